@@ -1,6 +1,7 @@
 import numpy as np
 import random
 import math
+import time
 from collections import namedtuple, deque
 from itertools import count
 
@@ -9,22 +10,237 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 
+# a batch of transitions, one row per transition; next_mask is the legal-action mask of next_state and done flags the
+# transitions whose next_state is terminal (their next_state and next_mask are left over from the game and never read)
 Transition = namedtuple('Transition',
-                        ('state', 'action', 'next_state', 'reward'))
+                        ('state', 'action', 'next_state', 'reward', 'next_mask', 'done'))
 
 class ReplayBuffer:
-    def __init__(self, capacity: int):
-        self.buffer = deque([], maxlen=capacity)
+    """
+    Ring buffer of transitions kept in preallocated tensors, so neither pushing nor sampling allocates Python objects.
 
-    def push(self, *args) -> None:
-        self.buffer.append(Transition(*args))
+    Fields:\n
+        states (capacity, state_size) float32\n
+        actions (capacity,) int64 index of the action taken\n
+        next_states (capacity, state_size) float32\n
+        rewards (capacity,) float32\n
+        next_masks (capacity, action_count) bool\n
+        dones (capacity,) bool
+    """
+
+    def __init__(self, capacity: int, state_size: int, action_count: int, device: torch.device | str = "cpu"):
+        self.capacity: int = capacity
+        self.device: torch.device = torch.device(device)
+
+        self.states: torch.Tensor = torch.zeros((capacity, state_size), dtype=torch.float32, device=self.device)
+        self.actions: torch.Tensor = torch.zeros((capacity,), dtype=torch.int64, device=self.device)
+        self.next_states: torch.Tensor = torch.zeros((capacity, state_size), dtype=torch.float32, device=self.device)
+        self.rewards: torch.Tensor = torch.zeros((capacity,), dtype=torch.float32, device=self.device)
+        self.next_masks: torch.Tensor = torch.zeros((capacity, action_count), dtype=torch.bool, device=self.device)
+        self.dones: torch.Tensor = torch.zeros((capacity,), dtype=torch.bool, device=self.device)
+
+        # the slot the next transition is written to and the number of slots holding a transition
+        self.head: int = 0
+        self.size: int = 0
+
+    def push(self, state, action: int, next_state, reward: float, next_mask, done: bool) -> None:
+        """Stores one transition; state, next_state and next_mask may be tensors or numpy arrays of a single row."""
+        i = self.head
+        self.states[i] = torch.as_tensor(state, device=self.device).reshape(-1)
+        self.actions[i] = action
+        self.next_states[i] = torch.as_tensor(next_state, device=self.device).reshape(-1)
+        self.rewards[i] = reward
+        self.next_masks[i] = torch.as_tensor(next_mask, device=self.device).reshape(-1)
+        self.dones[i] = done
+
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def push_batch(self, states, actions, next_states, rewards, next_masks, dones) -> None:
+        """Stores a batch of transitions, one per row of each argument, with one copy per field."""
+        batch_size = len(actions)
+        idxs = (self.head + torch.arange(batch_size, device=self.device)) % self.capacity
+        self.states[idxs] = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        self.actions[idxs] = torch.as_tensor(actions, dtype=torch.int64, device=self.device)
+        self.next_states[idxs] = torch.as_tensor(next_states, dtype=torch.float32, device=self.device)
+        self.rewards[idxs] = torch.as_tensor(rewards, dtype=torch.float32, device=self.device)
+        self.next_masks[idxs] = torch.as_tensor(next_masks, dtype=torch.bool, device=self.device)
+        self.dones[idxs] = torch.as_tensor(dones, dtype=torch.bool, device=self.device)
+
+        self.head = (self.head + batch_size) % self.capacity
+        self.size = min(self.size + batch_size, self.capacity)
+
+    def sample(self, batch_size: int) -> Transition:
+        """Samples batch_size transitions uniformly (with replacement) and returns them as a Transition of batched tensors."""
+        idxs = torch.randint(self.size, (batch_size,), device=self.device)
+        return Transition(self.states[idxs], self.actions[idxs], self.next_states[idxs], self.rewards[idxs], self.next_masks[idxs], self.dones[idxs])
 
-    def sample(self, batch_size: int) -> list[tuple]:
-        return random.sample(self.buffer, batch_size)
-    
     def __len__(self):
-        return len(self.buffer)
+        return self.size
     
+class SumTree:
+    """
+    Array-backed binary sum-tree over capacity leaves, kept in a single tensor: node i has children 2i and 2i + 1, the root
+    is node 1 and the leaves are nodes [leaf_count, 2 * leaf_count), where leaf_count is capacity rounded up to a power of 2.
+    Updates and searches work on whole batches of leaves, walking the tree one level at a time.
+    """
+
+    def __init__(self, capacity: int, device: torch.device | str = "cpu"):
+        self.depth: int = max(1, math.ceil(math.log2(capacity)))
+        self.leaf_count: int = 1 << self.depth
+        # float64 so that the running sums don't drift over millions of updates
+        self.nodes: torch.Tensor = torch.zeros((2 * self.leaf_count,), dtype=torch.float64, device=device)
+
+    def total(self) -> float:
+        return self.nodes[1].item()
+
+    def get(self, idxs: torch.Tensor) -> torch.Tensor:
+        return self.nodes[idxs + self.leaf_count]
+
+    def update(self, idxs: torch.Tensor, values: torch.Tensor) -> None:
+        """Sets the leaves idxs to values (the last value wins for repeated idxs) and recomputes their ancestors."""
+        # an indexed write with repeated indices may apply them in any order (notably on CUDA), so keep the value of the
+        # last occurrence of every leaf and write each leaf once
+        leaves, inverse = torch.unique(idxs, return_inverse=True)
+        positions = torch.arange(len(idxs), device=idxs.device)
+        last = torch.zeros_like(leaves).scatter_reduce_(0, inverse, positions, reduce="amax", include_self=False)
+        nodes = leaves + self.leaf_count
+        self.nodes[nodes] = values[last].to(self.nodes.dtype)
+        for _ in range(self.depth):
+            nodes = torch.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, values: torch.Tensor) -> torch.Tensor:
+        """Returns, for every value in [0, total), the leaf whose prefix-sum interval contains it."""
+        values = values.to(self.nodes.dtype)
+        nodes = torch.ones_like(values, dtype=torch.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.nodes[left]
+            go_right = values >= left_sums
+            values = torch.where(go_right, values - left_sums, values)
+            nodes = left + go_right
+        return nodes - self.leaf_count
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer sampling transition i with probability p_i^alpha / sum_j p_j^alpha, where p_i is its last absolute TD error
+    (new transitions get the largest priority seen so far, so they are sampled at least once).
+
+    sample draws one transition from each of batch_size equal slices of the priority mass and also returns the
+    importance-sampling weights (N * P(i))^-beta (normalized by the largest weight of the batch) along with the sampled
+    indices, which are passed back to update_priorities once the TD errors are known.
+    """
+
+    def __init__(self, capacity: int, state_size: int, action_count: int, device: torch.device | str = "cpu",
+                 alpha: float = 0.6, eps: float = 1e-3):
+        super().__init__(capacity, state_size, action_count, device)
+        self.alpha: float = alpha
+        self.eps: float = eps
+        self.max_priority: float = 1.0
+        self.tree: SumTree = SumTree(capacity, self.device)
+
+    def push(self, *args) -> None:
+        idxs = torch.tensor([self.head], device=self.device)
+        super().push(*args)
+        self.tree.update(idxs, torch.full((1,), self.max_priority ** self.alpha, device=self.device))
+
+    def push_batch(self, *args) -> None:
+        batch_size = len(args[1])
+        idxs = (self.head + torch.arange(batch_size, device=self.device)) % self.capacity
+        super().push_batch(*args)
+        self.tree.update(idxs, torch.full((batch_size,), self.max_priority ** self.alpha, device=self.device))
+
+    def sample(self, batch_size: int, beta: float = 0.4) -> tuple[Transition, torch.Tensor, torch.Tensor]:
+        total = self.tree.total()
+        segment = total / batch_size
+        values = (torch.arange(batch_size, device=self.device, dtype=torch.float64) + torch.rand(batch_size, device=self.device, dtype=torch.float64)) * segment
+        # rounding can push a value onto the (empty) leaves past the stored transitions
+        idxs = self.tree.find(values.clamp(max=total * (1 - 1e-12))).clamp(max=self.size - 1)
+
+        probs = self.tree.get(idxs) / total
+        weights = (self.size * probs).pow(-beta)
+        weights = (weights / weights.max()).to(torch.float32)
+
+        batch = Transition(self.states[idxs], self.actions[idxs], self.next_states[idxs], self.rewards[idxs], self.next_masks[idxs], self.dones[idxs])
+        return batch, weights, idxs
+
+    def update_priorities(self, idxs: torch.Tensor, td_errors: torch.Tensor) -> None:
+        priorities = td_errors.detach().abs().to(torch.float64) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max().item())
+        self.tree.update(idxs, priorities.pow(self.alpha))
+
+def _foreach_supported() -> bool:
+    """
+    Whether this torch build offers the fused multi-tensor ops torch._foreach_lerp_ and torch._foreach_copy_ with the
+    signatures TargetUpdater uses. They are private, so they may be missing or change between releases.
+    """
+    try:
+        targets, sources = [torch.zeros(2)], [torch.ones(2)]
+        torch._foreach_lerp_(targets, sources, 0.5)
+        torch._foreach_copy_(targets, sources)
+        return bool(targets[0].eq(1).all())
+    except (AttributeError, TypeError, RuntimeError):
+        return False
+
+_FOREACH: bool = _foreach_supported()
+
+class TargetUpdater:
+    """
+    Keeps a target network in step with a policy network, either with soft updates (target = tau * policy + (1 - tau) * target)
+    every update_freq calls to step, or with a hard copy of the policy weights every update_freq calls (mode "hard").
+
+    The parameter lists are gathered once, and every update is a single fused in-place multi-tensor op over all of them
+    when torch offers one (see _foreach_supported), or else an in-place lerp_ or copy_ per tensor.
+    update_count and update_time record the number of updates applied and the wall-clock seconds they took.
+    """
+
+    def __init__(self, policy_net: nn.Module, target_net: nn.Module, mode: str = "soft", tau: float = 0.005, update_freq: int = 1):
+        if mode not in ("soft", "hard"):
+            raise ValueError(f"Unknown target update mode {mode}")
+
+        self.mode: str = mode
+        self.tau: float = tau
+        self.update_freq: int = update_freq
+
+        self.policy_params: list[torch.Tensor] = [p.data for p in policy_net.parameters()]
+        self.target_params: list[torch.Tensor] = [p.data for p in target_net.parameters()]
+        self.policy_buffers: list[torch.Tensor] = list(policy_net.buffers())
+        self.target_buffers: list[torch.Tensor] = list(target_net.buffers())
+
+        self.steps: int = 0
+        self.update_count: int = 0
+        self.update_time: float = 0
+
+    def step(self) -> None:
+        self.steps += 1
+        if self.steps % self.update_freq != 0:
+            return
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            if _FOREACH:
+                if self.mode == "soft":
+                    torch._foreach_lerp_(self.target_params, self.policy_params, self.tau)
+                else:
+                    torch._foreach_copy_(self.target_params, self.policy_params)
+                if self.target_buffers:
+                    torch._foreach_copy_(self.target_buffers, self.policy_buffers)
+            else:
+                for target, policy in zip(self.target_params, self.policy_params):
+                    if self.mode == "soft":
+                        target.lerp_(policy, self.tau)
+                    else:
+                        target.copy_(policy)
+                for target, policy in zip(self.target_buffers, self.policy_buffers):
+                    target.copy_(policy)
+        self.update_time += time.perf_counter() - start
+        self.update_count += 1
+
+    def mean_update_time(self) -> float:
+        """The average wall-clock seconds per update so far."""
+        return self.update_time / self.update_count if self.update_count else 0
+
 class DQN(nn.Module):
     def __init__(self, state_size: int, action_count: int):
         super(DQN, self).__init__()
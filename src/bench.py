@@ -0,0 +1,244 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from typing import Any, Callable
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import torch
+
+from agent import DQN
+from coup.coup import Coup
+from coup.player import make_players
+from coup.recorder import GameRecorder
+from eval import Evaluator
+from train import Trainer
+
+
+REWARD_HYPERPARAMETERS: list[float] = [0.1, -0.05, 1, -0.5, 20]
+
+
+def measure(fn: Callable[[], int], repeats: int = 3) -> float:
+    """Runs fn (which returns the number of operations it performed) repeats times and returns the best rate per second."""
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        ops = fn()
+        best = max(best, ops / (time.perf_counter() - start))
+    return best
+
+
+def play_games(env: Coup, player_type: str, num_games: int, seed: int) -> tuple[int, int, int]:
+    """
+    Plays num_games games with random Q-values for the agent; returns the number of resets and steps performed, and the
+    number of turns played.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    steps = turns = 0
+    for i in range(num_games):
+        options = {'players' : make_players(player_type, env.player_count), 'agent_idx' : i % env.player_count, 'reward_hyperparameters' : REWARD_HYPERPARAMETERS}
+        env.reset(seed=seed + i, options=options)
+        while True:
+            _, _, terminated, truncated, _ = env.step(torch.rand(env.action_space.shape[0], generator=generator))
+            steps += 1
+            if terminated or truncated:
+                break
+        turns += env.round
+    return num_games, steps, turns
+
+
+def bench_env(player_types: list[str], player_counts: list[int], num_games: int, repeats: int) -> dict[str, float]:
+    """Coup.reset and Coup.step throughput for every player type and player count."""
+    results = {}
+    for player_type in player_types:
+        for n in player_counts:
+            env = Coup(n)
+
+            def reset() -> int:
+                for i in range(num_games):
+                    options = {'players' : make_players(player_type, n), 'agent_idx' : i % n, 'reward_hyperparameters' : REWARD_HYPERPARAMETERS}
+                    env.reset(seed=i, options=options)
+                return num_games
+
+            results[f"env/reset_per_sec/{player_type}/{n}"] = measure(reset, repeats)
+            results[f"env/steps_per_sec/{player_type}/{n}"] = measure(lambda: play_games(env, player_type, num_games, 0)[1], repeats)
+    return results
+
+
+def bench_encoding(player_counts: list[int], calls: int, repeats: int) -> dict[str, float]:
+    """Isolated costs of State.encode, Coup._encode_history and Coup._decode_action, on states taken from real games."""
+    results = {}
+    for n in player_counts:
+        env = Coup(n)
+        env.reset(seed=0, options={'players' : make_players("h", n), 'agent_idx' : 0, 'reward_hyperparameters' : REWARD_HYPERPARAMETERS})
+        # play a few turns so that the history buffer isn't empty
+        for _ in range(5):
+            _, _, terminated, truncated, _ = env.step(torch.rand(env.action_space.shape[0]))
+            if terminated or truncated:
+                env.reset(seed=1)
+        q_values = torch.rand(env.action_space.shape[0])
+
+        def encode() -> int:
+            for _ in range(calls):
+                env.game_state.encode(env.agent_idx, n)
+            return calls
+
+        def encode_history() -> int:
+            for _ in range(calls):
+                env._encode_history()
+            return calls
+
+        def decode_action() -> int:
+            for _ in range(calls):
+                env._decode_action(q_values)
+            return calls
+
+        results[f"encoding/state_encode_per_sec/{n}"] = measure(encode, repeats)
+        results[f"encoding/encode_history_per_sec/{n}"] = measure(encode_history, repeats)
+        results[f"encoding/decode_action_per_sec/{n}"] = measure(decode_action, repeats)
+    return results
+
+
+def bench_bots(player_types: list[str], player_counts: list[int], num_games: int, repeats: int) -> dict[str, float]:
+    """
+    Coup.simulate_games throughput, in games and turns, with bots in every seat, and the turns per second of the same
+    bots with an agent seat taking random Q-values through Coup.reset and Coup.step, which simulate_games speeds up by
+    simulation_speedup times.
+    """
+    results = {}
+    for player_type in player_types:
+        for n in player_counts:
+            env = Coup(n)
+            players = make_players(player_type, n)
+            results[f"bots/simulated_games_per_sec/{player_type}/{n}"] = measure(lambda: sum(1 for _ in env.simulate_games(players, num_games, 0)), repeats)
+            results[f"bots/simulated_turns_per_sec/{player_type}/{n}"] = measure(lambda: sum(outcome.rounds for outcome in env.simulate_games(players, num_games, 0)), repeats)
+            results[f"bots/stepped_turns_per_sec/{player_type}/{n}"] = measure(lambda: play_games(env, player_type, num_games, 0)[2], repeats)
+            results[f"bots/simulation_speedup/{player_type}/{n}"] = results[f"bots/simulated_turns_per_sec/{player_type}/{n}"] / results[f"bots/stepped_turns_per_sec/{player_type}/{n}"]
+    return results
+
+
+def bench_recorder(player_types: list[str], player_counts: list[int], num_games: int, repeats: int) -> dict[str, float]:
+    """
+    Coup.simulate_games throughput in turns with a GameRecorder attached, and as a percentage of the throughput without
+    one (100 minus it is the recorder's overhead). The runs with and without a recorder alternate, and the percentage is
+    the median over the pairs of runs, so that it holds up under a varying load on the machine.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for player_type in player_types:
+            for n in player_counts:
+                players = make_players(player_type, n)
+                plain = Coup(n)
+                with GameRecorder(os.path.join(directory, f"{player_type}_{n}")) as recorder:
+                    recorded = Coup(n, recorder=recorder)
+                    recorded_rates, ratios = [], []
+                    for _ in range(repeats):
+                        plain_rate = measure(lambda: sum(outcome.rounds for outcome in plain.simulate_games(players, num_games, 0)), 1)
+                        recorded_rates.append(measure(lambda: sum(outcome.rounds for outcome in recorded.simulate_games(players, num_games, 0)), 1))
+                        ratios.append(recorded_rates[-1] / plain_rate)
+                results[f"recorder/simulated_turns_per_sec/{player_type}/{n}"] = max(recorded_rates)
+                results[f"recorder/relative_throughput_pct/{player_type}/{n}"] = 100 * statistics.median(ratios)
+    return results
+
+
+def bench_training(player_counts: list[int], updates: int, eval_games: int, repeats: int) -> dict[str, float]:
+    """Trainer.optimize_model updates/sec on a full replay buffer and Evaluator.eval games/sec."""
+    results = {}
+    for n in player_counts:
+        torch.manual_seed(0)
+        trainer = Trainer(Coup(n))
+        memory = trainer.memory
+        size = memory.capacity
+        memory.push_batch(torch.rand(size, trainer.state_size), torch.randint(trainer.action_count, (size,)), torch.rand(size, trainer.state_size),
+                          torch.rand(size), torch.ones(size, trainer.action_count, dtype=torch.bool), torch.rand(size) < 0.05)
+
+        def optimize() -> int:
+            for _ in range(updates):
+                trainer.optimize_model()
+                trainer.target_updater.step()
+            return updates
+
+        results[f"training/updates_per_sec/{n}"] = measure(optimize, repeats)
+
+        model = DQN(trainer.state_size, trainer.action_count)
+        for batch_size in (1, 32):
+            def evaluate() -> int:
+                evaluator = Evaluator(Coup(n), model)
+                evaluator.eval(eval_games, "h", display=False, batch_size=batch_size, seed=0)
+                return evaluator.games_played
+
+            results[f"training/eval_games_per_sec/batch_{batch_size}/{n}"] = measure(evaluate, repeats)
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    """
+    Returns a line for every metric of results that fell more than tolerance (a fraction) below its baseline value. Every
+    metric is a rate, so higher is better.
+    """
+    regressions = []
+    for name, value in results.items():
+        if name in baseline and value < baseline[name] * (1 - tolerance):
+            regressions.append(f"{name}: {value:.1f} vs {baseline[name]:.1f} ({100 * (value / baseline[name] - 1):+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the Coup engine and the training loop.')
+    parser.add_argument('--suites', '-s', type=str, default="env,encoding,bots,recorder,training", help='comma-separated suites to run: env, encoding, bots, recorder, training')
+    parser.add_argument('--player_counts', '-n', type=str, default="2,3,4,5,6", help='comma-separated player counts')
+    parser.add_argument('--player_types', '-p', type=str, default="r,g,h,p", help='comma-separated opponent types: r(andom), g(reedy), h(euristic), p(irate)')
+    parser.add_argument('--quick', '-q', action='store_true', help='run fewer iterations per measurement')
+    parser.add_argument('--repeats', '-r', type=int, default=3, help='the number of times each measurement is repeated (the best rate is kept)')
+    parser.add_argument('--output', '-o', type=str, default="bench.json", help='the path of the JSON file to write the results to')
+    parser.add_argument('--baseline', '-b', type=str, default=None, help='the path of a previous results file to compare against')
+    parser.add_argument('--tolerance', '-t', type=float, default=0.1, help='the fraction a metric may fall below its baseline before it is flagged')
+
+    args = parser.parse_args()
+    suites = args.suites.split(",")
+    player_counts = [int(n) for n in args.player_counts.split(",")]
+    player_types = args.player_types.split(",")
+    scale = 0.1 if args.quick else 1
+
+    results = {}
+    if "env" in suites:
+        results.update(bench_env(player_types, player_counts, max(1, int(200 * scale)), args.repeats))
+    if "encoding" in suites:
+        results.update(bench_encoding(player_counts, max(1, int(20000 * scale)), args.repeats))
+    if "bots" in suites:
+        results.update(bench_bots(player_types, player_counts, max(1, int(200 * scale)), args.repeats))
+    if "recorder" in suites:
+        results.update(bench_recorder(player_types, player_counts, max(1, int(200 * scale)), args.repeats))
+    if "training" in suites:
+        results.update(bench_training(player_counts, max(1, int(200 * scale)), max(1, int(200 * scale)), args.repeats))
+
+    for name, value in results.items():
+        print(f"{name}: {value:.1f}")
+
+    report: dict[str, Any] = {
+        'meta' : {'time' : time.strftime("%Y-%m-%dT%H:%M:%S"), 'python' : sys.version.split()[0], 'numpy' : np.__version__,
+                  'torch' : torch.__version__, 'platform' : platform.platform(), 'quick' : args.quick},
+        'results' : results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(line)
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+if __name__ == '__main__':
+    main()
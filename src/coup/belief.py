@@ -0,0 +1,138 @@
+from typing import Sequence
+
+from coup.representations import Action, Counter, DiscardPair, Event, State
+from coup.utils import ACTION_IDX_BLOCKER, ACTION_IDX_CARD
+
+
+class BeliefTracker:
+    """
+    What the public events of a game say about the cards of each player, kept up to date incrementally by the Coup env
+    (see Coup(track_beliefs=True)) and shared through State.belief by every player of the game.
+
+    Per seat, it keeps the unchallenged claims made with the current hand (actions and blocks), the roles proven by
+    winning a challenge (one card each, kept as the engine doesn't redraw them), the roles ruled out by a lost challenge,
+    and the number of cards held. Hands are forgotten when their owner exchanges. Across seats, it keeps the copies of each role
+    not yet seen, out of 3, after revealed discards and proven cards.
+
+    Every update and query is O(1) in the length of the game (see probability).
+    """
+
+    # the chance that a player who doesn't hold a card claims it, relative to one who does
+    bluff_rate: float = 0.3
+
+    def __init__(self, player_count: int) -> None:
+        self.player_count: int = player_count
+        self.reset()
+
+    def reset(self) -> None:
+        n = self.player_count
+        self.claims: list[list[int]] = [[0] * 5 for _ in range(n)]
+        self.proven: list[list[int]] = [[0] * 5 for _ in range(n)]
+        # bit r is set when the seat is known not to hold a card of role r
+        self.excluded: list[int] = [0] * n
+        self.hand_sizes: list[int] = [2] * n
+        self.discard_counts: list[int] = [0] * n
+        # copies of each role neither revealed nor proven
+        self.unseen: list[int] = [3] * 5
+        # the latest action, i.e. the one being countered during the counter phases
+        self.action_type: int = -1
+        self.actor: int = -1
+
+    def observe(self, event: Event, state: State) -> None:
+        """Takes in an event as the engine appends it to the history."""
+        if isinstance(event, Action):
+            self.action_type = event.type
+            self.actor = state.seat_of[event.active_player]
+            card = ACTION_IDX_CARD.get(event.type)
+            if card is not None:
+                self.claims[self.actor][card] += 1
+        elif isinstance(event, Counter):
+            if event.attempted and event.counter_1 and not event.challenge:
+                seat = state.seat_of[event.active_player]
+                for card in ACTION_IDX_BLOCKER[self.action_type]:
+                    self.claims[seat][card] += 1
+        elif isinstance(event, DiscardPair):
+            # the cards drawn and returned are private, so nothing is known of the new hand
+            self._forget(event.active_player_idx)
+
+    def challenged(self, seat: int, cards: Sequence[int], proven_card: int) -> None:
+        """
+        Takes in the outcome of a challenge of a claim by seat of one of cards: proven_card is the card it showed, or -1
+        if it was bluffing.
+        """
+        if proven_card >= 0 and self.action_type == 3 and seat == self.actor:
+            # an exchanger shows its ambassador, then shuffles it with the cards it draws
+            return
+        if proven_card < 0:
+            for card in cards:
+                self.excluded[seat] |= 1 << card
+                self.claims[seat][card] = 0
+        elif self.proven[seat][proven_card] == 0:
+            # showing the same role twice doesn't prove a second copy
+            self.proven[seat][proven_card] = 1
+            self.unseen[proven_card] -= 1
+
+    def end_turn(self, state: State) -> None:
+        """Takes in the cards discarded during the turn that just ended."""
+        for seat in range(self.player_count):
+            count = self.discard_counts[seat]
+            while count < state.discard_counts[seat]:
+                card = state.discards[2 * seat + count]
+                if self.proven[seat][card] > 0:
+                    self.proven[seat][card] -= 1
+                else:
+                    self.unseen[card] -= 1
+                self.hand_sizes[seat] -= 1
+                count += 1
+            self.discard_counts[seat] = count
+
+    def probability(self, seat: int, cards: Sequence[int], observer: int = -1, hand: Sequence[int] = ()) -> float:
+        """
+        Returns the probability that seat holds at least one of cards, as seen by the player in observer (-1 for an
+        outside observer) holding hand.
+
+        The cards of seat that aren't proven are a uniform draw from the unseen copies that observer doesn't hold, except
+        for the roles seat is known not to hold, and each unchallenged claim of one of cards weighs that draw by
+        1 / bluff_rate if seat holds one of them.
+        """
+        proven = self.proven[seat]
+        unknown = self.hand_sizes[seat] - sum(proven)
+        for card in cards:
+            if proven[card] > 0:
+                return 1.0
+        if unknown <= 0:
+            return 0.0
+
+        excluded = self.excluded[seat]
+        own = self.proven[observer] if observer >= 0 else None
+        total = hits = 0
+        for card in range(5):
+            if excluded >> card & 1:
+                continue
+            copies = self.unseen[card]
+            if own is not None:
+                # the observer's proven cards are out of unseen already
+                copies -= hand.count(card) - own[card]
+            total += copies
+            if card in cards:
+                hits += copies
+        if hits <= 0 or total < unknown:
+            return 0.0
+
+        # hypergeometric chance of drawing none of the hits in unknown cards
+        miss = 1.0
+        for i in range(unknown):
+            miss *= max(total - hits - i, 0) / (total - i)
+        prior = 1.0 - miss
+        claims = max(self.claims[seat][card] for card in cards)
+        if claims == 0 or prior >= 1.0:
+            return prior
+        return prior / (prior + (1.0 - prior) * self.bluff_rate ** claims)
+
+    def _forget(self, seat: int) -> None:
+        proven = self.proven[seat]
+        for card in range(5):
+            self.unseen[card] += proven[card]
+            proven[card] = 0
+            self.claims[seat][card] = 0
+        self.excluded[seat] = 0
@@ -1,21 +1,67 @@
 import gymnasium as gym
 import numpy as np
 from gymnasium import spaces
-import random
-from typing import Any
+from typing import Any, Callable, Iterator, NamedTuple
 import torch
-
-from coup.representations import Action, Counter, State, Event, DiscardPair, Player
+from array import array
+
+from coup.representations import Action, Counter, State, StateStorage, Event, DiscardPair, Player
+from coup.encoding import DISCARD_PAIRS, EXCHANGE_PAIR_MASKS, EventEncoder, get_encoder
+from coup.rng import BlockRandom
+from coup.instrumentation import InstrumentedPlayer, Timings
+from coup.recorder import GameRecorder
+from coup.belief import BeliefTracker
 from coup.player import HeuristicPlayer
 from coup.utils import *
 
 
+# placeholders for the per-turn scratch of Coup before the current turn has an action, counter or discard pair
+NO_ACTION: Action = Action('', '', -2)
+NO_COUNTER_1: Counter = Counter('', False, False, True)
+NO_COUNTER_2: Counter = Counter('', False, False, False)
+NO_DISCARD_PAIR: list[int] = []
+# _EMPTY_SLOTS[k] pads k empty slots of a snapshot (see Coup.snapshot)
+_EMPTY_SLOTS: tuple[tuple[int, ...], ...] = tuple((-1,) * k for k in range(8))
+# the agent_idx of an env playing bots against each other (see Coup.simulate_games)
+NO_AGENT: int = -1
+
+
+class GameOutcome(NamedTuple):
+    """The result of a game played by Coup.simulate_games, with seats in the order of the players given."""
+    winner: int  # the seat of the winner, -1 if the game was truncated
+    rounds: int  # the number of turns played
+    start_hands: tuple[tuple[int, ...], ...]  # the cards dealt to each seat
+    action_counts: tuple[tuple[int, ...], ...]  # the number of turns each seat played with each action type
+
+
+class InvalidPhaseError(ValueError):
+    """Raised when a Coup env is in a phase that is not one of the phases in PHASE_NAMES."""
+
+    def __init__(self, phase: int) -> None:
+        super().__init__(f"invalid phase: {phase!r}")
+        self.phase = phase
+
+
 class Coup(gym.Env):
     """
     Simulates the game of Coup following the gym interface.  
     """
 
-    def __init__(self, player_count: int, round_cap: int = 100, history_length = 10) -> None:
+    def __init__(self, player_count: int, round_cap: int = 100, history_length = 10, mask_observation: bool = False, instrument: bool = False,
+                 recorder: GameRecorder | None = None, track_beliefs: bool = False) -> None:
+        """
+        mask_observation: if True, the legal-action mask of the agent's current decision (see _action_mask) is appended to
+        every observation.
+
+        instrument: if True, the wall time and call count of every phase and engine component are accumulated and can be
+        read with stats(). Instrumentation wraps the methods involved once, so a plain env pays nothing for it.
+
+        recorder: if given, every game played is streamed to it turn by turn (see GameRecorder).
+
+        track_beliefs: if True, a BeliefTracker follows the public events of every game and is shared with the players
+        as State.belief.
+        """
+
         super().__init__()
 
         action_count: int = 4 + 3 * (player_count - 1)  # 4 solo actions, 3 targeted actions
@@ -30,12 +76,58 @@ class Coup(gym.Env):
         history_dim: int = (35 + 6 * player_count) * history_length  # provides last batch of events
 
         observation_dim: int = game_state_dim + history_dim
+        if mask_observation:
+            observation_dim += action_dim
 
         self.action_space = spaces.Box(low=0, high=1, shape=(action_dim,), dtype=np.float32)
         self.observation_space = spaces.Box(low=0, high=1, shape=(observation_dim,), dtype=np.float32)
         self.player_count: int = player_count
         self.round_cap: int = round_cap
         self.history_length: int = history_length
+        self.mask_observation: bool = mask_observation
+        # the generator behind every random draw of a game, including the bots' (see reset)
+        self.rng: BlockRandom = BlockRandom()
+        self.action_mask: np.ndarray[bool] = np.zeros((action_dim,), dtype=bool)
+        self.encoder: EventEncoder = get_encoder(player_count)
+        self.event_dim: int = self.encoder.event_dim
+
+        # each turn is encoded once, into rows head and head + history_length, with head moving backwards so that
+        # history_buffer[head : head + history_length] always lists the most recent turn first
+        self.history_buffer: np.ndarray[np.float32] = np.zeros((2 * history_length, self.event_dim), dtype=np.float32)
+        self.history_head: int = 0
+        # whether the events of the game are appended to self.history (see simulate_games, which skips them when nobody
+        # reads them)
+        self.keep_history: bool = True
+        # the caller-owned array observations are written into, if any (see set_observation_buffer)
+        self.observation_buffer: np.ndarray[np.float32] | None = None
+        # the buffers every game keeps its state in, if any (see set_state_storage): the caller's, or the recorder's, which
+        # lays the state out as its records do
+        self.state_storage: StateStorage | None = recorder.state_storage(player_count) if recorder is not None else None
+
+        # per-turn scratch, reset at the start of every action phase (see _run_action_phase)
+        self.current_action: Action = NO_ACTION
+        self.current_counter_1: Counter = NO_COUNTER_1
+        self.current_counter_2: Counter = NO_COUNTER_2
+        self.current_discard: dict[int, int] = {}  # maps the seat of each discarder to the index of their discarded card
+        self.current_discard_pair: list[int] = NO_DISCARD_PAIR
+        self.current_discarders: list[int] = []
+        self.current_counter_1_queried: list[int] = []
+        self.current_counter_2_queried: list[int] = []
+
+        # indexed by phase
+        self._phase_handlers: tuple[Callable[[], bool], ...] = (self._run_action_phase, self._run_counter_1_phase, self._run_counter_2_phase,
+                                                                self._run_discard_phase, self._run_discard_pair_phase)
+        self._phase_transitions: tuple[Callable[[], None], ...] = (self._action_phase_transition, self._counter_1_phase_transition, self._counter_2_phase_transition,
+                                                                   self._discard_phase_transition, self._discard_pair_phase_transition)
+
+        # the length of the arrays returned by snapshot: the State, then 20 values of turn scratch and the 2 queried lists
+        self.snapshot_size: int = 9 * player_count + 7 + 20 + 2 * (player_count - 1)
+
+        self.recorder: GameRecorder | None = recorder
+        self.belief: BeliefTracker | None = BeliefTracker(player_count) if track_beliefs else None
+        self.timings: Timings | None = None
+        if instrument:
+            self._instrument()
 
     def step(self, action: np.ndarray[np.float32]) -> tuple[np.ndarray[np.float32], np.float32, bool, bool, dict[str, Any]]:
         gs: State = self.game_state
@@ -44,60 +136,273 @@ class Coup(gym.Env):
 
         self._run_phase_transition()
 
-        terminated = (self.players[self.agent_idx] not in gs.players) or (len(gs.players) == 1)
+        terminated = (not gs.is_alive(self.agent_idx)) or (gs.alive_count() == 1)
         if not terminated:
             self._run_game_until_input()
 
+        self.action_mask = self._action_mask()
         observation = self._observation()
         reward = self._reward()
-        terminated = (self.players[self.agent_idx] not in gs.players) or (len(gs.players) == 1)
+        terminated = (not gs.is_alive(self.agent_idx)) or (gs.alive_count() == 1)
         truncated = self.round > self.round_cap
-        info = {'action' : action_idx}
+        info = {'action' : action_idx, 'action_mask' : self.action_mask}
+        if self.recorder is not None and (terminated or truncated):
+            self.recorder.end_game(gs, self.round, truncated)
 
         return observation, reward, terminated, truncated, info
 
     def reset(self, seed: int | None = None, options: dict[str, Any] | None = None) -> tuple[np.ndarray[np.float32], dict[str, Any]]:
         """
+        seed: if given, restarts the env's generator (self.rng) from seed, which then determines the deal, the exchanges and
+        the bots' decisions of this game and of every following game reset without a seed.
+
         options:
         - 'players': specifices the agents to use as opponents
-        - 'agent_idx': specifies which player the RL agent is
+        - 'agent_idx': specifies which player the RL agent is; if missing or None, it is drawn from self.rng (after seeding)
         - 'reward_hyperparameters': specifies the values of features to be rewarded
             * number of agent's coins
             * number of opponents' coins
             * number of agent's cards
             * number of opponents' cards
             * value of winning
+        - 'agent_cards' (optional): the starting hand of the RL agent, drawn from the deck if not given
 
         usage:
             options = {'players': [GreedyPlayer(f"Player {i+1}") for i in range(self.player_count)], 'agent_idx': 0}
         """
 
+        if seed is not None:
+            self.rng.seed(seed)
+
         if options == None:
             self.players: list[Player] = [HeuristicPlayer(f"Player {i + 1}") for i in range(self.player_count)]
-            self.agent_idx: int = random.choice(list(range(self.player_count)))
+            self.agent_idx: int = self.rng.randrange(self.player_count)
             self.reward_hyperparameters: list[int] = [0.1, -0.05, 1, -0.5, 20]
         else:
             self.players: list[Player] = options['players']
-            self.agent_idx: int = options['agent_idx']
+            agent_idx = options.get('agent_idx')
+            self.agent_idx: int = agent_idx if agent_idx is not None else self.rng.randrange(self.player_count)
             self.reward_hyperparameters: list[int] = options['reward_hyperparameters']
 
-        self.game_state: State = State(self.players)
+        agent_cards = options.get('agent_cards') if options is not None else None
+        seats = self.players if self.timings is None else [InstrumentedPlayer(player, self.timings) for player in self.players]
+        self.game_state: State = State(seats, None if agent_cards is None else {self.agent_idx : agent_cards}, self.rng, self.state_storage)
+        if self.belief is not None:
+            self.belief.reset()
+            self.game_state.belief = self.belief
+        if self.recorder is not None:
+            self.recorder.start_game(self)
         self.history: list[Event] = []
-        self.phase: str = "action"
+        self.history_buffer[:] = 0
+        self.history_head = 0
+        self.keep_history = True
+        self.phase: int = ACTION_PHASE
 
         self.round: int = 0
 
         self._run_game_until_input()
 
+        self.action_mask = self._action_mask()
         observation = self._observation()
-        info = {}
+        info = {'action_mask' : self.action_mask}
 
         return observation, info
 
+    def config(self) -> dict[str, Any]:
+        """
+        Returns the constructor arguments of an env that plays the same games as this one with the same observations, e.g.
+        Coup(**env.config()). The recorder and the instrumentation belong to this env, and are left out.
+        """
+
+        return {'player_count' : self.player_count, 'round_cap' : self.round_cap, 'history_length' : self.history_length,
+                'mask_observation' : self.mask_observation, 'track_beliefs' : self.belief is not None}
+
+    def set_observation_buffer(self, out: np.ndarray[np.float32] | torch.Tensor | None) -> None:
+        """
+        Makes reset and step write their observations in place into out and return it (as a NumPy view for a tensor),
+        rather than a new array each. out is a float32 array or CPU tensor of observation_dim contiguous entries owned by
+        the caller, e.g. a row of a batch buffer; a tensor shares its memory with the env (see torch.from_numpy), so the
+        observations reach a network without a copy. Every reset and step overwrites out, so copy an observation that
+        needs to outlive the next one.
+
+        None goes back to a new array per observation.
+        """
+
+        if out is not None:
+            if isinstance(out, torch.Tensor):
+                out = out.numpy()
+            if out.dtype != np.float32 or out.size != self.observation_space.shape[0] or not out.flags.c_contiguous:
+                raise ValueError(f"observation buffer must be {self.observation_space.shape[0]} contiguous float32 entries")
+            out = out.reshape(-1)
+        self.observation_buffer = out
+
+    def set_state_storage(self, storage: StateStorage | None) -> None:
+        """
+        Makes every following game keep its coins, hands, discards and deck in storage, buffers owned by the caller (e.g.
+        rows of the arrays of a VecCoup), rather than in arrays of its own, so that they can be read without a copy. The
+        game in progress keeps its own. None goes back to new arrays per game.
+        """
+
+        self.state_storage = storage
+
+    def simulate_games(self, players: list[Player], num_games: int, seed: int | None = None) -> Iterator[GameOutcome]:
+        """
+        Plays num_games games among players (bots, in seat order) with no agent seat and yields the outcome of each as it
+        ends. Observations, rewards and the history encoding are skipped, and so are the events of self.history unless a
+        player reads them (see Player.reads_history) or the recorder or the belief tracker needs them. This plays 3-5x as
+        many turns per second as stepping the env (see the bots suite of bench.py); the bots' own decisions are most of
+        what is left. Games longer than round_cap turns are truncated.
+
+        seed: as in reset, restarts self.rng before the first game.
+
+        The games replace any game in progress: reset the env before stepping it again, and don't step it while iterating.
+        Attached recorders and instrumentation see these games as usual, with an agent_idx of NO_AGENT.
+        """
+
+        assert len(players) == self.player_count, f"expected {self.player_count} players, got {len(players)}"
+        if seed is not None:
+            self.rng.seed(seed)
+
+        n: int = self.player_count
+        self.players = players
+        self.agent_idx = NO_AGENT
+        # the recorder reads the cards drawn by an exchange off the last event, and the belief tracker observes every event
+        self.keep_history = self.recorder is not None or self.belief is not None or any(player.reads_history for player in players)
+        seats = players if self.timings is None else [InstrumentedPlayer(player, self.timings) for player in players]
+        phase_handlers = self._phase_handlers
+
+        for _ in range(num_games):
+            gs: State = State(seats, None, self.rng, self.state_storage)
+            self.game_state = gs
+            if self.belief is not None:
+                self.belief.reset()
+                gs.belief = self.belief
+            if self.recorder is not None:
+                self.recorder.start_game(self)
+            self.history = []
+            self.phase = ACTION_PHASE
+            self.round = 0
+
+            start_hands = tuple(tuple(gs.cards(seat)) for seat in range(n))
+            counts: list[int] = [0] * (7 * n)
+            # every handler runs its phase transition (no seat waits for the agent), and a turn ends with round moving on
+            while gs.alive_count() > 1 and self.round <= self.round_cap:
+                if not 0 <= self.phase < len(phase_handlers):
+                    raise InvalidPhaseError(self.phase)
+                round = self.round
+                phase_handlers[self.phase]()
+                if self.round != round:
+                    action = self.current_action
+                    counts[7 * gs.seat_of[action.active_player] + action.type] += 1
+
+            truncated = gs.alive_count() > 1
+            if self.recorder is not None:
+                self.recorder.end_game(gs, self.round, truncated)
+            yield GameOutcome(-1 if truncated else gs.alive.bit_length() - 1, self.round, start_hands,
+                              tuple(tuple(counts[7 * seat : 7 * seat + 7]) for seat in range(n)))
+
+    def snapshot(self) -> array:
+        """
+        Returns the position of the current game as a flat int8 array of snapshot_size values: the State (see
+        State.snapshot), the phase, the round, and the turn in flight, i.e. the action, both counters, the discards chosen,
+        the pair returned by an exchange, the discarders and the seats queried for each counter. Players are stored by
+        seat, and empty slots are -1. restore brings the env back to that position in a few microseconds, so that search
+        players can branch from it many times over.
+
+        The event history, the history buffer, the belief tracker and the rng are not captured; restoring leaves them as
+        they are.
+        """
+
+        gs: State = self.game_state
+        seat_of = gs.seat_of
+        action = self.current_action
+        counter_1 = self.current_counter_1
+        counter_2 = self.current_counter_2
+        discard = [value for item in self.current_discard.items() for value in item]
+        discarders = self.current_discarders
+        queried_1 = self.current_counter_1_queried
+        queried_2 = self.current_counter_2_queried
+        pad = self.player_count - 1
+
+        snapshot = gs.snapshot()
+        snapshot.extend([self.phase, self.round % 128, self.round // 128,
+                         seat_of.get(action.active_player, -1), action.type, seat_of.get(action.target_player, -1),
+                         seat_of.get(counter_1.active_player, -1), counter_1.attempted, counter_1.challenge,
+                         seat_of.get(counter_2.active_player, -1), counter_2.attempted, counter_2.challenge,
+                         *discard, *_EMPTY_SLOTS[4 - len(discard)], *(self.current_discard_pair or _EMPTY_SLOTS[2]),
+                         *discarders, *_EMPTY_SLOTS[2 - len(discarders)],
+                         *queried_1, *_EMPTY_SLOTS[pad - len(queried_1)], *queried_2, *_EMPTY_SLOTS[pad - len(queried_2)]])
+        return snapshot
+
+    def restore(self, snapshot: array) -> None:
+        """Returns the current game to the position snapshot was taken at (see snapshot)."""
+
+        gs: State = self.game_state
+        gs.restore(snapshot)
+        names = gs.names
+        start = gs.snapshot_size
+        (phase, round_low, round_high, actor, action_type, target, counter_1_seat, counter_1_attempted, counter_1_challenge,
+         counter_2_seat, counter_2_attempted, counter_2_challenge, discard_seat_1, discard_1, discard_seat_2, discard_2,
+         pair_1, pair_2, discarder_1, discarder_2) = snapshot[start:start + 20]
+        queried = snapshot[start + 20:]
+        pad = self.player_count - 1
+
+        self.phase = phase
+        self.round = round_low + 128 * round_high
+        self.current_action = NO_ACTION if actor < 0 else interned_action(names[actor], names[target], action_type)
+        self.current_counter_1 = NO_COUNTER_1 if counter_1_seat < 0 else interned_counter(names[counter_1_seat], counter_1_attempted == 1, counter_1_challenge == 1, True)
+        self.current_counter_2 = NO_COUNTER_2 if counter_2_seat < 0 else interned_counter(names[counter_2_seat], counter_2_attempted == 1, counter_2_challenge == 1, False)
+        self.current_discard.clear()
+        if discard_seat_1 >= 0:
+            self.current_discard[discard_seat_1] = discard_1
+        if discard_seat_2 >= 0:
+            self.current_discard[discard_seat_2] = discard_2
+        self.current_discard_pair = NO_DISCARD_PAIR if pair_1 < 0 else [pair_1, pair_2]
+        self.current_discarders[:] = [seat for seat in (discarder_1, discarder_2) if seat >= 0]
+        self.current_counter_1_queried[:] = [seat for seat in queried[:pad] if seat >= 0]
+        self.current_counter_2_queried[:] = [seat for seat in queried[pad:] if seat >= 0]
+        if self.agent_idx != NO_AGENT:
+            # the agent's pending decision is decoded against the mask of the restored position (see _decode_action)
+            self.action_mask = self._action_mask()
 
     def render(self) -> None:
         pass
 
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Returns the timings accumulated since the env was created (or since clear_stats) as
+        {key: {'time': seconds, 'calls': count, 'mean': seconds per call}}, or {} if the env isn't instrumented.
+
+        Keys are 'phase/<phase name>' for the phase handlers (including the bot decisions and phase transitions they run),
+        'policy/<method>' for the bots' decisions, and 'engine/<component>' for observation encoding, history encoding,
+        legal-action masks, action decoding and phase transitions. Nested entries overlap, e.g. a transition's time is
+        also part of the time of the phase that ran it.
+        """
+        return self.timings.snapshot() if self.timings is not None else {}
+
+    def clear_stats(self) -> None:
+        if self.timings is not None:
+            self.timings.clear()
+
+    def _instrument(self) -> None:
+        """Replaces the phase handlers and engine components of this env with timed wrappers (see stats)."""
+        timings = self.timings = Timings()
+
+        self._observation = timings.timed(self._observation, "engine/observation")
+        self._append_history = timings.timed(self._append_history, "engine/append_history")
+        self._action_mask = timings.timed(self._action_mask, "engine/action_mask")
+        self._decode_action = timings.timed(self._decode_action, "engine/decode_action")
+
+        transitions = []
+        for transition in self._phase_transitions:
+            # handlers call their transition by name, so the instance attribute has to be replaced as well
+            timed_transition = timings.timed(transition, "engine/transition")
+            setattr(self, transition.__name__, timed_transition)
+            transitions.append(timed_transition)
+        self._phase_transitions = tuple(transitions)
+
+        self._phase_handlers = tuple(timings.timed(handler, f"phase/{PHASE_NAMES[phase]}") for phase, handler in enumerate(self._phase_handlers))
+
     def close(self) -> None:
         pass
 
@@ -107,7 +412,7 @@ class Coup(gym.Env):
 
         Modifies self.game_state, self.history, self.phase
 
-        self.phase is one of the following: "action", "counter_1", "counter_2", "discard", or "discard_pair"
+        self.phase is one of the following (see PHASE_NAMES): ACTION_PHASE, COUNTER_1_PHASE, COUNTER_2_PHASE, DISCARD_PHASE, or DISCARD_PAIR_PHASE
 
         action: get action_action from current player
         counter_1: get action_counter_1 from all players besides current player (stop if dispute or block)
@@ -116,257 +421,309 @@ class Coup(gym.Env):
         discard_pair: get action_keep from player who exchanged successfully
         """
 
-        if (self.players[self.agent_idx] not in self.game_state.players) or (len(self.game_state.players) == 1):
-            return
-        
         gs: State = self.game_state
-        
-        if self.phase == "action":
-            self.current_action: Action = Action('', '', -2)
-            self.current_counter_1: Counter = Counter('', False, False, True)
-            self.current_counter_2: Counter = Counter('', False, False, False)
-            self.current_discard: list[tuple[Player, int]] = []
-            self.current_discard_pair: list[int] = []
-            self.current_discarders: list[Player] = []
-            self.current_counter_1_queried: list[Player] = []
-            self.current_counter_2_queried: list[Player] = []
-
-            if self._decision_is_agent(gs.current_player): 
-                return 
-            else:
-                self.current_action = gs.current_player.get_action(self.game_state, self.history, generate_valid_actions(gs.current_player, gs.players, gs.player_coins, gs.player_cards))
-                self._action_phase_transition()
-            
-        elif self.phase == "counter_1":
-            for player in [p for p in gs.players if p.name != gs.current_player.name]:
-                if player in self.current_counter_1_queried: continue
-                self.current_counter_1_queried.append(player)
-                if self._decision_is_agent(player):
-                    return 
-                else:
-                    potential_counter_1 = player.get_counter(self.current_action, self.game_state, self.history, generate_valid_counters(player.name, self.current_action))
-                    if potential_counter_1.attempted:
-                        self.current_counter_1 = potential_counter_1
-                        break
-            self._counter_1_phase_transition()
-
-        elif self.phase == "counter_2":
-
-            for player in [p for p in gs.players if p.name != self.current_counter_1.active_player]:
-                if player in self.current_counter_2_queried: continue
-                self.current_counter_2_queried.append(player)
-                if self._decision_is_agent(player):
-                    return
-                else:
-                    action = Action(self.current_counter_1.active_player, self.current_counter_1.active_player, -1)
-                    potential_counter_2 = player.get_counter(action, self.game_state, self.history, generate_valid_counters(player.name, action), action_is_block=True)
-                    if potential_counter_2.attempted:
-                        self.current_counter_2 = potential_counter_2
-                        break
-            self._counter_2_phase_transition()
-
-        elif self.phase == "discard":
-            if not self.current_discarders: self.current_discarders = self._determine_discarders()
-
-            agent_discard = False
-            for discarder in self.current_discarders:
-                if self._decision_is_agent(discarder):
-                    agent_discard = True
-                    continue
-                else:
-                    self.current_discard.append((discarder, discarder.get_discard(self.game_state, self.history)))
-            if agent_discard:
+        phase_handlers = self._phase_handlers
+
+        while gs.is_alive(self.agent_idx) and gs.alive_count() > 1:
+            if not 0 <= self.phase < len(phase_handlers):
+                raise InvalidPhaseError(self.phase)
+            # each handler returns True when it stopped to wait for the agent, and otherwise runs its phase transition
+            if phase_handlers[self.phase]():
                 return
-            self._discard_phase_transition()
 
-        elif self.phase == "discard_pair":
+    def _run_action_phase(self) -> bool:
+        gs: State = self.game_state
 
-            gs.player_cards[gs.current_player.name] += [gs.deck.pop(), gs.deck.pop()]
-            if self._decision_is_agent(gs.current_player):
-                return
-            else:
-                self.current_discard_pair = gs.current_player.get_discard_pair(self.game_state, self.history)
-                self._discard_pair_phase_transition()
-        else:
-            exit(1)
+        self.current_action = NO_ACTION
+        self.current_counter_1 = NO_COUNTER_1
+        self.current_counter_2 = NO_COUNTER_2
+        self.current_discard.clear()
+        self.current_discard_pair = NO_DISCARD_PAIR
+        self.current_discarders.clear()
+        self.current_counter_1_queried.clear()
+        self.current_counter_2_queried.clear()
 
-        self._run_game_until_input()
+        if gs.current == self.agent_idx: 
+            return True
+
+        self.current_action = gs.current_player.get_action(self.game_state, self.history, generate_valid_actions(gs))
+        self._action_phase_transition()
+        return False
+
+    def _run_counter_1_phase(self) -> bool:
+        gs: State = self.game_state
+
+        for seat in gs.turn_order()[1:]:
+            if seat in self.current_counter_1_queried: continue
+            self.current_counter_1_queried.append(seat)
+            if seat == self.agent_idx:
+                return True
+            player = gs.seats[seat]
+            potential_counter_1 = player.get_counter(self.current_action, self.game_state, self.history, generate_valid_counters(player.name, self.current_action))
+            if potential_counter_1.attempted:
+                self.current_counter_1 = potential_counter_1
+                break
+
+        self._counter_1_phase_transition()
+        return False
+
+    def _run_counter_2_phase(self) -> bool:
+        gs: State = self.game_state
+
+        blocker = gs.seat_of[self.current_counter_1.active_player]
+        for seat in gs.turn_order():
+            if seat == blocker or seat in self.current_counter_2_queried: continue
+            self.current_counter_2_queried.append(seat)
+            if seat == self.agent_idx:
+                return True
+            player = gs.seats[seat]
+            action = interned_action(self.current_counter_1.active_player, self.current_counter_1.active_player, -1)
+            potential_counter_2 = player.get_counter(action, self.game_state, self.history, generate_valid_counters(player.name, action), action_is_block=True)
+            if potential_counter_2.attempted:
+                self.current_counter_2 = potential_counter_2
+                break
+
+        self._counter_2_phase_transition()
+        return False
+
+    def _run_discard_phase(self) -> bool:
+        gs: State = self.game_state
+
+        if not self.current_discarders: self._determine_discarders()
+
+        agent_discard = False
+        for seat in self.current_discarders:
+            if seat == self.agent_idx:
+                agent_discard = True
+                continue
+            self.current_discard.setdefault(seat, gs.seats[seat].get_discard(self.game_state, self.history))
+        if agent_discard:
+            return True
+
+        self._discard_phase_transition()
+        return False
+
+    def _run_discard_pair_phase(self) -> bool:
+        gs: State = self.game_state
+
+        gs.draw_cards(gs.current, 2)
+        if gs.current == self.agent_idx:
+            return True
+
+        self.current_discard_pair = gs.current_player.get_discard_pair(self.game_state, self.history)
+        self._discard_pair_phase_transition()
+        return False
 
     def _run_phase_transition(self) -> None:
-        if self.phase == "action":
-            self._action_phase_transition()
-        elif self.phase == "counter_1":
-            self._counter_1_phase_transition()
-        elif self.phase == "counter_2":
-            self._counter_2_phase_transition()
-        elif self.phase == "discard":
-            self._discard_phase_transition()
-        elif self.phase == "discard_pair":
-            self._discard_pair_phase_transition()
-        else:
-            exit(1)
+        if not 0 <= self.phase < len(self._phase_transitions):
+            raise InvalidPhaseError(self.phase)
+        self._phase_transitions[self.phase]()
 
     def _action_phase_transition(self) -> None:
-        self.history.append(self.current_action)
+        if self.keep_history:
+            self._append_history(self.current_action)
         if self.current_action.type == 0:
-            self.phase = "action"
+            self.phase = ACTION_PHASE
             self._simulate_turn()
         elif self.current_action.type == 6:
-            self.phase = "discard"
+            self.phase = DISCARD_PHASE
         else:
-            self.phase = "counter_1"
+            self.phase = COUNTER_1_PHASE
 
     def _counter_1_phase_transition(self) -> None:
         if len(self.current_counter_1_queried) < self.player_count - 1: 
-            self.phase = "counter_1"
-        if self.current_counter_1.active_player != '':
-            self.history.append(self.current_counter_1)
+            self.phase = COUNTER_1_PHASE
+        if self.keep_history and self.current_counter_1.active_player != '':
+            self._append_history(self.current_counter_1)
         if not self.current_counter_1.attempted:
             if self.current_action.type == 5:
-                self.phase = "discard"
+                self.phase = DISCARD_PHASE
             elif self.current_action.type == 3:
-                self.phase = "discard_pair"
+                self.phase = DISCARD_PAIR_PHASE
             else:
-                self.phase = "action"
+                self.phase = ACTION_PHASE
                 self._simulate_turn()
         else:
             if self.current_counter_1.challenge:
-                self.phase = "discard"
+                self.phase = DISCARD_PHASE
             else:
-                self.phase = "counter_2"
+                self.phase = COUNTER_2_PHASE
 
     def _counter_2_phase_transition(self) -> None:
         if len(self.current_counter_2_queried) < self.player_count - 1: 
-            self.phase = "counter_2"
-        if self.current_counter_1.active_player != '':
-            self.history.append(self.current_counter_2)
+            self.phase = COUNTER_2_PHASE
+        if self.keep_history and self.current_counter_1.active_player != '':
+            self._append_history(self.current_counter_2)
         if not self.current_counter_2.attempted:
-            self.phase = "action"
+            self.phase = ACTION_PHASE
             self._simulate_turn()
         else:
-            self.phase = "discard"
+            self.phase = DISCARD_PHASE
 
     def _discard_phase_transition(self) -> None:
         if self.current_action.type == 3:
-            active_cards = self.game_state.player_cards[self.current_action.active_player]
+            gs: State = self.game_state
+            active_cards = gs.cards(gs.seat_of[self.current_action.active_player])
             if not action_bluffed(self.current_action.type, active_cards):
-                self.phase = "discard_pair"
+                self.phase = DISCARD_PAIR_PHASE
             else:
-                self.phase = "action"
+                self.phase = ACTION_PHASE
                 self._simulate_turn()
         else:
-            self.phase = "action"
+            self.phase = ACTION_PHASE
             self._simulate_turn()
 
     def _discard_pair_phase_transition(self) -> None:
-        gs: State = self.game_state
-        self.history.append(DiscardPair(self.players.index(gs.current_player), gs.player_cards[gs.current_player.name].copy(), self.current_discard_pair))
-        self.phase = "action"
+        if self.keep_history:
+            gs: State = self.game_state
+            self._append_history(DiscardPair(gs.current, gs.cards(gs.current), self.current_discard_pair))
+        self.phase = ACTION_PHASE
         self._simulate_turn()
 
     def _simulate_turn(self) -> None:
         self.round += 1
         gs: State = self.game_state
         action_type: int = self.current_action.type
+        belief: BeliefTracker | None = self.belief
 
         if self.current_counter_1.attempted:
+            counter_1_seat = gs.seat_of[self.current_counter_1.active_player]
             if self.current_counter_2.attempted:
-                counter_cards = gs.player_cards[self.current_counter_1.active_player]
-                if not bool(set(ACTION_IDX_BLOCKER[action_type]).intersection(set(counter_cards))):
-                    card_idx = [disc[1] for disc in self.current_discard if disc[0].name == self.current_counter_1.active_player][0]
-                    lose_challenge(self.current_counter_1.active_player, gs.player_cards, card_idx, gs.player_discards)
+                counter_cards = gs.cards(counter_1_seat)
+                if counter_1_bluffed(action_type, counter_cards):
+                    if belief is not None:
+                        belief.challenged(counter_1_seat, ACTION_IDX_BLOCKER[action_type], -1)
+                    lose_challenge(gs, counter_1_seat, self.current_discard[counter_1_seat])
                     self._take_action()
                 else:
-                    card_idx = [disc[1] for disc in self.current_discard if disc[0].name == self.current_counter_2.active_player][0]
-                    lose_challenge(self.current_counter_2.active_player, gs.player_cards, card_idx, gs.player_discards)
+                    if belief is not None:
+                        blockers = ACTION_IDX_BLOCKER[action_type]
+                        belief.challenged(counter_1_seat, blockers, next(card for card in counter_cards if card in blockers))
+                    counter_2_seat = gs.seat_of[self.current_counter_2.active_player]
+                    lose_challenge(gs, counter_2_seat, self.current_discard[counter_2_seat])
 
             else:
                 if self.current_counter_1.challenge:
-                    active_cards = gs.player_cards[self.current_action.active_player]
-                    if action_bluffed(action_type, active_cards):
-                        card_idx = [disc[1] for disc in self.current_discard if disc[0].name == self.current_action.active_player][0]
-                        lose_challenge(self.current_action.active_player, gs.player_cards, card_idx, gs.player_discards)
+                    active_seat = gs.seat_of[self.current_action.active_player]
+                    if action_bluffed(action_type, gs.cards(active_seat)):
+                        if belief is not None:
+                            belief.challenged(active_seat, (ACTION_IDX_CARD[action_type],), -1)
+                        lose_challenge(gs, active_seat, self.current_discard[active_seat])
                     else:
-                        card_idx = [disc[1] for disc in self.current_discard if disc[0].name == self.current_counter_1.active_player][0]
-                        lose_challenge(self.current_counter_1.active_player, gs.player_cards, card_idx, gs.player_discards)
+                        if belief is not None:
+                            belief.challenged(active_seat, (ACTION_IDX_CARD[action_type],), ACTION_IDX_CARD[action_type])
+                        lose_challenge(gs, counter_1_seat, self.current_discard[counter_1_seat])
                         self._take_action()
 
         else:
             self._take_action()
 
-        self._update_next_player()
+        gs.advance()
+        if belief is not None:
+            belief.end_turn(gs)
+        if self.recorder is not None:
+            self.recorder.record_turn(self)
 
     def _take_action(self) -> None:
         gs: State = self.game_state
-        p1: str = self.current_action.active_player
-        p2: str = self.current_action.target_player
         action_type: int = self.current_action.type
+        p1: int = gs.seat_of[self.current_action.active_player]
+        p2: int = gs.seat_of[self.current_action.target_player]
 
         match action_type:
             case 0:
-                income(p1, gs.player_coins)
+                income(gs, p1)
             case 1:
-                foreign_aid(p1, gs.player_coins)
+                foreign_aid(gs, p1)
             case 2:
-                tax(p1, gs.player_coins)
+                tax(gs, p1)
             case 3:
-                cards = gs.player_cards[gs.current_player.name].copy()
-                cards_idxs = self.current_discard_pair
-                exchange(p1, gs.player_cards, cards, cards_idxs, gs.deck)
+                exchange(gs, p1, self.current_discard_pair)
             case 4:
-                steal(p1, p2, gs.player_coins)
+                steal(gs, p1, p2)
             case 5:
-                if len(gs.player_cards[p2]) > 0:
-                    card_idx = [disc[1] for disc in self.current_discard if disc[0].name == self.current_action.target_player][0]
-                    assassinate(p1, p2, gs.player_coins, gs.player_cards, card_idx, gs.player_discards)
+                if gs.hand_sizes[p2] > 0:
+                    assassinate(gs, p1, p2, self.current_discard[p2])
             case 6:
-                card_idx = [disc[1] for disc in self.current_discard if disc[0].name == self.current_action.target_player][0]
-                coup(p1, p2, gs.player_coins, gs.player_cards, card_idx, gs.player_discards)
+                coup(gs, p1, p2, self.current_discard[p2])
             case _:
                 return
 
-    def _update_next_player(self) -> None:
-        gs: State = self.game_state
-
-        gs.players = gs.players[1:] + [gs.players[0]]
-        gs.players = [p for p in gs.players if len(gs.player_cards[p.name]) > 0]
-        gs.player_coins = { p : (c if len(gs.player_cards[p]) > 0 else 0) for p, c in zip(gs.player_coins.keys(), gs.player_coins.values())}
-        gs.current_player = gs.players[0]
-
-    def _determine_discarders(self) -> list[Player]:
-        discarders: list[Player] = []
+    def _determine_discarders(self) -> list[int]:
+        discarders: list[int] = self.current_discarders
         gs: State = self.game_state
         action_type: int = self.current_action.type
+        active_seat: int = gs.seat_of[self.current_action.active_player]
+        target_seat: int = gs.seat_of[self.current_action.target_player]
 
         if self.current_counter_1.attempted:
+            counter_1_seat = gs.seat_of[self.current_counter_1.active_player]
             if self.current_counter_2.attempted:
-                counter_cards = gs.player_cards[self.current_counter_1.active_player]
+                counter_cards = gs.cards(counter_1_seat)
                 if counter_1_bluffed(action_type, counter_cards):
-                    discarders.append([p for p in gs.players if p.name == self.current_counter_1.active_player][0])
+                    discarders.append(counter_1_seat)
                     if action_type in [5, 6]:
-                        discarders.append([p for p in gs.players if p.name == self.current_action.target_player][0])
+                        discarders.append(target_seat)
                 else:
-                    discarders.append([p for p in gs.players if p.name == self.current_counter_2.active_player][0])
+                    discarders.append(gs.seat_of[self.current_counter_2.active_player])
                 
             else:
                 if self.current_counter_1.challenge:
-                    active_cards = gs.player_cards[self.current_action.active_player]
+                    active_cards = gs.cards(active_seat)
                     if action_bluffed(action_type, active_cards):
-                        discarders.append([p for p in gs.players if p.name == self.current_action.active_player][0])
+                        discarders.append(active_seat)
                     else:
-                        discarders.append([p for p in gs.players if p.name == self.current_counter_1.active_player][0])
+                        discarders.append(counter_1_seat)
                         if action_type in [5, 6]:
-                            discarders.append([p for p in gs.players if p.name == self.current_action.target_player][0])
+                            discarders.append(target_seat)
 
         else:
             if action_type in [5, 6]:
-                discarders.append([p for p in gs.players if p.name == self.current_action.target_player][0])
+                discarders.append(target_seat)
         
         return discarders
 
 
     def _observation(self) -> np.ndarray[np.float32]:
-        return np.concatenate((self.game_state.encode(self.agent_idx, self.player_count), self._encode_history()))
+        """Writes the observation into the observation buffer, or a new array if there is none, and returns it."""
+
+        observation = self.observation_buffer
+        if observation is None:
+            observation = np.empty(self.observation_space.shape, dtype=np.float32)
+        state_end = 20 + 12 * self.player_count
+        history_end = state_end + self.history_length * self.event_dim
+        self.game_state.encode_into(observation[:state_end], self.agent_idx, self.player_count)
+        observation[state_end:history_end] = self._encode_history()
+        if self.mask_observation:
+            observation[history_end:] = self.action_mask
+        return observation
+
+    def _append_history(self, event: Event) -> None:
+        """
+        Appends event to self.history and encodes it into the history buffer. An Action starts a new turn; counters and
+        the agent's own discard pairs are added to the turn of the latest Action.
+        """
+
+        if self.belief is not None:
+            self.belief.observe(event, self.game_state)
+        self.history.append(event)
+        if self.agent_idx == NO_AGENT:
+            # nobody observes the history of a game among bots (see simulate_games)
+            return
+
+        L: int = self.history_length
+
+        if isinstance(event, Action):
+            self.history_head = (self.history_head - 1) % L
+            turn = self.history_buffer[self.history_head]
+            turn[:] = 0
+        elif isinstance(event, Counter) or (isinstance(event, DiscardPair) and event.active_player_idx == self.agent_idx):
+            turn = self.history_buffer[self.history_head]
+        else:
+            return
+
+        event.encode_into(turn, self.game_state, self.encoder)
+        self.history_buffer[self.history_head + L] = turn
 
     def _encode_history(self) -> np.ndarray[np.float32]:
         """
@@ -378,38 +735,14 @@ class Coup(gym.Env):
             2 + player_count  : counter_2 phase, 2 (accept, challenge) + player_count (blocker)
             26     : discard_pair phase  , 4 * 5 roles + (4 choose 2)
 
-        self.history is stored as the following:
-        [action: Action, counter_1: Counter, action: Action, counter_1: Counter, discard_pair: DiscardPair, ...]
-
-        action fields       : active, target , type 
-        counter fields      : active, attempted, challenge, counter_1
-        discard_pair fields : initial_cards , discard_idxs
+        The most recent turn comes first. Turns are encoded as they happen (see _append_history), so this is a view of the
+        history buffer rather than a copy.
 
         Note: dispose is not a relevant action to store in the memory. 
         Note: keeps are only stored for the agent
         """
 
-        gs: State = self.game_state
-
-        encoding: np.ndarray[np.float32] = np.zeros(((6 * self.player_count + 35) * self.history_length,))
-        encoded_turns: int = 0
-        event_encoding: np.ndarray[np.float32] = np.zeros((6 * self.player_count + 35,))
-        for event in reversed(self.history):
-            if encoded_turns == self.history_length:
-                return encoding
-            if isinstance(event, Action):
-                event_encoding[0:4 + 4 * self.player_count] = event.encode(gs, self.player_count)
-                encoding[(6 * self.player_count + 35) * encoded_turns:(6 * self.player_count + 35) * (encoded_turns + 1)] = event_encoding
-                encoded_turns += 1
-                event_encoding = np.zeros((6 * self.player_count + 35,))
-            elif isinstance(event, Counter):
-                if event.counter_1:
-                    event_encoding[4 + 4 * self.player_count:7 + 5 * self.player_count] = event.encode(gs, self.player_count)
-                else:
-                    event_encoding[7 + 5 * self.player_count:9 + 6 * self.player_count] = event.encode(gs, self.player_count)
-            elif isinstance(event, DiscardPair) and event.active_player_idx == self.agent_idx:
-                event_encoding[9 + 6 * self.player_count:35 + 6 * self.player_count] = event.encode(gs, self.player_count)
-        return encoding
+        return self.history_buffer[self.history_head:self.history_head + self.history_length].reshape(-1)
 
     def _decode_action(self, a: torch.tensor) -> int:
         """
@@ -420,131 +753,117 @@ class Coup(gym.Env):
         counter_2_size = 2 # accept, challenge
         discard_size = 2 # remove card 1 or card 2
         discard_pair_size = 6 # (4 choose 2)
+
+        The selected index is the highest entry of a that is allowed by self.action_mask.
         """
 
         gs: State = self.game_state
-        idx: int = 0
-
-        a = a.cpu()
-
-        player_names = list(gs.player_discards.keys())
-        if self.phase == "action":
-            a = a[0:1 + 3 * self.player_count]
-            possible_actions = generate_valid_actions(gs.current_player, gs.players, gs.player_coins, gs.player_cards)
-            list_of_players = list([p_name for p_name in gs.player_discards.keys() if p_name != player_names[self.agent_idx]])
-            idx_to_player = {i : list_of_players[i] for i in range(len(list_of_players))}
-            idx_to_type = {0: 'Income', 1: 'Foreign Aid', 2: 'Tax', 3: 'Exchange'}
-
-            for i in range(4, 3 + self.player_count):
-                idx_to_type[i] = 'Steal'
-            for i in range(3 + self.player_count, 2 + 2 * self.player_count):
-                idx_to_type[i] = 'Assassinate'
-            for i in range(2 + 2 * self.player_count, 1 + 3 * self.player_count):
-                idx_to_type[i] = 'Coup'
-
-            action = None
-            while action not in possible_actions:
-                i = torch.argmax(a).item()
-                a[i] = -1 * float('inf')
-                type = ACTION_INDICES[idx_to_type[i]]
-                if i > 3:
-                    target = idx_to_player[(i - 4) % (self.player_count - 1)]
-                else:
-                    target = player_names[self.agent_idx]
-                action = Action(player_names[self.agent_idx], target, type)
-            self.current_action = action
-
-        elif self.phase == "counter_1":
-            idx += 1 + 3 * self.player_count
-            a = a[1 + 3 * self.player_count:4 + 3 * self.player_count]
-            possible_counters = generate_valid_counters(player_names[self.agent_idx], self.current_action)
-
-            counter_1 = None
-            while counter_1 not in possible_counters:
-                i = torch.argmax(a).item()
-                a[i] = -1 * float('inf')
-                if i == 0: # accept
-                    counter_1 = Counter(player_names[self.agent_idx], False, False, True)
-                if i == 1: # challenge
-                    counter_1 = Counter(player_names[self.agent_idx], True, True, True)
-                if i == 2: # block
-                    counter_1 = Counter(player_names[self.agent_idx], True, False, True)
-            self.current_counter_1 = counter_1
-
-        elif self.phase == "counter_2":
-            idx += 4 + 3 * self.player_count
-            a = a[4 + 3 * self.player_count:6 + 3 * self.player_count]
-            counter_1 = self.current_counter_1
-            if counter_1.challenge:
-                counter_1 = Action(counter_1.active_player, player_names[self.agent_idx], -2)
+        n: int = self.player_count
+        agent: int = self.agent_idx
+        agent_name: str = gs.names[agent]
+
+        if isinstance(a, torch.Tensor):
+            a = a.detach().cpu().numpy()
+        idx: int = int(np.argmax(np.where(self.action_mask, a, -np.inf)))
+
+        if self.phase == ACTION_PHASE:
+            i = idx
+            if i < 4:
+                self.current_action = interned_action(agent_name, agent_name, i)
             else:
-                counter_1 = Action(counter_1.active_player, player_names[self.agent_idx], -1)
-            possible_counters = generate_valid_counters(player_names[self.agent_idx], counter_1)
-
-            counter_2 = None
-            while counter_2 not in possible_counters:
-                i = torch.argmax(a).item()
-                a[i] = -1 * float('inf')
-                if i == 0: # accept
-                    counter_2 = Counter(player_names[self.agent_idx], False, False, False)
-                if i == 1: # challenge
-                    counter_2 = Counter(player_names[self.agent_idx], True, True, False)  
-            self.current_counter_2 = counter_2
-
-        elif self.phase == "discard":
-            idx += 6 + 3 * self.player_count
-            a = a[6 + 3 * self.player_count:8 + 3 * self.player_count]
-            i = torch.argmax(a).item()
-            if len(gs.player_discards[player_names[self.agent_idx]]) > 0:
-                i = 0
-            self.current_discard.append((self.players[self.agent_idx], i))
-
-        elif self.phase == "discard_pair":
-            idx += 8 + 3 * self.player_count
-            a = a[8 + 3 * self.player_count:14 + 3 * self.player_count]
-
-            possible_pairs = [[0, 1], [0, 2], [1, 2]]
-            if len(gs.player_cards[self.current_action.active_player]) == 2:
-                possible_pairs += [[0, 3], [1, 3], [2, 3]]
-            
-            idx_to_discard = {0: [0, 1],
-                            1: [0, 2],
-                            2: [0, 3],
-                            3: [1, 2],
-                            4: [1, 3],
-                            5: [2, 3]}
-            
-            discard_pair = None
-            while discard_pair not in possible_pairs:
-                i = torch.argmax(a).item()
-                a[i] = -1 * float('inf')
-                discard_pair = idx_to_discard[i]
-            
-            self.current_discard_pair = discard_pair
+                # targeted actions list the other players in seat order, skipping the agent
+                k = (i - 4) % (n - 1)
+                target = k + (k >= agent)
+                self.current_action = interned_action(agent_name, gs.names[target], 4 + (i - 4) // (n - 1))
+
+        elif self.phase == COUNTER_1_PHASE:
+            i = idx - (1 + 3 * n)  # accept, challenge, block
+            self.current_counter_1 = interned_counter(agent_name, i != 0, i == 1, True)
+
+        elif self.phase == COUNTER_2_PHASE:
+            i = idx - (4 + 3 * n)  # accept, challenge
+            self.current_counter_2 = interned_counter(agent_name, i == 1, i == 1, False)
+
+        elif self.phase == DISCARD_PHASE:
+            i = idx - (6 + 3 * n)
+            self.current_discard.setdefault(agent, i)
+
+        elif self.phase == DISCARD_PAIR_PHASE:
+            i = idx - (8 + 3 * n)
+            self.current_discard_pair = list(DISCARD_PAIRS[i])
+
+        else:
+            raise InvalidPhaseError(self.phase)
+
+        return idx
+
+    def _action_mask(self) -> np.ndarray[bool]:
+        """
+        Return a boolean mask over the action space of the moves the agent may make in the current phase. The mask is all
+        False when the agent has no decision to make (i.e. the game has ended for the agent).
+        """
+
+        gs: State = self.game_state
+        n: int = self.player_count
+        agent: int = self.agent_idx
+        mask: np.ndarray[bool] = np.zeros((self.action_space.shape[0],), dtype=bool)
+
+        if (not gs.is_alive(agent)) or (gs.alive_count() == 1):
+            return mask
+
+        if self.phase == ACTION_PHASE:
+            coins = gs.coins[agent]
+            if coins < 10:
+                mask[0:4] = True
+            # targeted actions list the other players in seat order, skipping the agent
+            for k in range(n - 1):
+                target = k + (k >= agent)
+                if not gs.is_alive(target):
+                    continue
+                if coins < 10:
+                    mask[4 + k] = gs.coins[target] > 0
+                    mask[3 + n + k] = coins >= 3
+                mask[2 + 2 * n + k] = coins >= 7
+
+        elif self.phase == COUNTER_1_PHASE:
+            action_type = self.current_action.type
+            mask[1 + 3 * n] = True
+            mask[2 + 3 * n] = action_type in CHALLENGEABLE_ACTIONS
+            mask[3 + 3 * n] = action_type in BLOCKABLE_ACTIONS
+
+        elif self.phase == COUNTER_2_PHASE:
+            # a block may be challenged, a challenge may not
+            mask[4 + 3 * n] = True
+            mask[5 + 3 * n] = not self.current_counter_1.challenge
+
+        elif self.phase == DISCARD_PHASE:
+            mask[6 + 3 * n] = True
+            mask[7 + 3 * n] = gs.discard_counts[agent] == 0
+
+        elif self.phase == DISCARD_PAIR_PHASE:
+            # the hand holds the 2 cards just drawn on top of the ones held before the exchange
+            mask[8 + 3 * n:] = EXCHANGE_PAIR_MASKS[gs.hand_sizes[agent] - 2]
 
         else:
-            exit(1)
+            raise InvalidPhaseError(self.phase)
 
-        return idx + i
+        return mask
 
     def _reward(self) -> np.float32:
         COIN_VALUE, OPP_COIN_VALUE, CARD_VALUE, OPP_CARD_VALUE, WIN_VALUE = self.reward_hyperparameters
 
         gs: State = self.game_state
+        agent: int = self.agent_idx
 
         reward = 0
 
-        reward += COIN_VALUE * gs.player_coins[self.players[self.agent_idx].name]
-        reward += OPP_COIN_VALUE * sum([gs.player_coins[self.players[i].name] for i in range(self.player_count) if i != self.agent_idx])
-        reward += CARD_VALUE * len(gs.player_cards[self.players[self.agent_idx].name])
-        reward += OPP_CARD_VALUE * sum([len(gs.player_cards[self.players[i].name]) for i in range(self.player_count) if i != self.agent_idx])
-        if all(self.players[self.agent_idx].name == p for p in [p.name for p in gs.players]):
+        reward += COIN_VALUE * gs.coins[agent]
+        reward += OPP_COIN_VALUE * (sum(gs.coins) - gs.coins[agent])
+        reward += CARD_VALUE * gs.hand_sizes[agent]
+        reward += OPP_CARD_VALUE * (sum(gs.hand_sizes) - gs.hand_sizes[agent])
+        if gs.alive == 1 << agent:
             reward += WIN_VALUE
-        elif self.players[self.agent_idx].name not in [p.name for p in gs.players]:
+        elif not gs.is_alive(agent):
             reward += -1 * WIN_VALUE
 
         return reward
-    
-    def _decision_is_agent(self, player: Player) -> bool:
-        player_names = list(self.game_state.player_discards.keys())
-        return self.agent_idx == player_names.index(player.name)
\ No newline at end of file
@@ -0,0 +1,120 @@
+import numpy as np
+from functools import cache
+
+# kinds of counters, in the order they are one-hot encoded (2nd order counters are only ever accepted or challenged)
+ACCEPT: int = 0
+CHALLENGE: int = 1
+BLOCK: int = 2
+
+# maps the position of a pair of discarded card indices in the discard pair encoding to the pair
+DISCARD_PAIRS: list[tuple[int, int]] = [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+# EXCHANGE_PAIR_MASKS[k] flags the pairs of DISCARD_PAIRS that a player holding k cards before the exchange may return, i.e.
+# the pairs within the k + 2 cards it holds once it has drawn
+EXCHANGE_PAIR_MASKS: np.ndarray[bool] = np.array([[j < k + 2 for _, j in DISCARD_PAIRS] for k in range(3)])
+
+
+def counter_kind(attempted: bool, challenge: bool) -> int:
+    if not attempted:
+        return ACCEPT
+    return CHALLENGE if challenge else BLOCK
+
+
+class EventEncoder:
+    """
+    Precomputed one-hot offsets for the events of a game with player_count players.
+
+    Every offset indexes into a turn row of size event_dim = 35 + 6 * player_count (see Coup._encode_history):\n
+        [0 : 4 + 4 * player_count]                       action: sender, then 4 actions on oneself and 3 targeted actions\n
+        [4 + 4 * player_count : 7 + 5 * player_count]    counter_1: accept / challenge / block, then the blocker\n
+        [7 + 5 * player_count : 9 + 6 * player_count]    counter_2: accept / challenge, then the challenger\n
+        [9 + 6 * player_count : 35 + 6 * player_count]   discard_pair: up to 4 initial cards, then the (4 choose 2) pair
+
+    The encode_* methods write one event into a caller-supplied turn row; the batched encode_*s methods write a batch of
+    events into rows of a (batch, event_dim) array with a single fancy-indexing assignment.
+    """
+
+    def __init__(self, player_count: int) -> None:
+        n = player_count
+        seats = np.arange(n)
+
+        self.player_count: int = n
+        self.event_dim: int = 35 + 6 * n
+        self.action_slice: slice = slice(0, 4 + 4 * n)
+        self.counter_1_slice: slice = slice(4 + 4 * n, 7 + 5 * n)
+        self.counter_2_slice: slice = slice(7 + 5 * n, 9 + 6 * n)
+        self.discard_pair_slice: slice = slice(9 + 6 * n, 35 + 6 * n)
+
+        # action_table[actor, type, target] holds the offsets of the sender and of the action type (along with its target)
+        type_offsets = np.zeros((7, n), dtype=np.int64)
+        type_offsets[:4] = n + np.arange(4)[:, None]
+        type_offsets[4] = n + 4 + seats
+        type_offsets[5] = 2 * n + 4 + seats
+        type_offsets[6] = 3 * n + 4 + seats
+        self.action_table: np.ndarray[np.int64] = np.zeros((n, 7, n, 2), dtype=np.int64)
+        self.action_table[..., 0] = seats[:, None, None]
+        self.action_table[..., 1] = type_offsets[None]
+
+        # counter_1_table[kind, actor] holds the offsets of the counter kind and of the blocker (an accept has no blocker)
+        base = self.counter_1_slice.start
+        self.counter_1_table: np.ndarray[np.int64] = np.zeros((3, n, 2), dtype=np.int64)
+        self.counter_1_table[..., 0] = base + np.arange(3)[:, None]
+        self.counter_1_table[..., 1] = base + 3 + seats[None]
+        self.counter_1_table[ACCEPT, :, 1] = base + ACCEPT
+
+        # counter_2_table[kind, actor] is laid out the same way as counter_1_table, without the block kind
+        base = self.counter_2_slice.start
+        self.counter_2_table: np.ndarray[np.int64] = np.zeros((2, n, 2), dtype=np.int64)
+        self.counter_2_table[..., 0] = base + np.arange(2)[:, None]
+        self.counter_2_table[..., 1] = base + 2 + seats[None]
+        self.counter_2_table[ACCEPT, :, 1] = base + ACCEPT
+
+        # card_table[slot, card] is the offset of the initial card in slot; pair_table[i, j] the offset of the pair (i, j)
+        base = self.discard_pair_slice.start
+        self.card_table: np.ndarray[np.int64] = base + 5 * np.arange(4)[:, None] + np.arange(5)[None]
+        self.pair_table: np.ndarray[np.int64] = np.full((4, 4), -1, dtype=np.int64)
+        for k, (i, j) in enumerate(DISCARD_PAIRS):
+            self.pair_table[i, j] = self.pair_table[j, i] = base + 20 + k
+
+        # flat copies of the tables for encoding single events without going through numpy indexing
+        self._actions: list[list[int]] = self.action_table.reshape(-1, 2).tolist()
+        self._counters_1: list[list[int]] = self.counter_1_table.reshape(-1, 2).tolist()
+        self._counters_2: list[list[int]] = self.counter_2_table.reshape(-1, 2).tolist()
+        self._cards: list[int] = self.card_table.reshape(-1).tolist()
+        self._pairs: list[int] = self.pair_table.reshape(-1).tolist()
+
+    def encode_action(self, out: np.ndarray, actor: int, action_type: int, target: int) -> None:
+        i, j = self._actions[(actor * 7 + action_type) * self.player_count + target]
+        out[i] = 1
+        out[j] = 1
+
+    def encode_counter(self, out: np.ndarray, counter_1: bool, kind: int, actor: int) -> None:
+        if counter_1:
+            i, j = self._counters_1[kind * self.player_count + actor]
+        else:
+            i, j = self._counters_2[kind * self.player_count + actor]
+        out[i] = 1
+        out[j] = 1
+
+    def encode_discard_pair(self, out: np.ndarray, initial_cards: list[int], discard_idxs: list[int]) -> None:
+        for slot, card in enumerate(initial_cards):
+            out[self._cards[5 * slot + card]] = 1
+        out[self._pairs[4 * discard_idxs[0] + discard_idxs[1]]] = 1
+
+    def encode_actions(self, out: np.ndarray, rows: np.ndarray, actors: np.ndarray, types: np.ndarray, targets: np.ndarray) -> None:
+        out[rows[:, None], self.action_table[actors, types, targets]] = 1
+
+    def encode_counters(self, out: np.ndarray, rows: np.ndarray, counter_1: bool, kinds: np.ndarray, actors: np.ndarray) -> None:
+        table = self.counter_1_table if counter_1 else self.counter_2_table
+        out[rows[:, None], table[kinds, actors]] = 1
+
+    def encode_discard_pairs(self, out: np.ndarray, rows: np.ndarray, initial_cards: np.ndarray, discard_idxs: np.ndarray) -> None:
+        """initial_cards is a (batch, 4) array padded with -1 when only 3 cards were held, discard_idxs a (batch, 2) array."""
+        slots, cards = np.nonzero(initial_cards >= 0)[1], initial_cards[initial_cards >= 0]
+        out[np.repeat(rows, (initial_cards >= 0).sum(axis=1)), self.card_table[slots, cards]] = 1
+        out[rows, self.pair_table[discard_idxs[:, 0], discard_idxs[:, 1]]] = 1
+
+
+@cache
+def get_encoder(player_count: int) -> EventEncoder:
+    """Returns the (shared) EventEncoder for games with player_count players."""
+    return EventEncoder(player_count)
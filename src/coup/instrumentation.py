@@ -0,0 +1,63 @@
+import time
+from typing import Any, Callable
+
+from coup.representations import Action, Counter, Event, Player, State, ValidActions
+
+
+class Timings:
+    """
+    Accumulated wall time and call counts of the functions wrapped with timed, keyed by name.
+    """
+
+    def __init__(self) -> None:
+        # maps each key to [total seconds, calls]
+        self.records: dict[str, list[float]] = {}
+
+    def timed(self, fn: Callable[..., Any], key: str) -> Callable[..., Any]:
+        """Returns fn wrapped so that every call adds its wall time and a call to the record of key."""
+        record = self.records.setdefault(key, [0.0, 0])
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record[0] += perf_counter() - start
+                record[1] += 1
+
+        return wrapper
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """Returns a copy of the records as {key: {'time': seconds, 'calls': count, 'mean': seconds per call}}."""
+        return {key : {'time' : total, 'calls' : calls, 'mean' : total / calls if calls else 0.0} for key, (total, calls) in self.records.items()}
+
+    def clear(self) -> None:
+        for record in self.records.values():
+            record[0] = 0.0
+            record[1] = 0
+
+
+class InstrumentedPlayer(Player):
+    """Wraps a bot so that the time spent in each of its decision methods is recorded in timings."""
+
+    def __init__(self, player: Player, timings: Timings) -> None:
+        super().__init__(player.name)
+        self.player: Player = player
+        self.reads_history: bool = player.reads_history
+        self._get_action = timings.timed(player.get_action, "policy/get_action")
+        self._get_counter = timings.timed(player.get_counter, "policy/get_counter")
+        self._get_discard = timings.timed(player.get_discard, "policy/get_discard")
+        self._get_discard_pair = timings.timed(player.get_discard_pair, "policy/get_discard_pair")
+
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
+        return self._get_action(state, history, valid_actions)
+
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
+        return self._get_counter(action, state, history, valid_counters, action_is_block)
+
+    def get_discard(self, state: State, history: list[Event]) -> int:
+        return self._get_discard(state, history)
+
+    def get_discard_pair(self, state: State, history: list[Event]) -> list[int]:
+        return self._get_discard_pair(state, history)
@@ -0,0 +1,421 @@
+import atexit
+import math
+import multiprocessing as mp
+import time
+from array import array
+from itertools import combinations
+from typing import Any, Hashable, Sequence
+
+from coup.coup import Coup, NO_AGENT, NO_ACTION, NO_COUNTER_1, NO_COUNTER_2, NO_DISCARD_PAIR
+from coup.player import player_class
+from coup.representations import Action, Counter, DiscardPair, Event, Player, State, ValidActions
+from coup.utils import *
+
+# _PAIRS[k] lists the pairs of hand indices a player holding k cards may return from an exchange
+_PAIRS: tuple[tuple[tuple[int, int], ...], ...] = tuple(tuple(combinations(range(k), 2)) for k in range(5))
+# the number of times the hidden cards are redealt to find a deal consistent with the turn in progress (see _Search._consistent)
+_MAX_REDEALS: int = 20
+# the worker pools shared by the searchers that weren't given one, by number of processes (see ISMCTSPlayer)
+_pools: dict[int, Any] = {}
+
+
+def _shared_pool(processes: int) -> Any:
+    pool = _pools.get(processes)
+    if pool is None:
+        pool = _pools[processes] = mp.Pool(processes)
+    return pool
+
+
+@atexit.register
+def _close_pools() -> None:
+    for pool in _pools.values():
+        pool.terminate()
+    _pools.clear()
+
+
+def _information(phase: int, history: list[Event], start: int) -> tuple[int, tuple[Event, ...]]:
+    """
+    Returns what the searcher knows of how it came to a decision of the given phase since its previous one, whose
+    history ended at start: the phase and the actions and counters played since (the exchanged cards are hidden).
+    """
+    return phase, tuple(event for event in history[start:] if not isinstance(event, DiscardPair))
+
+
+class _Node:
+    """
+    A node of the search tree: the choice the searcher made at one of its decisions, with its statistics and a child per
+    choice made at the next decision, keyed by what the searcher knew there (see _information) and the choice.
+    """
+
+    __slots__ = ('children', 'visits', 'reward', 'available')
+
+    def __init__(self) -> None:
+        self.children: dict[Hashable, _Node] = {}
+        self.visits: int = 0
+        self.reward: float = 0.0
+        # the number of visits to the parent in which the choice leading here was legal
+        self.available: int = 0
+
+
+class _TreePolicy(Player):
+    """
+    Sits in the searcher's seat during the rollouts: picks its choices with UCB while its decisions are in the tree, adds
+    the first one that isn't, and plays like rollout from there on.
+    """
+
+    def __init__(self, rollout: Player, exploration: float) -> None:
+        super().__init__(rollout.name)
+        self.rollout: Player = rollout
+        self.exploration: float = exploration
+        self.node: _Node | None = None
+        # the nodes of the choices made in the current rollout, in order
+        self.path: list[_Node] = []
+        # what the searcher knows at the root decision, then the length of the history as of its latest choice
+        self.root_information: Hashable = None
+        self.mark: int = 0
+
+    def start(self, root: _Node, information: Hashable) -> None:
+        self.node = root
+        self.path = []
+        self.root_information = information
+        self.mark = 0
+
+    def choose(self, state: State, history: list[Event], phase: int, choices: Sequence[Hashable]) -> Hashable:
+        information = _information(phase, history, self.mark) if self.path else self.root_information
+        self.mark = len(history)
+        children = self.node.children
+        exploration = self.exploration
+        best, best_score = None, -math.inf
+        for choice in choices:
+            child = children.get((information, choice))
+            if child is None:
+                child = children[(information, choice)] = _Node()
+            child.available += 1
+            if child.visits == 0:
+                # untried choices come first, in random order
+                score = 1e9 + state.rng.random()
+            else:
+                score = child.reward / child.visits + exploration * math.sqrt(math.log(child.available) / child.visits)
+            if score > best_score:
+                best, best_score = choice, score
+
+        child = children[(information, best)]
+        self.path.append(child)
+        self.node = child if child.visits > 0 else None
+        return best
+
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
+        if self.node is None:
+            return self.rollout.get_action(state, history, valid_actions)
+        return self.choose(state, history, ACTION_PHASE, valid_actions)
+
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
+        if self.node is None:
+            return self.rollout.get_counter(action, state, history, valid_counters, action_is_block)
+        return self.choose(state, history, COUNTER_2_PHASE if action_is_block else COUNTER_1_PHASE, valid_counters)
+
+    def get_discard(self, state: State, history: list[Event]) -> int:
+        if self.node is None:
+            return self.rollout.get_discard(state, history)
+        return self.choose(state, history, DISCARD_PHASE, range(len(state.player_cards[self.name])))
+
+    def get_discard_pair(self, state: State, history: list[Event]) -> list[int]:
+        if self.node is None:
+            return self.rollout.get_discard_pair(state, history)
+        return list(self.choose(state, history, DISCARD_PAIR_PHASE, _PAIRS[len(state.player_cards[self.name])]))
+
+
+class _Search:
+    """
+    The game a searcher plays its rollouts in: a Coup env without an agent seat (see Coup.simulate_games), with bots of
+    rollout_type named like the players of the real game and a _TreePolicy in the searcher's seat.
+    """
+
+    def __init__(self, names: tuple[str, ...], seat: int, rollout_type: str, exploration: float, max_rollout_turns: int) -> None:
+        self.seat: int = seat
+        self.env: Coup = Coup(len(names), round_cap=max_rollout_turns)
+        bots = [player_class(rollout_type)(name) for name in names]
+        self.tree_policy: _TreePolicy = _TreePolicy(bots[seat], exploration)
+        bots[seat] = self.tree_policy
+
+        env = self.env
+        env.players = bots
+        env.agent_idx = NO_AGENT
+        env.game_state = State(bots, None, env.rng)
+        env.history = []
+
+    def position(self, state: State, history: list[Event], phase: int) -> array:
+        """
+        Returns a snapshot (see Coup.snapshot) of the real game at the searcher's decision of the given phase, rebuilt from
+        state and from the events of the current turn in history. The cards the searcher can't see are redealt by run.
+        """
+        env = self.env
+        gs = env.game_state
+        gs.restore(state.snapshot())
+        env.phase = phase
+        env.round = 0
+        env.current_action = NO_ACTION
+        env.current_counter_1 = NO_COUNTER_1
+        env.current_counter_2 = NO_COUNTER_2
+        env.current_discard.clear()
+        env.current_discard_pair = NO_DISCARD_PAIR
+        env.current_discarders.clear()
+        env.current_counter_1_queried.clear()
+        env.current_counter_2_queried.clear()
+
+        if phase != ACTION_PHASE:
+            # the seats before the searcher's in turn order have already accepted
+            env.current_action, env.current_counter_1, env.current_counter_2 = _current_turn(history)
+            order = gs.turn_order()
+            if phase == COUNTER_1_PHASE:
+                env.current_counter_1_queried.extend(order[1:order.index(self.seat)])
+            elif phase == COUNTER_2_PHASE:
+                blocker = gs.seat_of[env.current_counter_1.active_player]
+                order = [seat for seat in order if seat != blocker]
+                env.current_counter_2_queried.extend(order[:order.index(self.seat)])
+        return env.snapshot()
+
+    def run(self, tree: _Node, root: array, phase: int, information: Hashable, iterations: int | None, time_budget: float | None, seed: int) -> int:
+        """
+        Runs rollouts from root (see position) until iterations of them are done or time_budget seconds have passed,
+        adding their results to tree, and returns the number of rollouts run. information is what the searcher knows at
+        the root decision (see _information), under which its choices there are added to tree.
+
+        Every rollout deals the cards the searcher can't see (the deck and its opponents' hands) anew at random, redealing
+        up to _MAX_REDEALS times until the deal is consistent with the turn in progress (see _consistent).
+        """
+        env = self.env
+        gs = env.game_state
+        rng = env.rng
+        rng.seed(seed)
+        n = env.player_count
+        seat = self.seat
+
+        sizes = root[5 * n:6 * n]
+        counts = [3] * 5
+        for card in root[n + 4 * seat:n + 4 * seat + sizes[seat]]:
+            counts[card] -= 1
+        for card in root[6 * n:8 * n]:
+            if card >= 0:
+                counts[card] -= 1
+        unknown = [card for card in range(5) for _ in range(counts[card])]
+        # the positions in the snapshot of the cards in the opponents' hands, then the deck
+        slots = [n + 4 * other + i for other in range(n) if other != seat for i in range(sizes[other])]
+        deck = 9 * n
+        deal = array('b', root)
+
+        policy = self.tree_policy
+        phase_handlers = env._phase_handlers
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time.perf_counter() < deadline):
+            for _ in range(_MAX_REDEALS):
+                cards = rng.sample(unknown, len(unknown))
+                for slot, card in zip(slots, cards):
+                    deal[slot] = card
+                left = [0] * 5
+                for card in cards[len(slots):]:
+                    left[card] += 1
+                deal[deck:deck + 5] = array('b', left)
+                env.restore(deal)
+                if self._consistent(phase):
+                    break
+
+            # the events of past rollouts are of no use to this one, and would pile up over the search
+            env.history.clear()
+            policy.start(tree, information)
+            if phase == DISCARD_PAIR_PHASE:
+                # the searcher has drawn its cards already, so the phase handler (which draws them) is skipped; a
+                # challenger who lost has chosen its discard in the discard phase, unseen, so its bot chooses it again
+                for other in env._determine_discarders():
+                    env.current_discard.setdefault(other, gs.seats[other].get_discard(gs, env.history))
+                env.current_discard_pair = policy.get_discard_pair(gs, env.history)
+                env._discard_pair_phase_transition()
+            while gs.alive >> seat & 1 and gs.alive_count() > 1 and env.round <= env.round_cap:
+                phase_handlers[env.phase]()
+
+            # a win is worth 1, and a truncated game is shared between the players left
+            reward = 1 / gs.alive_count() if gs.alive >> seat & 1 else 0.0
+            for node in policy.path:
+                node.visits += 1
+                node.reward += reward
+            tree.visits += 1
+            done += 1
+        return done
+
+
+    def _consistent(self, phase: int) -> bool:
+        """
+        Whether the bots would have played the action and counters of the turn in progress with the cards just dealt, and
+        the searcher loses a card in it if it is asked to discard. Opponents' claims are thus weighted by how likely the
+        rollout bots are to make them with each deal, as a uniform deal would have them bluff far more than they do.
+        """
+        if phase == ACTION_PHASE:
+            return True
+        env = self.env
+        gs = env.game_state
+        history = env.history
+        action = env.current_action
+        if gs.current != self.seat and gs.current_player.get_action(gs, history, generate_valid_actions(gs)) != action:
+            return False
+
+        counter_1 = env.current_counter_1
+        if phase != COUNTER_1_PHASE and counter_1.attempted:
+            seat = gs.seat_of[counter_1.active_player]
+            if seat != self.seat and gs.seats[seat].get_counter(action, gs, history, generate_valid_counters(counter_1.active_player, action)) != counter_1:
+                return False
+            counter_2 = env.current_counter_2
+            if phase != COUNTER_2_PHASE and counter_2.attempted:
+                seat = gs.seat_of[counter_2.active_player]
+                block = interned_action(counter_1.active_player, counter_1.active_player, -1)
+                if seat != self.seat and gs.seats[seat].get_counter(block, gs, history, generate_valid_counters(counter_2.active_player, block), action_is_block=True) != counter_2:
+                    return False
+
+        return phase != DISCARD_PHASE or self.seat in env._determine_discarders()
+
+
+class ISMCTSPlayer(Player):
+    """
+    A player that picks each decision with information-set Monte Carlo tree search (single observer).
+
+    Every rollout starts from the current position with the cards it can't see dealt anew at random, among the deals in
+    which the bots would have played the turn in progress as it was played, then plays the game out with bots of
+    rollout_type in every seat. In its own seat, the choices follow a tree of its decisions with UCB
+    (with availability counts, as the legal choices vary between deals) until a new decision is added. The most visited
+    choice is played.
+
+    Each decision runs at most iterations rollouts and stops after time_budget seconds, whichever comes first (either
+    may be None). The subtree of the choice played is kept for the next decision of the same game, whose nodes are
+    found by the phase of that decision and the events played since this one. With processes > 0, that many worker
+    processes also search the same decision independently within the same budget, and their root statistics are added
+    to this player's. The workers are those of pool, which the caller owns and may share between players; without one,
+    every player with the same number of processes shares a pool that lasts as long as the program.
+
+    The search draws its seed from the game's rng, so games stay reproducible from their seed under an iteration budget.
+    """
+
+    def __init__(self, name: str = 'Bot', iterations: int | None = 100, time_budget: float | None = 0.1, rollout_type: str = "h",
+                 exploration: float = 0.7, max_rollout_turns: int = 60, processes: int = 0, reuse_tree: bool = True, pool: Any = None) -> None:
+        super().__init__(name)
+        assert iterations is not None or time_budget is not None, "a search needs an iteration or a time budget"
+        assert rollout_type != "m", "rollouts are played by bots"
+        self.iterations: int | None = iterations
+        self.time_budget: float | None = time_budget
+        self.settings: tuple[str, float, int] = (rollout_type, exploration, max_rollout_turns)
+        self.processes: int = processes
+        self.reuse_tree: bool = reuse_tree
+
+        self.search: _Search | None = None
+        # the game being played, and the subtree of the last choice made in it
+        self.game: State | None = None
+        self.tree: _Node | None = None
+        # the length of the game's history as of the last decision
+        self.mark: int = 0
+        self.pool: Any = pool
+        # the number of rollouts behind the last decision, over all processes
+        self.last_iterations: int = 0
+
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
+        return self._decide(state, history, ACTION_PHASE, valid_actions)
+
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
+        return self._decide(state, history, COUNTER_2_PHASE if action_is_block else COUNTER_1_PHASE, valid_counters)
+
+    def get_discard(self, state: State, history: list[Event]) -> int:
+        return self._decide(state, history, DISCARD_PHASE, range(len(state.player_cards[self.name])))
+
+    def get_discard_pair(self, state: State, history: list[Event]) -> list[int]:
+        return list(self._decide(state, history, DISCARD_PAIR_PHASE, _PAIRS[len(state.player_cards[self.name])]))
+
+    def close(self) -> None:
+        """Drops the search, the tree of the game in progress and the pool (which is left running for its owner)."""
+        self.search = None
+        self.game = None
+        self.tree = None
+        self.pool = None
+
+    def __enter__(self) -> 'ISMCTSPlayer':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the search, the tree and the pool belong to the game in progress
+        return {**self.__dict__, 'search' : None, 'game' : None, 'tree' : None, 'pool' : None}
+
+    def _decide(self, state: State, history: list[Event], phase: int, choices: Sequence[Hashable]) -> Hashable:
+        seat = state.seat_of[self.name]
+        if state is not self.game:
+            self.game = state
+            self.tree = None
+            self.mark = 0
+        if self.search is None or self.search.seat != seat or self.search.env.game_state.names != state.names:
+            self.search = _Search(state.names, seat, *self.settings)
+        tree = self.tree if self.tree is not None and self.reuse_tree else _Node()
+        information = _information(phase, history, self.mark)
+        self.mark = len(history)
+
+        if len(choices) == 1:
+            choice = choices[0]
+            self.last_iterations = 0
+        else:
+            root = self.search.position(state, history, phase)
+            seed = int(state.rng.random() * (1 << 31))
+            pending = None
+            if self.processes > 0:
+                if self.pool is None:
+                    self.pool = _shared_pool(self.processes)
+                jobs = [(state.names, seat, self.settings, root, phase, information, self.iterations, self.time_budget, seed + 1 + k) for k in range(self.processes)]
+                pending = self.pool.starmap_async(_search_worker, jobs)
+
+            self.last_iterations = self.search.run(tree, root, phase, information, self.iterations, self.time_budget, seed)
+            stats = _root_stats(tree, information)
+            if pending is not None:
+                for worker_iterations, worker_stats in pending.get():
+                    self.last_iterations += worker_iterations
+                    for key, (visits, reward) in worker_stats.items():
+                        stats.setdefault(key, (0, 0.0))
+                        stats[key] = (stats[key][0] + visits, stats[key][1] + reward)
+
+            def score(choice: Hashable) -> tuple[int, float]:
+                visits, reward = stats.get(choice, (0, 0.0))
+                return visits, reward / visits if visits else 0.0
+
+            choice = max(choices, key=score)
+
+        self.tree = tree.children.get((information, choice))
+        return choice
+
+
+def _current_turn(history: list[Event]) -> tuple[Action, Counter, Counter]:
+    """Returns the action of the turn in progress and its attempted counters (or placeholders), read from history."""
+    counter_1, counter_2 = NO_COUNTER_1, NO_COUNTER_2
+    for event in reversed(history):
+        if isinstance(event, Action):
+            return event, counter_1, counter_2
+        if isinstance(event, Counter) and event.attempted:
+            if event.counter_1:
+                counter_1 = event
+            else:
+                counter_2 = event
+    return NO_ACTION, counter_1, counter_2
+
+
+# the searches of a worker process, by the players of the game, the searcher's seat and its settings
+_worker_searches: dict[tuple[tuple[str, ...], int, tuple[str, float, int]], _Search] = {}
+
+
+def _root_stats(tree: _Node, information: Hashable) -> dict[Hashable, tuple[int, float]]:
+    """Returns the visits and total reward of the choices made at the root of tree, whose information is given."""
+    return {choice : (child.visits, child.reward) for (known, choice), child in tree.children.items() if known == information}
+
+
+def _search_worker(names: tuple[str, ...], seat: int, settings: tuple[str, float, int], root: array, phase: int, information: Hashable,
+                   iterations: int | None, time_budget: float | None, seed: int) -> tuple[int, dict[Hashable, tuple[int, float]]]:
+    search = _worker_searches.get((names, seat, settings))
+    if search is None:
+        search = _worker_searches[(names, seat, settings)] = _Search(names, seat, *settings)
+    tree = _Node()
+    done = search.run(tree, root, phase, information, iterations, time_budget, seed)
+    return done, _root_stats(tree, information)
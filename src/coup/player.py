@@ -1,43 +1,45 @@
-import random
 import torch
 from itertools import combinations
 
-from coup.representations import Event, Action, Counter, State, Player
+from coup.representations import Event, Action, Counter, State, Player, ValidActions
 from coup.utils import *
 
 
 class HeuristicPlayer(Player):
-    """A player that follows a relatively effective heuristic."""
+    """
+    A player that follows a relatively effective heuristic. When the engine tracks beliefs (see State.belief), it
+    challenges the claims that are most likely bluffs and never challenges the ones that are most likely true.
+    """
 
-    # TODO: add tracking for which cards opponent has (e.g. for relevant counteractions)
+    reads_history = False
 
-    def get_action(self, state: State, history: list[Event], valid_actions: list[Action]) -> Action:
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
         cards = state.player_cards[self.name]
 
-        coups = [action for action in valid_actions if action.type == 6]
+        coups = valid_actions.by_type[6]
         if len(coups) > 0:
             max_cards = max([len(state.player_cards[action.target_player]) for action in coups])
-            return random.choice([action for action in coups if len(state.player_cards[action.target_player]) == max_cards])
+            return state.rng.choice([action for action in coups if len(state.player_cards[action.target_player]) == max_cards])
         
-        if (1 in cards and random.random() < 0.8) or (1 not in cards and random.random() < 0.2):
-            assassinations = [action for action in valid_actions if action.type == 5]
+        if (1 in cards and state.rng.random() < 0.8) or (1 not in cards and state.rng.random() < 0.2):
+            assassinations = valid_actions.by_type[5]
             if len(assassinations) > 0:
                 max_cards = max([len(state.player_cards[action.target_player]) for action in assassinations])
-                return random.choice([action for action in assassinations if len(state.player_cards[action.target_player]) == max_cards])
+                return state.rng.choice([action for action in assassinations if len(state.player_cards[action.target_player]) == max_cards])
             
-        tax = [action for action in valid_actions if action.type == 2]
+        tax = valid_actions.by_type[2]
         if tax and (4 in cards):
             return tax[0]
             
-        thefts = [action for action in valid_actions if action.type == 4]
+        thefts = valid_actions.by_type[4]
         if len(thefts) > 0:
             max_coins = max([state.player_coins[action.target_player] for action in thefts])
             if max_coins > 0 and (2 in cards):
-                return random.choice([action for action in thefts if state.player_coins[action.target_player] == max_coins])
+                return state.rng.choice([action for action in thefts if state.player_coins[action.target_player] == max_coins])
             
-        rand = random.random()
+        rand = state.rng.random()
         if rand < 0.5:
-            income = [action for action in valid_actions if action.type == 0]
+            income = valid_actions.by_type[0]
             if income:
                 return income[0]
             
@@ -46,34 +48,49 @@ class HeuristicPlayer(Player):
                 return tax[0]
             
             if len(thefts) > 0 and max_coins > 0:
-                return random.choice([action for action in thefts if state.player_coins[action.target_player] == max_coins])
+                return state.rng.choice([action for action in thefts if state.player_coins[action.target_player] == max_coins])
         
-        return random.choice(valid_actions)
+        return state.rng.choice(valid_actions)
     
-    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: list[Counter], action_is_block: bool = False) -> Counter:
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
+        belief = state.belief
+        cards = state.player_cards[self.name]
+
         if action_is_block:
-            if random.random() < 0.2:
-                return Counter(self.name, True, True, False)
+            if belief is not None:
+                held = belief.probability(state.seat_of[action.active_player], ACTION_IDX_BLOCKER[belief.action_type], state.seat_of[self.name], cards)
+                if held < 0.25:
+                    return interned_counter(self.name, True, True, False)
+                if held > 0.75:
+                    return interned_counter(self.name, False, False, False)
+            if state.rng.random() < 0.2:
+                return interned_counter(self.name, True, True, False)
             else:
-                return Counter(self.name, False, False, False)
-            
-        cards = state.player_cards[self.name]
+                return interned_counter(self.name, False, False, False)
 
         if action.type == 1 and 4 in cards:
             # block foreign aid
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         if action.type == 5 and 3 in cards:
             # block assassination
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         if action.type == 4 and (0 in cards or 2 in cards):
             # block theft
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         
-        if random.random() < 0.4:
-            counter = random.choice(valid_counters)
+        counters = valid_counters
+        if belief is not None and action.type in ACTION_IDX_CARD:
+            held = belief.probability(state.seat_of[action.active_player], (ACTION_IDX_CARD[action.type],), state.seat_of[self.name], cards)
+            if held < 0.25:
+                return interned_counter(self.name, True, True, True)
+            if held > 0.75:
+                counters = tuple(counter for counter in valid_counters if not counter.challenge)
+
+        if state.rng.random() < 0.4:
+            counter = state.rng.choice(counters)
             return counter
         
-        return Counter(self.name, False, False, True)
+        return interned_counter(self.name, False, False, True)
         
     def get_discard(self, state: State, history: list[Event]) -> int:
 
@@ -148,42 +165,44 @@ class HeuristicPlayer(Player):
         if len(discards) == 2:
             return discards
         
-        return random.sample(list(range(len(cards))), k=2)
+        return state.rng.sample(list(range(len(cards))), k=2)
 
 
 class GreedyPlayer(Player):
     """A player that always assassinates an opponent when possible, taxes otherwise, uses counteractions when it has the appropriate cards, and never challenges."""
 
-    def get_action(self, state: State, history: list[Event], valid_actions: list[Action]) -> Action:
+    reads_history = False
+
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
         cards = state.player_cards[self.name]
-        assassinations = [action for action in valid_actions if action.type == 5]
+        assassinations = valid_actions.by_type[5]
         if len(assassinations) > 0:
             max_cards = max([len(state.player_cards[action.target_player]) for action in assassinations])
-            return random.choice([action for action in assassinations if len(state.player_cards[action.target_player]) == max_cards])
+            return state.rng.choice([action for action in assassinations if len(state.player_cards[action.target_player]) == max_cards])
         
-        tax = [action for action in valid_actions if action.type == 2]
+        tax = valid_actions.by_type[2]
         if tax:
             return tax[0]
         
-        return random.choice(valid_actions)
+        return state.rng.choice(valid_actions)
     
-    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: list[Counter], action_is_block: bool = False) -> Counter:
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
         if action_is_block:
-            return Counter(self.name, False, False, False)
+            return interned_counter(self.name, False, False, False)
             
         cards = state.player_cards[self.name]
 
         if action.type == 1 and 4 in cards:
             # block foreign aid
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         if action.type == 5 and 3 in cards:
             # block assassination
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         if action.type == 4 and (0 in cards or 2 in cards):
             # block theft
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         
-        return Counter(self.name, False, False, True)
+        return interned_counter(self.name, False, False, True)
         
     def get_discard(self, state: State, history: list[Event]) -> int:
         cards = state.player_cards[self.name]
@@ -216,37 +235,39 @@ class GreedyPlayer(Player):
 class PiratePlayer(Player):
     """A player that always assassinates an opponent when possible, steals from the richest opponent otherwise, uses counteractions when it has the appropriate cards, and never challenges."""
 
-    def get_action(self, state: State, history: list[Event], valid_actions: list[Action]) -> Action:
-        assassinations = [action for action in valid_actions if action.type == 5]
+    reads_history = False
+
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
+        assassinations = valid_actions.by_type[5]
         if len(assassinations) > 0:
             max_cards = max([len(state.player_cards[action.target_player]) for action in assassinations])
-            return random.choice([action for action in assassinations if len(state.player_cards[action.target_player]) == max_cards])
+            return state.rng.choice([action for action in assassinations if len(state.player_cards[action.target_player]) == max_cards])
         
-        thefts = [action for action in valid_actions if action.type == 4]
+        thefts = valid_actions.by_type[4]
         if len(thefts) > 0:
             max_coins = max([state.player_coins[action.target_player] for action in thefts])
             if max_coins > 0:
-                return random.choice([action for action in thefts if state.player_coins[action.target_player] == max_coins])
+                return state.rng.choice([action for action in thefts if state.player_coins[action.target_player] == max_coins])
         
-        return random.choice(valid_actions)
+        return state.rng.choice(valid_actions)
     
-    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: list[Counter], action_is_block: bool = False) -> Counter:
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
         if action_is_block:
-            return Counter(self.name, False, False, False)
+            return interned_counter(self.name, False, False, False)
             
         cards = state.player_cards[self.name]
 
         if action.type == 1 and 4 in cards:
             # block foreign aid
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         if action.type == 5 and 3 in cards:
             # block assassination
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         if action.type == 4 and (0 in cards or 2 in cards):
             # block theft
-            return Counter(self.name, True, False, True)
+            return interned_counter(self.name, True, False, True)
         
-        return Counter(self.name, False, False, True)
+        return interned_counter(self.name, False, False, True)
         
     def get_discard(self, state: State, history: list[Event]) -> int:
         cards = state.player_cards[self.name]
@@ -281,15 +302,39 @@ class RandomPlayer(Player):
     A player that selects actions at random.
     """
 
-    def get_action(self, state: State, history: list[Event], valid_actions: list[Action]) -> Action:
-        return random.choice(valid_actions)
+    reads_history = False
+
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
+        return state.rng.choice(valid_actions)
 
-    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: list[Counter], action_is_block: bool = False) -> Counter:
-        return random.choice(valid_counters)
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
+        return state.rng.choice(valid_counters)
 
     def get_discard(self, state: State, history: list[Event]) -> int:
-        return random.choice([0, 1])
+        return state.rng.choice([0, 1])
 
     def get_discard_pair(self, state: State, history: list[Event]) -> list[int]:
         cards = state.player_cards[self.name]
-        return random.choice(list(combinations(range(len(cards)), 2)))
+        return state.rng.choice(list(combinations(range(len(cards)), 2)))
+
+
+def player_class(player_type: str) -> type[Player]:
+    """Returns the class of the players of player_type: r(andom), g(reedy), h(euristic), p(irate) or m(cts). Defaults to greedy."""
+    match player_type:
+        case "r":
+            return RandomPlayer
+        case "h":
+            return HeuristicPlayer
+        case "p":
+            return PiratePlayer
+        case "m":
+            # imported here, as the search plays its rollouts on the engine, which imports this module
+            from coup.ismcts import ISMCTSPlayer
+            return ISMCTSPlayer
+        case _:
+            return GreedyPlayer
+
+
+def make_players(player_type: str, player_count: int) -> list[Player]:
+    """Returns player_count players of player_type (see player_class)."""
+    return [player_class(player_type)(f"Player {i+1}") for i in range(player_count)]
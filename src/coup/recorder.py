@@ -0,0 +1,288 @@
+import os
+import struct
+import numpy as np
+from array import array
+from typing import TYPE_CHECKING
+
+from coup.encoding import ACCEPT, BLOCK, CHALLENGE, DISCARD_PAIRS
+from coup.representations import State, StateStorage
+
+if TYPE_CHECKING:
+    from coup.coup import Coup
+
+MAX_PLAYERS: int = 6
+
+# every record is RECORD_SIZE int8 values: the record kind, a seat (-1 if none), 14 kind-specific values, then the state of
+# the game as of the record (hands and discards indexed by seat, with -1 for empty slots; seats past player_count are 0)
+RECORD_SIZE: int = 64
+RECORD_DTYPE: np.dtype = np.dtype([('kind', 'i1'), ('seat', 'i1'), ('data', 'i1', (14,)), ('hands', 'i1', (MAX_PLAYERS, 4)),
+                                   ('coins', 'i1', (MAX_PLAYERS,)), ('discards', 'i1', (MAX_PLAYERS, 2)), ('padding', 'i1', (6,))])
+
+# record kinds and their data (unused values are 0):
+#   GAME     seat -1, data [player_count, agent_idx]; its state is the deal
+#   TURN     the actor, data [action type, target seat, counter_1 seat (-1 if none), counter_1 kind (see counter_kind),
+#            seats queried for counter_1 (a bitmask), counter_2 seat (-1 if none), seats queried for counter_2 (a bitmask),
+#            then the seat (-1 if none) and hand index of up to 2 chosen discards, then for an exchange the 2 cards drawn
+#            and the index in DISCARD_PAIRS of the cards returned (-1 otherwise)]; its state is the one the turn left
+#   OUTCOME  the winner (-1 if none), data [round % 128, round // 128, truncated, end reason (see the end reasons)]
+# A game is a GAME record, a TURN record per turn and an OUTCOME record. Coin changes, lost cards and the cards redrawn
+# after winning a challenge are the differences between the states of consecutive records.
+GAME: int = 0
+TURN: int = 1
+OUTCOME: int = 2
+
+# end reasons: a single player was left standing, the agent was eliminated with several players left (ending the episode
+# though not the game), or the round cap was passed
+WON: int = 0
+AGENT_ELIMINATED: int = 1
+ROUND_CAP: int = 2
+
+# the dtype of the entries of the index file: the chunk holding a game, the record the game starts at, and its length
+INDEX_DTYPE: np.dtype = np.dtype([('chunk', '<i8'), ('offset', '<i8'), ('length', '<i8')])
+
+# the kind, seat and data of each record kind, zero-padded to 16 bytes
+_GAME_HEAD: struct.Struct = struct.Struct("4b12x")
+_TURN_HEAD: struct.Struct = struct.Struct("16b")
+_OUTCOME_HEAD: struct.Struct = struct.Struct("6b10x")
+_NO_DISCARDS: tuple[int, ...] = (-1, 0, -1, 0)
+_NO_DISCARD: tuple[int, int] = (-1, 0)
+_NO_EXCHANGE: tuple[int, ...] = (-1, -1, -1)
+_DISCARD_PAIR_INDEX: dict[tuple[int, int], int] = {pair : k for k, pair in enumerate(DISCARD_PAIRS)}
+# the byte offsets in a record of the hands, coins and discards
+_HANDS: int = RECORD_DTYPE.fields['hands'][1]
+_COINS: int = RECORD_DTYPE.fields['coins'][1]
+_DISCARDS: int = RECORD_DTYPE.fields['discards'][1]
+# the byte offsets of the hand sizes, discard counts and deck past the record in the buffers of state_storage
+_HAND_SIZES: int = RECORD_SIZE
+_DISCARD_COUNTS: int = _HAND_SIZES + MAX_PLAYERS
+_DECK: int = _DISCARD_COUNTS + MAX_PLAYERS
+
+
+def chunk_path(directory: str, chunk: int) -> str:
+    return os.path.join(directory, f"chunk_{chunk:05d}.bin")
+
+
+def index_path(directory: str) -> str:
+    return os.path.join(directory, "index.bin")
+
+
+def read_index(directory: str) -> np.ndarray:
+    """Returns the index of every game recorded in directory, as an array of INDEX_DTYPE."""
+    return np.fromfile(index_path(directory), dtype=INDEX_DTYPE)
+
+
+def action_index(player_count: int, seat: int, action_type: int, target: int) -> int:
+    """
+    Returns the index in the action space of a Coup env with player_count players of an action taken by the player in
+    seat, as if that player were the agent (see Coup._decode_action).
+    """
+    if action_type < 4:
+        return action_type
+    return 4 + (action_type - 4) * (player_count - 1) + target - (target > seat)
+
+
+class GameRecorder:
+    """
+    Streams the games played by Coup envs to disk as fixed-width int8 records (see RECORD_DTYPE and the record kinds).
+
+    Records are written in place into a preallocated block of RECORD_DTYPE rows, and the block is written out once at
+    least buffer_records of its rows are pending. Games are appended to chunk files of about chunk_records records (a
+    game never spans two chunks), and every finished game gets an entry in the index file. Both are append-only: a
+    recorder reopening a directory starts a new chunk after the existing ones. A game that is abandoned before it ends
+    (the env is reset mid-game) is dropped.
+
+    An env that keeps its games in the recorder's state_storage (as Coup(recorder=...) does) has its state laid out as in
+    a record, and every record copies it in one slice before packing its head; the state of any other env (e.g. one of a
+    VecCoup) is copied a slice per array.
+
+    Attach a recorder with Coup(recorder=...), which calls start_game, record_turn and end_game as its games go on; call
+    close (or use it as a context manager) to flush the last games.
+    """
+
+    def __init__(self, directory: str, chunk_records: int = 1 << 20, buffer_records: int = 1 << 14) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory: str = directory
+        self.chunk_records: int = chunk_records
+        self.buffer_records: int = buffer_records
+
+        self.chunk: int = 0
+        while os.path.exists(chunk_path(directory, self.chunk)):
+            self.chunk += 1
+        self.chunk_file = open(chunk_path(directory, self.chunk), "ab")
+        self.index_file = open(index_path(directory), "ab")
+
+        # records already written to the current chunk file, and the pending index entries
+        self.chunk_written: int = 0
+        self.index: array = array('q')
+        # the pending records are the first rows of block, which has room for the longest game past buffer_records (it
+        # grows if needed); rows past them are all zeros, so that the seats past a game's player count are 0
+        self.block: np.ndarray = np.zeros((buffer_records + 512,), dtype=RECORD_DTYPE)
+        self.rows: int = 0
+        # the bytes of block, as int8 to take the slices of the State arrays
+        self.view: memoryview = memoryview(self.block.view(np.int8))
+
+        # row of block of the start of the game being recorded (-1 if none), and its offset in the chunk
+        self.game_start: int = -1
+        self.game_offset: int = 0
+        # the seat of the agent of the current game (-1 if none)
+        self.agent_idx: int = -1
+        # the ends of the hands, coins and discards of the current game's players in a record
+        self.extents: tuple[int, int, int] = (_HANDS, _COINS, _DISCARDS)
+        # the storage last handed out by state_storage, the record its State arrays are slices of, and whether the
+        # current game keeps its state there
+        self.storage: StateStorage | None = None
+        self.image: memoryview | None = None
+        self.in_image: bool = False
+        self.games_recorded: int = 0
+
+    @property
+    def chunk_length(self) -> int:
+        """The number of records of the current chunk, including the pending ones."""
+        return self.chunk_written + self.rows
+
+    def state_storage(self, player_count: int) -> StateStorage:
+        """
+        Returns buffers for the States of the games of an env with player_count players (see Coup.set_state_storage) that
+        lay their hands, coins and discards out as they are in a record, so that the state is recorded in one slice.
+        """
+        n = player_count
+        buffer = memoryview(bytearray(_DECK + 5)).cast('b')
+        self.image = buffer[:RECORD_SIZE]
+        self.storage = StateStorage(buffer[_COINS:_COINS + n], buffer[_HANDS:_HANDS + 4 * n], buffer[_HAND_SIZES:_HAND_SIZES + n],
+                                    buffer[_DISCARDS:_DISCARDS + 2 * n], buffer[_DISCARD_COUNTS:_DISCARD_COUNTS + n], buffer[_DECK:_DECK + 5])
+        return self.storage
+
+    def start_game(self, env: 'Coup') -> None:
+        if self.game_start >= 0:
+            # the previous game was abandoned
+            self.block[self.game_start:self.rows] = 0
+            self.rows = self.game_start
+        if self.chunk_length >= self.chunk_records:
+            self._next_chunk()
+
+        n = env.player_count
+        self.game_start = self.rows
+        self.game_offset = self.chunk_length
+        self.agent_idx = env.agent_idx
+        self.extents = (_HANDS + 4 * n, _COINS + n, _DISCARDS + 2 * n)
+        self.in_image = self.storage is not None and env.state_storage is self.storage
+
+        offset = self._write_state(env.game_state)
+        _GAME_HEAD.pack_into(self.view, offset, GAME, -1, env.player_count, env.agent_idx)
+
+    def record_turn(self, env: 'Coup') -> None:
+        """Records the turn env has just simulated and the state it left."""
+        gs: State = env.game_state
+        seat_of = gs.seat_of
+        action = env.current_action
+        counter_1 = env.current_counter_1
+        counter_2 = env.current_counter_2
+
+        queried_1 = 0
+        for seat in env.current_counter_1_queried:
+            queried_1 |= 1 << seat
+        queried_2 = 0
+        for seat in env.current_counter_2_queried:
+            queried_2 |= 1 << seat
+        if counter_1.attempted:
+            counter_1_seat, counter_1_kind = seat_of[counter_1.active_player], CHALLENGE if counter_1.challenge else BLOCK
+        else:
+            counter_1_seat, counter_1_kind = -1, ACCEPT
+        discard_seat_1, discard_1, discard_seat_2, discard_2 = _NO_DISCARDS
+        if env.current_discard:
+            chosen = iter(env.current_discard.items())
+            discard_seat_1, discard_1 = next(chosen)
+            discard_seat_2, discard_2 = next(chosen, _NO_DISCARD)
+        drawn_1, drawn_2, pair = _NO_EXCHANGE
+        if env.current_discard_pair:
+            # the drawn cards are gone from the state by now, but they end the initial cards of the turn's last event
+            initial_cards = env.history[-1].initial_cards
+            drawn_1, drawn_2, pair = initial_cards[-2], initial_cards[-1], _DISCARD_PAIR_INDEX[tuple(sorted(env.current_discard_pair))]
+
+        offset = self._write_state(gs)
+        _TURN_HEAD.pack_into(self.view, offset, TURN, seat_of[action.active_player], action.type, seat_of[action.target_player], counter_1_seat, counter_1_kind, queried_1,
+                             seat_of[counter_2.active_player] if counter_2.attempted else -1, queried_2,
+                             discard_seat_1, discard_1, discard_seat_2, discard_2, drawn_1, drawn_2, pair)
+
+    def end_game(self, gs: State, round: int, truncated: bool) -> None:
+        """Records the outcome of the current game, which ended in gs, and why it ended (see the end reasons)."""
+        if self.game_start < 0:
+            return
+        if gs.alive_count() == 1:
+            winner, reason = gs.alive.bit_length() - 1, WON
+        elif self.agent_idx >= 0 and not gs.is_alive(self.agent_idx):
+            winner, reason = -1, AGENT_ELIMINATED
+        else:
+            winner, reason = -1, ROUND_CAP
+        offset = self._write_state(gs)
+        _OUTCOME_HEAD.pack_into(self.view, offset, OUTCOME, winner, round % 128, round // 128, truncated, reason)
+
+        self.index.extend((self.chunk, self.game_offset, self.chunk_length - self.game_offset))
+        self.game_start = -1
+        self.games_recorded += 1
+        if self.rows >= self.buffer_records:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes out the records of every finished game."""
+        end = self.rows if self.game_start < 0 else self.game_start
+        self.chunk_file.write(self.view[:end * RECORD_SIZE])
+        self.chunk_file.flush()
+        self.index_file.write(self.index.tobytes())
+        self.index_file.flush()
+        self.chunk_written += end
+        del self.index[:]
+        # the game in progress moves to the start of the block
+        left = self.rows - end
+        self.block[:left] = self.block[end:self.rows]
+        self.block[left:self.rows] = 0
+        self.rows = left
+        if self.game_start >= 0:
+            self.game_start = 0
+
+    def close(self) -> None:
+        if not self.chunk_file.closed:
+            self.flush()
+            self.chunk_file.close()
+            self.index_file.close()
+
+    def __enter__(self) -> 'GameRecorder':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _next_chunk(self) -> None:
+        self.flush()
+        self.chunk_file.close()
+        self.chunk += 1
+        self.chunk_file = open(chunk_path(self.directory, self.chunk), "ab")
+        self.chunk_written = 0
+
+    def _write_state(self, gs: State) -> int:
+        """
+        Adds a record with the hands, coins and discards of gs to the block, and returns the byte offset of the record,
+        whose head (its kind, seat and data) is left to the caller. The block may grow, so self.view is only valid after.
+        """
+        rows = self.rows
+        if rows == len(self.block):
+            self._grow()
+        self.rows = rows + 1
+        offset = rows * RECORD_SIZE
+        view = self.view
+        if self.in_image:
+            # the head of the image is all zeros, and is packed over by the caller
+            view[offset:offset + RECORD_SIZE] = self.image
+        else:
+            hands_end, coins_end, discards_end = self.extents
+            view[offset + _HANDS:offset + hands_end] = gs.hands
+            view[offset + _COINS:offset + coins_end] = gs.coins
+            view[offset + _DISCARDS:offset + discards_end] = gs.discards
+        return offset
+
+    def _grow(self) -> None:
+        block = np.zeros((2 * len(self.block),), dtype=RECORD_DTYPE)
+        block[:self.rows] = self.block[:self.rows]
+        self.view.release()
+        self.block = block
+        self.view = memoryview(block.view(np.int8))
@@ -1,72 +1,262 @@
 from abc import ABC, abstractmethod
-import random
 import numpy as np
+from array import array
+from collections.abc import Mapping
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Iterator, NamedTuple
+
+from coup.encoding import ACCEPT, CHALLENGE, EventEncoder, counter_kind, get_encoder
+from coup.rng import BlockRandom
+
+if TYPE_CHECKING:
+    from coup.belief import BeliefTracker
 
 
 class State:
     """
-    Represents the state of the game.\n
+    Represents the state of the game. Players are referred to by their seat, i.e. their index in seats.\n
     Fields:\n
-    players\n
+    seats\n
+    names\n
+    seat_of\n
+    coins\n
+    hands\n
+    hand_sizes\n
+    discards\n
+    discard_counts\n
     deck\n
-    player_cards\n
-    player_discards\n
-    player_coins\n
-    current_player
+    alive\n
+    current\n
+    rng\n
+    belief
     """
-    def __init__(self, players: list['Player']) -> None:
+
+    __slots__ = ('seats', 'names', 'seat_of', 'coins', 'hands', 'hand_sizes', 'discards', 'discard_counts', 'deck', 'alive', 'current',
+                 'rng', 'belief', 'player_cards', 'player_discards', 'player_coins')
+
+    def __init__(self, players: list['Player'], dealt: dict[int, tuple[int, int]] | None = None, rng: BlockRandom | None = None,
+                 storage: 'StateStorage | None' = None) -> None:
+        """
+        dealt optionally fixes the starting hands of some seats; every other seat draws its hand from the deck.
+        rng is the game's random number generator, used for every draw from the deck and by the bots.
+        storage optionally holds the int8 buffers to keep the per-player fields and the deck in, rather than arrays of the
+        State's own (see StateStorage); they are overwritten with the new game.
+        """
         assert len(players) <= 6
 
-        self.players = players
+        player_count = len(players)
+
+        self.seats: list[Player] = players
+        self.names: tuple[str, ...] = tuple(player.name for player in players)
+        self.seat_of: dict[str, int] = {name : i for i, name in enumerate(self.names)}
+
+        # all per-player fields are int8 arrays (or the buffers of storage) indexed by seat; hands hold up to 4 cards (during an exchange) and discards
+        # up to 2, so seat i's hand is hands[4 * i : 4 * i + hand_sizes[i]] and unused slots are -1
+        if storage is None:
+            self.coins: array = array('b', [2] * player_count)
+            self.hands: array = array('b', [-1] * (4 * player_count))
+            self.hand_sizes: array = array('b', [0] * player_count)
+            self.discards: array = array('b', [-1] * (2 * player_count))
+            self.discard_counts: array = array('b', [0] * player_count)
+            # number of copies of each role left in the deck
+            self.deck: array = array('b', [3] * 5)
+        else:
+            self.coins, self.hands, self.hand_sizes, self.discards, self.discard_counts, self.deck = storage
+            self.coins[:] = array('b', [2] * player_count)
+            self.hands[:] = array('b', [-1] * (4 * player_count))
+            self.hand_sizes[:] = array('b', [0] * player_count)
+            self.discards[:] = array('b', [-1] * (2 * player_count))
+            self.discard_counts[:] = array('b', [0] * player_count)
+            self.deck[:] = array('b', [3] * 5)
+        # bit i is set while seat i still holds a card
+        self.alive: int = (1 << player_count) - 1
+        # seat of the player whose turn it is
+        self.current: int = 0
+        self.rng: BlockRandom = rng if rng is not None else BlockRandom()
+        # what the public events say about everyone's cards, if the engine tracks it (see BeliefTracker)
+        self.belief: 'BeliefTracker | None' = None
+
+        # read-only views keyed by player name, for Player implementations
+        self.player_cards: Mapping[str, list[int]] = _SeatView(self, self.cards)
+        self.player_discards: Mapping[str, list[int]] = _SeatView(self, self.discarded)
+        self.player_coins: Mapping[str, int] = _SeatView(self, self.coins.__getitem__)
+
+        dealt = dealt or {}
+        for seat, cards in dealt.items():
+            for card in cards:
+                assert self.deck[card] > 0
+                self.deck[card] -= 1
+                self.hands[4 * seat + self.hand_sizes[seat]] = card
+                self.hand_sizes[seat] += 1
+        for seat in range(player_count):
+            if seat not in dealt:
+                self.draw_cards(seat, 2)
 
-        self.deck: list[int] = list(range(5)) * 3
-        random.shuffle(self.deck)
+    def encode(self, idx: int, player_count: int) -> np.ndarray[np.float32]:
+        encoding = np.empty((20 + 12 * player_count,), dtype=np.float32)
+        self.encode_into(encoding, idx, player_count)
+        return encoding
 
-        self.player_cards: dict[str, list[int]] = {}
-        self.player_discards: dict[str, list[int]] = {}
-        self.player_coins: dict[str, int] = {}
-        
-        for player in players:
-            self.player_cards[player.name] = [self.deck.pop(), self.deck.pop()]
-            self.player_discards[player.name] = []
-            self.player_coins[player.name] = 2
+    def encode_into(self, encoding: np.ndarray, idx: int, player_count: int) -> None:
+        """Writes the encoding of the state as seen by the player in seat idx into encoding, of size 20 + 12 * player_count."""
+        encoding[:] = 0
+        hands, discards = self.hands, self.discards
 
-        self.current_player = players[0]
-    
-    def encode(self, idx: int, player_count: int) -> np.ndarray[np.float32]:
-        _, _, player_cards, player_discards, player_coins, _ = vars(self).values()
-        player_names = list(player_discards.keys())
-        name = player_names[idx]
-        our_cards = player_cards[name]
-
-        encoding = np.zeros((20 + 12 * player_count,))
-
-        # fill [0 : 10] with information about our_cards
-        if len(player_cards[name]) > 0:
-            encoding[our_cards[0]] = 1
-        if len(player_cards[name]) > 1:
-            encoding[our_cards[1] + 5] = 1
-        # fill [10 : 20] with more information about our_cards (if during an exchange)
-        if len(player_cards[name]) > 2:
-            encoding[our_cards[2] + 10] = 1
-        if len(player_cards[name]) > 3:
-            encoding[our_cards[3] + 15] = 1
-        # fill [20 : 20 + player_count] with information about player_coins
-        for i in range(player_count):
-            player_name = player_names[i]
-            encoding[20 + i] = player_coins[player_name] / 12
-        # fill [20 + player_count : 20 + 11 * player_count] entries with information about player_discards
+        # fill [0 : 10] with information about our_cards, and [10 : 20] during an exchange
+        for i in range(self.hand_sizes[idx]):
+            encoding[5 * i + hands[4 * idx + i]] = 1
+        coins, discard_counts = self.coins, self.discard_counts
         for i in range(player_count):
-            player_name = player_names[i]
-            if len(player_discards[player_name]) > 0:
-                encoding[20 + player_count + 10 * i + player_discards[player_name][0]] = 1
-            if len(player_discards[player_name]) > 1:
-                encoding[20 + player_count + 10 * i + 5 + player_discards[player_name][1]] = 1
+            # fill [20 : 20 + player_count] with information about player_coins
+            encoding[20 + i] = coins[i] / 12
+            # fill [20 + player_count : 20 + 11 * player_count] entries with information about player_discards
+            for j in range(discard_counts[i]):
+                encoding[20 + player_count + 10 * i + 5 * j + discards[2 * i + j]] = 1
         # fill [20 + 11 * player_count : 20 + 12 * player_count] with information about which player you are
         encoding[20 + 11 * player_count + idx] = 1
 
-        return encoding
+    def cards(self, seat: int) -> list[int]:
+        """Returns the cards held by the player in seat."""
+        return self.hands[4 * seat:4 * seat + self.hand_sizes[seat]].tolist()
+
+    def discarded(self, seat: int) -> list[int]:
+        """Returns the cards discarded by the player in seat."""
+        return self.discards[2 * seat:2 * seat + self.discard_counts[seat]].tolist()
+
+    def is_alive(self, seat: int) -> bool:
+        return bool(self.alive >> seat & 1)
+
+    def alive_count(self) -> int:
+        return self.alive.bit_count()
+
+    def turn_order(self) -> list[int]:
+        """Returns the seats of the players still in the game, starting with the current player."""
+        player_count = len(self.seats)
+        alive = self.alive
+        return [seat for seat in _RING[player_count][self.current] if alive >> seat & 1]
+
+    def advance(self) -> None:
+        """Passes the turn to the next player still in the game and clears the coins of eliminated players."""
+        player_count = len(self.seats)
+        alive = self.alive
+        for seat in range(player_count):
+            if not alive >> seat & 1:
+                self.coins[seat] = 0
+        for seat in _RING[player_count][self.current][1:] + (self.current,):
+            if alive >> seat & 1:
+                self.current = seat
+                return
+
+    def draw_cards(self, seat: int, count: int) -> None:
+        """Deals count cards from the deck to the end of the hand of the player in seat."""
+        deck = self.deck
+        for _ in range(count):
+            r = self.rng.randrange(sum(deck))
+            card = 0
+            while r >= deck[card]:
+                r -= deck[card]
+                card += 1
+            deck[card] -= 1
+            self.hands[4 * seat + self.hand_sizes[seat]] = card
+            self.hand_sizes[seat] += 1
+
+    def lose_card(self, seat: int, card_idx: int) -> None:
+        """Moves the card at card_idx in the hand of the player in seat to their discards."""
+        hand = self.cards(seat)
+        if len(hand) < 2: card_idx = 0
+        self.discards[2 * seat + self.discard_counts[seat]] = hand.pop(card_idx)
+        self.discard_counts[seat] += 1
+        self._set_hand(seat, hand)
+        if not hand:
+            self.alive &= ~(1 << seat)
+
+    def return_cards(self, seat: int, card_idxs: list[int]) -> None:
+        """Returns the cards at card_idxs in the hand of the player in seat to the deck."""
+        hand = self.cards(seat)
+        for idx in card_idxs:
+            self.deck[hand[idx]] += 1
+        self._set_hand(seat, [card for i, card in enumerate(hand) if i not in card_idxs])
+
+    @property
+    def snapshot_size(self) -> int:
+        """The length of the arrays returned by snapshot: 9 values per seat, the deck, alive and current."""
+        return 9 * len(self.seats) + 7
+
+    def snapshot(self) -> array:
+        """
+        Returns the coins, hands, discards, deck, alive seats and current seat as a flat int8 array of snapshot_size values,
+        in that order. restore brings this State (or any State with the same seats) back to that position. The rng is not
+        part of it.
+        """
+        snapshot = array('b')
+        for field in (self.coins, self.hands, self.hand_sizes, self.discards, self.discard_counts, self.deck):
+            snapshot.frombytes(field)
+        snapshot.append(self.alive)
+        snapshot.append(self.current)
+        return snapshot
+
+    def restore(self, snapshot: array) -> None:
+        """Sets every field captured by snapshot back in place; only the first snapshot_size values of snapshot are read."""
+        n = len(self.seats)
+        self.coins[:] = snapshot[:n]
+        self.hands[:] = snapshot[n:5 * n]
+        self.hand_sizes[:] = snapshot[5 * n:6 * n]
+        self.discards[:] = snapshot[6 * n:8 * n]
+        self.discard_counts[:] = snapshot[8 * n:9 * n]
+        self.deck[:] = snapshot[9 * n:9 * n + 5]
+        self.alive = snapshot[9 * n + 5]
+        self.current = snapshot[9 * n + 6]
+
+    def _set_hand(self, seat: int, hand: list[int]) -> None:
+        self.hands[4 * seat:4 * seat + 4] = array('b', hand + [-1] * (4 - len(hand)))
+        self.hand_sizes[seat] = len(hand)
+
+    @property
+    def players(self) -> list['Player']:
+        """The players still in the game, starting with the current player."""
+        return [self.seats[seat] for seat in self.turn_order()]
+
+    @property
+    def current_player(self) -> 'Player':
+        return self.seats[self.current]
+
+
+class StateStorage(NamedTuple):
+    """
+    Writable int8 buffers of the per-player fields and the deck of a State (see State for their layouts), e.g. memoryviews
+    of the rows of (N, ...) NumPy arrays shared by N games (see VecCoup).
+    """
+
+    coins: memoryview
+    hands: memoryview
+    hand_sizes: memoryview
+    discards: memoryview
+    discard_counts: memoryview
+    deck: memoryview
+
+
+class _SeatView(Mapping):
+    """A read-only mapping from player names to a per-seat field of a State."""
+
+    __slots__ = ('state', 'get')
+
+    def __init__(self, state: State, get: Callable[[int], Any]) -> None:
+        self.state: State = state
+        self.get: Callable[[int], Any] = get
+
+    def __getitem__(self, name: str) -> Any:
+        return self.get(self.state.seat_of[name])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.state.names)
+
+    def __len__(self) -> int:
+        return len(self.state.names)
+
+
+# _RING[player_count][seat] lists every seat in turn order starting from seat
+_RING: list[list[tuple[int, ...]]] = [[tuple((seat + i) % n for i in range(n)) for seat in range(n)] for n in range(7)]
+
 
 class Event(ABC):
     """
@@ -80,11 +270,16 @@ class Event(ABC):
     def encode(self, state: State, player_count: int) -> np.ndarray[np.float32]:
         pass
 
+    @abstractmethod
+    def encode_into(self, out: np.ndarray, state: State, encoder: EventEncoder) -> None:
+        """Sets the one-hot entries of the event in out, a turn row of size encoder.event_dim (see EventEncoder)."""
+        pass
+
 
-@dataclass
+@dataclass(frozen=True)
 class Action(Event):
     """
-    Represents an action.\n
+    Represents an action. Actions are immutable, and the ones handed out by the engine are interned (see interned_action).\n
     Fields:\n
     active_player\n
     target_player\n
@@ -96,38 +291,19 @@ class Action(Event):
     type: int
 
     def encode(self, state: State, player_count: int) -> np.ndarray[np.float32]:
-        encoding = np.zeros((4 * player_count + 4,))
-        active, target, action_type = vars(self).values()
-        player_names = list(state.player_discards.keys())
-
-        # encode the sender
-        encoding[player_names.index(active)] = 1
-
-        # encode the action_type along with target
-        if action_type == 0:
-            encoding[player_count] = 1
-        elif action_type == 1:
-            encoding[player_count + 1] = 1
-        elif action_type == 2:
-            encoding[player_count + 2] = 1
-        elif action_type == 3:
-            encoding[player_count + 3] = 1
-        elif action_type == 4:
-            encoding[player_count + 4 + player_names.index(target)] = 1
-        elif action_type == 5:
-            encoding[2 * player_count + 4 + player_names.index(target)] = 1 
-        elif action_type == 6:
-            encoding[3 * player_count + 4 + player_names.index(target)] = 1
-        else:
-            exit(1)
+        encoder = get_encoder(player_count)
+        encoding = np.zeros((encoder.event_dim,), dtype=np.float32)
+        self.encode_into(encoding, state, encoder)
+        return encoding[encoder.action_slice]
 
-        return encoding
+    def encode_into(self, out: np.ndarray, state: State, encoder: EventEncoder) -> None:
+        encoder.encode_action(out, state.seat_of[self.active_player], self.type, state.seat_of[self.target_player])
 
 
-@dataclass
+@dataclass(frozen=True)
 class Counter(Event):
     """
-    Represents a challenge or a block.\n
+    Represents a challenge or a block. Counters are immutable, and can be interned with interned_counter.\n
     Fields:\n
     active_player\n
     attempted\n
@@ -141,38 +317,19 @@ class Counter(Event):
     counter_1: bool  # true if the counter is a 1st order counter, false if counter-counter
 
     def encode(self, state: State, player_count: int) -> np.ndarray[np.float32]:
-        active, attempted, challenge, counter_1 = vars(self).values()
-
-        if counter_1:
-            encoding = np.zeros((3 + player_count,))
-            
-            # encode accept / challenge / block
-            if not attempted:
-                encoding[0] = 1
-            elif challenge:
-                encoding[1] = 1
-            else:
-                encoding[2] = 1
-
-            # encode the blocker
-            if attempted:
-                player_names = list(state.player_discards.keys())
-                encoding[3 + player_names.index(active)] = 1
-
+        encoder = get_encoder(player_count)
+        encoding = np.zeros((encoder.event_dim,), dtype=np.float32)
+        self.encode_into(encoding, state, encoder)
+        return encoding[encoder.counter_1_slice if self.counter_1 else encoder.counter_2_slice]
+
+    def encode_into(self, out: np.ndarray, state: State, encoder: EventEncoder) -> None:
+        if self.counter_1:
+            kind = counter_kind(self.attempted, self.challenge)
         else:
-            encoding = np.zeros((2 + player_count,))
-
-            if not attempted:
-                encoding[0] = 1
-            else:
-                encoding[1] = 1
-
-            # encode the blocker
-            if attempted:
-                player_names = list(state.player_discards.keys())
-                encoding[2 + player_names.index(active)] = 1
-
-        return encoding
+            kind = CHALLENGE if self.attempted else ACCEPT
+        # an accept does not encode who accepted, and may not name a player at all
+        actor = state.seat_of[self.active_player] if self.attempted else 0
+        encoder.encode_counter(out, self.counter_1, kind, actor)
     
 
 @dataclass
@@ -190,40 +347,51 @@ class DiscardPair(Event):
     discard_idxs: list[int]
 
     def encode(self, state: State, player_count: int) -> np.ndarray[np.float32]:
-        encoding = np.zeros((26,))
-        _, initial_cards, discard_idxs = vars(self).values()
-
-        for i, card in enumerate(initial_cards):
-            encoding[5 * i + card] = 1
-
-        # encode the card_idxs
-        idxs_to_encoding = {frozenset({0, 1}): 20,
-                            frozenset({0, 2}): 21,
-                            frozenset({0, 3}): 22,
-                            frozenset({1, 2}): 23,
-                            frozenset({1, 3}): 24,
-                            frozenset({2, 3}): 25}
-        
-        encoding[idxs_to_encoding[frozenset(discard_idxs)]] = 1
+        encoder = get_encoder(player_count)
+        encoding = np.zeros((encoder.event_dim,), dtype=np.float32)
+        self.encode_into(encoding, state, encoder)
+        return encoding[encoder.discard_pair_slice]
 
-        return encoding
+    def encode_into(self, out: np.ndarray, state: State, encoder: EventEncoder) -> None:
+        encoder.encode_discard_pair(out, self.initial_cards, self.discard_idxs)
     
 
+class ValidActions(tuple):
+    """
+    The legal actions for a decision, as an immutable sequence in the order generate_valid_actions lists them.\n
+    Fields:\n
+    by_type: by_type[t] holds the legal actions of type t, in the same order
+    """
+
+    def __new__(cls, actions: list[Action]) -> 'ValidActions':
+        self = super().__new__(cls, actions)
+        self.by_type: tuple[tuple[Action, ...], ...] = tuple(tuple(a for a in actions if a.type == t) for t in range(7))
+        self._members: frozenset[Action] = frozenset(actions)
+        return self
+
+    def __contains__(self, action: object) -> bool:
+        return action in self._members
+
+
 class Player(ABC):
     """
     Interface for players.
     """
 
+    # whether the player's decisions depend on the history they are given; games among players that don't read it skip
+    # keeping it (see Coup.simulate_games)
+    reads_history: bool = True
+
     def __init__(self, name: str = 'Bot') -> None:
         self.name: str = name
 
     @abstractmethod
-    def get_action(self, state: State, history: list[Event], valid_actions: list[Action]) -> Action:
+    def get_action(self, state: State, history: list[Event], valid_actions: ValidActions) -> Action:
         """Selects a valid action given a game state and history."""
         pass
 
     @abstractmethod
-    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: list[Counter], action_is_block: bool = False) -> Counter:
+    def get_counter(self, action: Action, state: State, history: list[Event], valid_counters: tuple[Counter, ...], action_is_block: bool = False) -> Counter:
         """Decides whether to take a counteraction given a game state and history."""
         pass
 
@@ -0,0 +1,54 @@
+import numpy as np
+from typing import Sequence, TypeVar
+
+T = TypeVar('T')
+
+
+class BlockRandom:
+    """
+    The random number generator owned by a game (see State.rng), offering the subset of the random module's interface the
+    engine and the bots use.
+
+    Uniform floats are drawn from a seeded NumPy generator block_size at a time and handed out one by one, so a draw costs
+    a list pop instead of a call into the generator. randrange, choice and sample are built on top of random.
+    """
+
+    def __init__(self, seed: int | None = None, block_size: int = 1024) -> None:
+        self.block_size: int = block_size
+        self.seed(seed)
+
+    def seed(self, seed: int | None = None) -> None:
+        """Restarts the stream from seed (from fresh OS entropy if seed is None)."""
+        self.generator: np.random.Generator = np.random.default_rng(seed)
+        self.block: list[float] = []
+
+    def random(self) -> float:
+        """Returns a uniform float in [0, 1)."""
+        block = self.block
+        if not block:
+            self._refill()
+        return block.pop()
+
+    def randrange(self, n: int) -> int:
+        """Returns a uniform integer in [0, n)."""
+        block = self.block
+        if not block:
+            self._refill()
+        return int(block.pop() * n)
+
+    def choice(self, seq: Sequence[T]) -> T:
+        block = self.block
+        if not block:
+            self._refill()
+        return seq[int(block.pop() * len(seq))]
+
+    def sample(self, population: Sequence[T], k: int) -> list[T]:
+        """Returns k distinct elements of population in random order."""
+        pool = list(population)
+        result = []
+        for _ in range(k):
+            result.append(pool.pop(int(self.random() * len(pool))))
+        return result
+
+    def _refill(self) -> None:
+        self.block.extend(self.generator.random(self.block_size).tolist())
@@ -1,5 +1,6 @@
-from coup.representations import Action, Counter, Player
-import random
+from functools import lru_cache
+
+from coup.representations import Action, Counter, State, ValidActions
 
 # maps action number representation to name of action; i.e. ACTION_NAMES[i] gives the name of the action represented by i
 ACTION_NAMES: list[str] = ['Income', 'Foreign Aid', 'Tax', 'Exchange', 'Steal', 'Assassinate', 'Coup']
@@ -13,39 +14,71 @@ CARD_NAMES: list[str] = ['Ambassador', 'Assassin', 'Captain', 'Contessa', 'Duke'
 # maps card names to associated indices
 CARD_INDICES: dict[str, int] = {'Ambassador' : 0, 'Assassin' : 1, 'Captain' : 2, 'Contessa' : 3, 'Duke' : 4}
 
+# maps phase number representation to name of phase; i.e. PHASE_NAMES[i] gives the name of the phase represented by i
+PHASE_NAMES: list[str] = ['action', 'counter_1', 'counter_2', 'discard', 'discard_pair']
+
+# phase number representations
+ACTION_PHASE: int = 0
+COUNTER_1_PHASE: int = 1
+COUNTER_2_PHASE: int = 2
+DISCARD_PHASE: int = 3
+DISCARD_PAIR_PHASE: int = 4
+
+# action number representations that can be blocked / challenged (-1 represents a block)
+BLOCKABLE_ACTIONS: tuple[int, ...] = (1, 4, 5)
+CHALLENGEABLE_ACTIONS: tuple[int, ...] = (2, 3, 4, 5, -1)
+
 # maps action number representation to associated card
 ACTION_IDX_CARD: dict[int, int] = {2 : 4, 3 : 0, 4 : 2, 5 : 1}
 
 # maps action number representation to card that blocks it
 ACTION_IDX_BLOCKER: dict[int, list[int]] = {1 : [4], 4 : [0, 2], 5 : [3]}
 
-def generate_valid_actions(current_player: Player, players: list[Player], player_coins: dict[str, int], player_cards: dict[str, list[int]]) -> list[Action]:
+def generate_valid_actions(state: State) -> ValidActions:
     """
     Return all possible actions of the form (p1, p2, type) where
 
     p1 = current player
     p2 = any other player that is still alive
     type = the type of action 
+
+    The legal actions only depend on the coin bucket of p1 (< 3, < 7, < 10 or >= 10 coins), on who is alive and on which
+    other players have coins to steal, so the result is cached on those.
     """
-    p1 = current_player.name
-    other_players = [p2.name for p2 in players if p2.name != p1 and len(player_cards[p2.name]) > 0]
+    current = state.current
+    coins = state.coins[current]
+    coin_bucket = 0 if coins < 3 else 1 if coins < 7 else 2 if coins < 10 else 3
+    alive = state.alive
+    with_coins = 0
+    for seat, seat_coins in enumerate(state.coins):
+        if seat_coins > 0:
+            with_coins |= 1 << seat
+
+    return _valid_actions(state.names, current, coin_bucket, alive, with_coins & alive & ~(1 << current))
+
+@lru_cache(maxsize=1 << 16)
+def _valid_actions(names: tuple[str, ...], current: int, coin_bucket: int, alive: int, with_coins: int) -> ValidActions:
+    player_count = len(names)
+    p1 = names[current]
+    other_seats = [seat % player_count for seat in range(current + 1, current + player_count) if alive >> (seat % player_count) & 1]
+    other_players = [names[seat] for seat in other_seats]
 
     possible_actions = []
 
-    if player_coins[p1] >= 10:
-        return [Action(p1, p2, 6) for p2 in other_players]
-    if player_coins[p1] >= 3:
-        possible_actions += [Action(p1, p2, 5) for p2 in other_players]
-    if player_coins[p1] >= 7:
-        possible_actions += [Action(p1, p2, 6) for p2 in other_players]
+    if coin_bucket == 3:
+        return ValidActions([interned_action(p1, p2, 6) for p2 in other_players])
+    if coin_bucket >= 1:
+        possible_actions += [interned_action(p1, p2, 5) for p2 in other_players]
+    if coin_bucket >= 2:
+        possible_actions += [interned_action(p1, p2, 6) for p2 in other_players]
     
-    possible_actions += [Action(p1, p1, 0), Action(p1, p1, 1), Action(p1, p1, 2), Action(p1, p1, 3)]
+    possible_actions += [interned_action(p1, p1, 0), interned_action(p1, p1, 1), interned_action(p1, p1, 2), interned_action(p1, p1, 3)]
 
-    possible_actions += [Action(p1, p2.name, 4) for p2 in players if p2.name != p1 and player_coins[p2.name] > 0]
+    possible_actions += [interned_action(p1, names[seat], 4) for seat in other_seats if with_coins >> seat & 1]
 
-    return possible_actions
+    return ValidActions(possible_actions)
 
-def generate_valid_counters(player_name: str, action: Action) -> list[Counter]:
+def generate_valid_counters(player_name: str, action: Action) -> tuple[Counter, ...]:
     """
     Return all possible counters of the form (player_name, attempted, challenge, counter_1) where
 
@@ -53,19 +86,36 @@ def generate_valid_counters(player_name: str, action: Action) -> list[Counter]:
     attempted = boolean whether player chose to block
     challenge = True if player challenges, or False if player claims a role to block
     counter_1 = True if counter is against action, False if against other counter
+
+    The result only depends on player_name and the type of action, and is cached on those.
     """
 
-    counter_1 = (action.type >= 0)
+    return _valid_counters(player_name, action.type)
+
+@lru_cache(maxsize=1 << 12)
+def _valid_counters(player_name: str, action_type: int) -> tuple[Counter, ...]:
+
+    counter_1 = (action_type >= 0)
+
+    possible_counters = [interned_counter(player_name, False, False, counter_1)]
 
-    possible_counters = [Counter(player_name, False, False, counter_1)]
+    if action_type in BLOCKABLE_ACTIONS:
+        possible_counters += [interned_counter(player_name, True, False, True)]
 
-    if action.type in [1, 4, 5]:
-        possible_counters += [Counter(player_name, True, False, True)]
+    if action_type in CHALLENGEABLE_ACTIONS:
+        possible_counters += [interned_counter(player_name, True, True, counter_1)]
 
-    if action.type in [2, 3, 4, 5, -1]:
-        possible_counters += [Counter(player_name, True, True, counter_1)]
+    return tuple(possible_counters)
 
-    return possible_counters
+@lru_cache(maxsize=1 << 12)
+def interned_action(active_player: str, target_player: str, action_type: int) -> Action:
+    """Returns the shared Action with the given fields."""
+    return Action(active_player, target_player, action_type)
+
+@lru_cache(maxsize=1 << 12)
+def interned_counter(active_player: str, attempted: bool, challenge: bool, counter_1: bool) -> Counter:
+    """Returns the shared Counter with the given fields."""
+    return Counter(active_player, attempted, challenge, counter_1)
 
 def action_bluffed(action_type: int, active_cards: list[int]) -> bool:
     return not ACTION_IDX_CARD[action_type] in active_cards
@@ -73,40 +123,30 @@ def action_bluffed(action_type: int, active_cards: list[int]) -> bool:
 def counter_1_bluffed(action_type: int, counter_cards: list[int]) -> bool:
     return not bool(set(ACTION_IDX_BLOCKER[action_type]).intersection(set(counter_cards)))
 
-def income(player_name: str, player_coins: dict[str, int]) -> None:
-    player_coins[player_name] += 1
-
-def foreign_aid(player_name: str, player_coins: dict[str, int]) -> None:
-    player_coins[player_name] += 2
-
-def tax(player_name: str, player_coins: dict[str, int]) -> None:
-    player_coins[player_name] += 3
-
-def steal(player1_name: str, player2_name: str, player_coins: dict[str, int]) -> None:
-    player_coins[player1_name] += min(player_coins[player2_name], 2)
-    player_coins[player2_name] -= min(player_coins[player2_name], 2)
-
-def coup(player1_name: str, player2_name: str, player_coins: dict[str, int], player_cards: dict[str, list[int]], card_idx: int, player_discards: dict[str, list[int]]) -> None:
-    player_coins[player1_name] -= 7
-    if len(player_cards[player2_name]) < 2: card_idx = 0
-    lost_card = player_cards[player2_name].pop(card_idx)
-    player_discards[player2_name].append(lost_card)
-
-def assassinate(player1_name: str, player2_name: str, player_coins: dict[str, int], player_cards: dict[str, list[int]], card_idx: int, player_discards: dict[str, list[int]]) -> None:
-    player_coins[player1_name] -= 3
-    if len(player_cards[player2_name]) < 2: card_idx = 0
-    lost_card = player_cards[player2_name].pop(card_idx)
-    player_discards[player2_name].append(lost_card)
-
-def lose_challenge(player_name: str, player_cards: dict[str, list[int]], card_idx: int, player_discards: dict[str, list[int]]) -> None:
-    if len(player_cards[player_name]) < 2: card_idx = 0
-    lost_card = player_cards[player_name].pop(card_idx)
-    player_discards[player_name].append(lost_card)
-
-def exchange(player_name: str, player_cards: dict[str, list[int]], cards: list[int], cards_idxs: list[int], deck: list[int]) -> None:
-    discards = [cards[idx] for idx in cards_idxs]
-    for idx in cards_idxs:
-        cards[idx] = None
-    player_cards[player_name] = [c for c in cards if c != None]
-    deck += discards
-    random.shuffle(deck)
\ No newline at end of file
+def income(state: State, player: int) -> None:
+    state.coins[player] += 1
+
+def foreign_aid(state: State, player: int) -> None:
+    state.coins[player] += 2
+
+def tax(state: State, player: int) -> None:
+    state.coins[player] += 3
+
+def steal(state: State, player1: int, player2: int) -> None:
+    stolen = min(state.coins[player2], 2)
+    state.coins[player1] += stolen
+    state.coins[player2] -= stolen
+
+def coup(state: State, player1: int, player2: int, card_idx: int) -> None:
+    state.coins[player1] -= 7
+    state.lose_card(player2, card_idx)
+
+def assassinate(state: State, player1: int, player2: int, card_idx: int) -> None:
+    state.coins[player1] -= 3
+    state.lose_card(player2, card_idx)
+
+def lose_challenge(state: State, player: int, card_idx: int) -> None:
+    state.lose_card(player, card_idx)
+
+def exchange(state: State, player: int, cards_idxs: list[int]) -> None:
+    state.return_cards(player, cards_idxs)
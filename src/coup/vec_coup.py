@@ -0,0 +1,123 @@
+import numpy as np
+import torch
+from gymnasium import spaces
+from typing import Any, Callable
+
+from coup.coup import Coup
+from coup.representations import StateStorage
+
+
+class VecCoup:
+    """
+    Steps N games of Coup in lockstep.
+
+    This is a batching wrapper around N Coup envs, not a vectorized engine: step runs every game's Coup.step in turn,
+    bots included, so the games play no more turns per second than N separate envs would. What it batches is the agent's
+    side, so that one network forward serves every game, and it keeps the games' state in shared arrays. The bots have
+    no batched decision path.
+
+    A single call to step takes an (N, action_dim) batch of Q-values, advances every game (including all of the bot turns
+    up to each agent's next decision) and returns (N, observation_dim) observations along with (N,) rewards and done flags.
+    Games that finish are reset automatically; the final observation and info of a finished game are kept in its info dict
+    under 'final_observation' and 'final_info'.
+
+    The state of every game is kept in (N, ...) int8 arrays indexed by game then seat: coins, hands, hand_sizes, discards,
+    discard_counts and decks are the storage of the games' States (see Coup.set_state_storage), which read and write their
+    rows in place, and phases is brought up to date by every reset and step. Reading them copies nothing. The bots decide
+    game by game, on their game's State and with their game's own generator, so a game plays out exactly as it would in
+    a lone Coup env reset with the same seed.
+
+    action_masks holds the (N, action_dim) legal-action masks of the pending decision of every game.
+
+    Every game writes its observations in place into its row of observations (see Coup.set_observation_buffer), which
+    may be a caller-owned (N, observation_dim) float32 array, e.g. in shared memory.
+    """
+
+    def __init__(self, num_envs: int, player_count: int, round_cap: int = 100, history_length: int = 10, mask_observation: bool = False,
+                 track_beliefs: bool = False, make_options: Callable[[], dict[str, Any]] | None = None,
+                 observations: np.ndarray[np.float32] | None = None) -> None:
+        self.num_envs: int = num_envs
+        self.player_count: int = player_count
+        # every game is a Coup env with the given constructor arguments, so VecCoup(num_envs, **env.config()) steps games like env's
+        self.envs: list[Coup] = [Coup(player_count, round_cap, history_length, mask_observation, track_beliefs=track_beliefs) for _ in range(num_envs)]
+
+        # make_options returns the reset options for a new game, e.g. a fresh list of opponents; None uses the Coup defaults
+        self.make_options: Callable[[], dict[str, Any]] | None = make_options
+
+        self.single_action_space: spaces.Box = self.envs[0].action_space
+        self.single_observation_space: spaces.Box = self.envs[0].observation_space
+        self.action_space = spaces.Box(low=0, high=1, shape=(num_envs,) + self.single_action_space.shape, dtype=np.float32)
+        self.observation_space = spaces.Box(low=0, high=1, shape=(num_envs,) + self.single_observation_space.shape, dtype=np.float32)
+
+        self.observations: np.ndarray[np.float32] = observations if observations is not None else np.zeros(self.observation_space.shape, dtype=np.float32)
+        for env, row in zip(self.envs, self.observations):
+            env.set_observation_buffer(row)
+        self.rewards: np.ndarray[np.float32] = np.zeros((num_envs,), dtype=np.float32)
+        self.terminated: np.ndarray[bool] = np.zeros((num_envs,), dtype=bool)
+        self.truncated: np.ndarray[bool] = np.zeros((num_envs,), dtype=bool)
+        self.action_masks: np.ndarray[bool] = np.zeros(self.action_space.shape, dtype=bool)
+
+        # (N, player_count) coins of each player; hands (N, player_count, 4) and discards (N, player_count, 2) list the cards
+        # held and discarded by each player, with -1 in empty slots; decks (N, 5) count the copies of each role left
+        self.coins: np.ndarray[np.int8] = np.zeros((num_envs, player_count), dtype=np.int8)
+        self.hands: np.ndarray[np.int8] = np.full((num_envs, player_count, 4), -1, dtype=np.int8)
+        self.hand_sizes: np.ndarray[np.int8] = np.zeros((num_envs, player_count), dtype=np.int8)
+        self.discards: np.ndarray[np.int8] = np.full((num_envs, player_count, 2), -1, dtype=np.int8)
+        self.discard_counts: np.ndarray[np.int8] = np.zeros((num_envs, player_count), dtype=np.int8)
+        self.decks: np.ndarray[np.int8] = np.zeros((num_envs, 5), dtype=np.int8)
+        # (N,) current phase of each game (see PHASE_NAMES)
+        self.phases: np.ndarray[np.int8] = np.zeros((num_envs,), dtype=np.int8)
+        fields = (self.coins, self.hands, self.hand_sizes, self.discards, self.discard_counts, self.decks)
+        for i, env in enumerate(self.envs):
+            env.set_state_storage(StateStorage(*(memoryview(field[i].reshape(-1)) for field in fields)))
+
+    def reset(self, seed: int | None = None, options: list[dict[str, Any]] | None = None) -> tuple[np.ndarray[np.float32], list[dict[str, Any]]]:
+        """
+        Resets every game. options, if given, holds one Coup reset options dict per game.
+        """
+
+        infos = []
+        for i, env in enumerate(self.envs):
+            env_seed = None if seed is None else seed + i
+            env_options = options[i] if options is not None else self._make_options()
+            _, info = env.reset(seed=env_seed, options=env_options)
+            self.action_masks[i] = info['action_mask']
+            self.phases[i] = env.phase
+            infos.append(info)
+
+        return self.observations, infos
+
+    def step(self, actions: torch.Tensor | np.ndarray) -> tuple[np.ndarray[np.float32], np.ndarray[np.float32], np.ndarray[bool], np.ndarray[bool], list[dict[str, Any]]]:
+        """
+        Advances every game by one agent decision. actions is an (N, action_dim) batch of Q-values.
+
+        Returns (observations, rewards, terminated, truncated, infos). The returned arrays are reused between calls, so copy
+        them if they need to outlive the next step.
+        """
+
+        infos = []
+        for i, env in enumerate(self.envs):
+            observation, reward, terminated, truncated, info = env.step(actions[i])
+            self.rewards[i] = reward
+            self.terminated[i] = terminated
+            self.truncated[i] = truncated
+
+            if terminated or truncated:
+                # the reset overwrites the game's row of observations
+                final_observation, final_info = observation.copy(), info
+                _, info = env.reset(options=self._make_options())
+                info['final_observation'] = final_observation
+                info['final_info'] = final_info
+
+            self.action_masks[i] = info['action_mask']
+            self.phases[i] = env.phase
+            infos.append(info)
+
+        return self.observations, self.rewards, self.terminated, self.truncated, infos
+
+    def close(self) -> None:
+        for env in self.envs:
+            env.close()
+
+    def _make_options(self) -> dict[str, Any] | None:
+        return self.make_options() if self.make_options is not None else None
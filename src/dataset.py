@@ -0,0 +1,317 @@
+import numpy as np
+import torch
+from itertools import count
+from typing import Iterator
+
+from agent import Transition
+from coup.encoding import ACCEPT, BLOCK, CHALLENGE, DISCARD_PAIRS, EXCHANGE_PAIR_MASKS, EventEncoder, get_encoder
+from coup.recorder import RECORD_DTYPE, TURN, chunk_path, read_index
+from coup.utils import ACTION_PHASE, BLOCKABLE_ACTIONS, CHALLENGEABLE_ACTIONS, COUNTER_1_PHASE, COUNTER_2_PHASE, DISCARD_PAIR_PHASE, DISCARD_PHASE
+
+
+class OfflineDataset:
+    """
+    The transitions of the games recorded by a GameRecorder in directory, rebuilt for offline training of a DQN.
+
+    Every decision a seat took in a recorded game with player_count players becomes a (state, action, next_state,
+    reward, next_mask, done) transition, encoded exactly as Coup.step would have returned it had that seat been the agent:
+    observations match Coup._observation (with the given history_length and mask_observation), actions are indices into
+    the action space, and rewards follow Coup._reward with reward_hyperparameters. The history of a seat holds the events
+    the engine recorded in that game (including the accepts of the game's actual agent) and its own discard pairs.
+
+    seats selects whose decisions are used: "all", "agent" (the seat of the game's agent) or "bots" (every other seat).
+    Games recorded by Coup.simulate_games have no agent, so all their seats are bots.
+    A seat's last decision becomes a terminal transition if the seat lost or won the game; if the game ended otherwise
+    (the agent was eliminated, or it was truncated) that decision is dropped, as its next state is unknown.
+
+    Chunk files are memory-mapped, and the transitions are rebuilt a block of games at a time with vectorized numpy
+    operations, so the dataset may be much larger than memory.
+    """
+
+    def __init__(self, directory: str, player_count: int, history_length: int = 10, mask_observation: bool = False, seats: str = "all",
+                 reward_hyperparameters: list[float] = [0.1, -0.05, 1, -0.5, 20], device: torch.device = torch.device("cpu")) -> None:
+        if seats not in ("all", "agent", "bots"):
+            raise ValueError(f"seats must be all, agent or bots, not {seats}")
+
+        self.directory: str = directory
+        self.player_count: int = player_count
+        self.history_length: int = history_length
+        self.mask_observation: bool = mask_observation
+        self.seats: str = seats
+        self.reward_hyperparameters: list[float] = reward_hyperparameters
+        self.device: torch.device = device
+
+        self.encoder: EventEncoder = get_encoder(player_count)
+        self.state_size: int = 20 + 12 * player_count + history_length * self.encoder.event_dim
+        self.action_count: int = 14 + 3 * player_count
+        if mask_observation:
+            self.state_size += self.action_count
+
+        self.chunks: dict[int, np.memmap] = {}
+        # keep the games played with player_count players, read from their GAME records
+        index = read_index(directory)
+        keep = np.zeros((len(index),), dtype=bool)
+        for chunk in np.unique(index['chunk']):
+            in_chunk = index['chunk'] == chunk
+            keep[in_chunk] = self._chunk(chunk)[index['offset'][in_chunk]]['data'][:, 0] == player_count
+        self.games: np.ndarray = index[keep]
+
+    def __len__(self) -> int:
+        """The number of games in the dataset."""
+        return len(self.games)
+
+    def batches(self, batch_size: int, epochs: int | None = 1, games_per_block: int = 512, seed: int | None = None) -> Iterator[Transition]:
+        """
+        Yields shuffled minibatches of batch_size transitions as a Transition of tensors on the dataset's device, like
+        ReplayBuffer.sample. Every epoch visits the games in a new random order, games_per_block at a time, and shuffles
+        the transitions of each block (along with those left over from the previous block); epochs=None repeats forever.
+        """
+        rng = np.random.default_rng(seed)
+        leftover = None
+        for _ in (count() if epochs is None else range(epochs)):
+            order = rng.permutation(len(self.games))
+            for start in range(0, len(order), games_per_block):
+                block = self.build(order[start:start + games_per_block])
+                if leftover is not None:
+                    block = tuple(np.concatenate(arrays) for arrays in zip(leftover, block))
+                size = len(block[0])
+                tensors = [torch.from_numpy(array).to(self.device) for array in block]
+                permutation = torch.from_numpy(rng.permutation(size)).to(self.device)
+                end = size - size % batch_size
+                for i in range(0, end, batch_size):
+                    idxs = permutation[i:i + batch_size]
+                    yield Transition(*(tensor[idxs] for tensor in tensors))
+                leftover = tuple(array[permutation[end:].cpu().numpy()] for array in block)
+
+    def build(self, games: np.ndarray) -> tuple[np.ndarray, ...]:
+        """
+        Rebuilds the transitions of the games at the given positions of self.games, as numpy arrays (states, actions,
+        next_states, rewards, next_masks, dones) ordered by game, seat and time.
+        """
+        entries = self.games[np.sort(games)]
+        records = np.concatenate([self._chunk(chunk)[offset:offset + length] for chunk, offset, length in entries.tolist()])
+        return self._rebuild(records, entries['length'])
+
+    def _chunk(self, chunk: int) -> np.memmap:
+        if chunk not in self.chunks:
+            self.chunks[chunk] = np.memmap(chunk_path(self.directory, chunk), dtype=RECORD_DTYPE, mode='r')
+        return self.chunks[chunk]
+
+    def _rebuild(self, records: np.ndarray, lengths: np.ndarray) -> tuple[np.ndarray, ...]:
+        n = self.player_count
+        encoder = self.encoder
+
+        # the turns of every game, numbered globally; the state before a turn is that of the record preceding it
+        game_rows = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        turn_rows = np.flatnonzero(records['kind'] == TURN)
+        turn_game = np.searchsorted(game_rows, turn_rows, side='right') - 1
+        first_turn = np.searchsorted(turn_rows, game_rows)
+        agent_seats = records['data'][game_rows, 1].astype(np.int64)
+        T = len(turn_rows)
+        turns = np.arange(T)
+
+        data = records['data'][turn_rows].astype(np.int64)
+        actors = records['seat'][turn_rows].astype(np.int64)
+        types, targets = data[:, 0], data[:, 1]
+        counter_1_seats, counter_1_kinds, queried_1 = data[:, 2], data[:, 3], data[:, 4]
+        counter_2_seats, queried_2 = data[:, 5], data[:, 6]
+        pairs = data[:, 13]
+
+        # the public part of every turn's history row, as it stands when the action, the counter_1 and the counter_2
+        # events have been appended (see Coup._append_history): a counter_1 is appended if it was attempted or if the
+        # agent accepted it, and a counter_2 whenever the counter_2 phase ran, i.e. the counter_1 was a block
+        action_rows = np.zeros((T, encoder.event_dim), dtype=np.float32)
+        encoder.encode_actions(action_rows, turns, actors, types, targets)
+        counter_1_rows = action_rows.copy()
+        attempted = counter_1_seats >= 0
+        encoder.encode_counters(counter_1_rows, turns[attempted], True, counter_1_kinds[attempted], counter_1_seats[attempted])
+        # games played by Coup.simulate_games have no agent (an agent seat of -1), so nobody's accepts are appended
+        turn_agents = agent_seats[turn_game]
+        agent_accepted = ~attempted & (turn_agents >= 0) & (queried_1 >> np.maximum(turn_agents, 0) & 1 == 1)
+        encoder.encode_counters(counter_1_rows, turns[agent_accepted], True, np.full(agent_accepted.sum(), ACCEPT), np.zeros(agent_accepted.sum(), dtype=np.int64))
+        public_rows = counter_1_rows.copy()
+        blocked = attempted & (counter_1_kinds == BLOCK)
+        encoder.encode_counters(public_rows, turns[blocked], False, np.where(counter_2_seats[blocked] >= 0, CHALLENGE, ACCEPT), np.maximum(counter_2_seats[blocked], 0))
+
+        # the discard pair of every exchange, which only its actor sees; its initial cards are the actor's hand followed
+        # by the 2 cards drawn
+        exchanges = np.flatnonzero(pairs >= 0)
+        exchange_of_turn = np.full((T,), -1, dtype=np.int64)
+        exchange_of_turn[exchanges] = np.arange(len(exchanges))
+        initial_cards = records['hands'][turn_rows[exchanges] - 1, actors[exchanges]].astype(np.int64)
+        hand_sizes = (initial_cards >= 0).sum(axis=1)
+        initial_cards[np.arange(len(exchanges)), hand_sizes] = data[exchanges, 11]
+        initial_cards[np.arange(len(exchanges)), hand_sizes + 1] = data[exchanges, 12]
+        exchange_rows = np.zeros((len(exchanges), encoder.event_dim), dtype=np.float32)
+        encoder.encode_discard_pairs(exchange_rows, np.arange(len(exchanges)), initial_cards, np.array(DISCARD_PAIRS)[pairs[exchanges]])
+
+        # every decision as (turn, seat, phase, action index), in the order they were taken within each seat's game
+        discards_1, discards_2 = data[:, 7] >= 0, data[:, 9] >= 0
+        queried_1_turns, queried_1_seats = np.nonzero(queried_1[:, None] >> np.arange(n) & 1)
+        queried_2_turns, queried_2_seats = np.nonzero(queried_2[:, None] >> np.arange(n) & 1)
+        decision_turns = np.concatenate((turns, queried_1_turns, queried_2_turns, turns[discards_1], turns[discards_2], exchanges))
+        decision_seats = np.concatenate((actors, queried_1_seats, queried_2_seats, data[discards_1, 7], data[discards_2, 9], actors[exchanges]))
+        phases = np.repeat([ACTION_PHASE, COUNTER_1_PHASE, COUNTER_2_PHASE, DISCARD_PHASE, DISCARD_PHASE, DISCARD_PAIR_PHASE],
+                           [T, len(queried_1_turns), len(queried_2_turns), discards_1.sum(), discards_2.sum(), len(exchanges)])
+        # a seat with a single card loses it whichever index it picks
+        discard_idxs = np.concatenate((data[discards_1, 8], data[discards_2, 10]))
+        discard_hand_sizes = (records['hands'][turn_rows[decision_turns[phases == DISCARD_PHASE]] - 1, decision_seats[phases == DISCARD_PHASE]] >= 0).sum(axis=1)
+        actions = np.concatenate((
+            np.where(types < 4, types, 4 + (types - 4) * (n - 1) + targets - (targets > actors)),
+            1 + 3 * n + np.where(counter_1_seats[queried_1_turns] == queried_1_seats, counter_1_kinds[queried_1_turns], ACCEPT),
+            4 + 3 * n + (counter_2_seats[queried_2_turns] == queried_2_seats),
+            6 + 3 * n + np.minimum(discard_idxs, discard_hand_sizes - 1),
+            8 + 3 * n + pairs[exchanges],
+        ))
+
+        decision_games = turn_game[decision_turns]
+        if self.seats != "all":
+            selected = (decision_seats == agent_seats[decision_games]) == (self.seats == "agent")
+            decision_turns, decision_seats, phases, actions, decision_games = decision_turns[selected], decision_seats[selected], phases[selected], actions[selected], decision_games[selected]
+        # phases are numbered in the order their decisions are taken within a turn
+        order = np.lexsort((phases, decision_turns, decision_seats, decision_games))
+        decision_turns, decision_seats, phases, actions, decision_games = decision_turns[order], decision_seats[order], phases[order], actions[order], decision_games[order]
+        N = len(order)
+
+        # the next decision of the same seat in the same game, if any; otherwise the seat's last decision is terminal if the
+        # seat was eliminated (in the turn of that decision, which is its last discard) or won the game (in its last turn)
+        same_seat = (decision_games[1:] == decision_games[:-1]) & (decision_seats[1:] == decision_seats[:-1])
+        has_next = np.append(same_seat, False)[:N]
+        last = np.flatnonzero(~has_next)
+        last_games, last_seats = decision_games[last], decision_seats[last]
+        final_rows = game_rows[last_games] + lengths[last_games] - 1
+        final_hands = records['hands'][final_rows, :n]
+        final_alive = (final_hands >= 0).any(axis=2)
+        eliminated = ~final_alive[np.arange(len(last)), last_seats]
+        won = ~eliminated & (final_alive.sum(axis=1) == 1)
+        terminal = last[eliminated | won]
+        terminal_turns = np.where(eliminated, decision_turns[last], first_turn[last_games] + lengths[last_games] - 3)[eliminated | won]
+
+        # the points observations are taken at: every decision, then the end of the final turn of every terminal seat
+        point_turns = np.concatenate((decision_turns, terminal_turns))
+        point_seats = np.concatenate((decision_seats, decision_seats[terminal]))
+        point_phases = np.concatenate((phases, np.full(len(terminal), -1)))
+        point_state_rows = np.concatenate((turn_rows[decision_turns] - 1, turn_rows[terminal_turns]))
+        point_first_turns = first_turn[np.concatenate((decision_games, decision_games[terminal]))]
+        is_terminal = point_phases < 0
+
+        hands = records['hands'][point_state_rows, :n].astype(np.int64)
+        coins = records['coins'][point_state_rows, :n].astype(np.int64)
+        discards = records['discards'][point_state_rows, :n].astype(np.int64)
+        # while exchanging, the actor holds the cards it drew as well
+        exchanging = np.flatnonzero(point_phases == DISCARD_PAIR_PHASE)
+        exchange_seats = point_seats[exchanging]
+        sizes = (hands[exchanging, exchange_seats] >= 0).sum(axis=1)
+        hands[exchanging, exchange_seats, sizes] = data[point_turns[exchanging], 11]
+        hands[exchanging, exchange_seats, sizes + 1] = data[point_turns[exchanging], 12]
+
+        masks = self._action_masks(point_phases, point_seats, types[point_turns], hands, coins, discards)
+        parts = [self._encode_states(point_seats, hands, coins, discards),
+                 self._encode_histories(point_turns, point_seats, point_phases, point_first_turns, actors, exchange_of_turn,
+                                        action_rows, counter_1_rows, public_rows, exchange_rows)]
+        if self.mask_observation:
+            parts.append(masks.astype(np.float32))
+        observations = np.concatenate(parts, axis=1)
+        rewards = self._rewards(point_seats, hands, coins, is_terminal)
+
+        # a decision's next point is the seat's next decision, or the end of the game for a terminal one
+        next_points = np.arange(1, N + 1)
+        next_points[terminal] = N + np.arange(len(terminal))
+        kept = np.flatnonzero(has_next | np.isin(np.arange(N), terminal))
+        next_points = next_points[kept]
+        return (observations[kept], actions[kept], observations[next_points], rewards[next_points], masks[next_points], is_terminal[next_points])
+
+    def _encode_states(self, seats: np.ndarray, hands: np.ndarray, coins: np.ndarray, discards: np.ndarray) -> np.ndarray:
+        """State.encode of every point, seen from its seat."""
+        n = self.player_count
+        points = np.arange(len(seats))
+        encoding = np.zeros((len(seats), 20 + 12 * n), dtype=np.float32)
+        own = hands[points, seats]
+        rows, slots = np.nonzero(own >= 0)
+        encoding[rows, 5 * slots + own[rows, slots]] = 1
+        encoding[:, 20:20 + n] = coins / 12
+        rows, discarders, slots = np.nonzero(discards >= 0)
+        encoding[rows, 20 + n + 10 * discarders + 5 * slots + discards[rows, discarders, slots]] = 1
+        encoding[points, 20 + 11 * n + seats] = 1
+        return encoding
+
+    def _encode_histories(self, turns: np.ndarray, seats: np.ndarray, phases: np.ndarray, first_turns: np.ndarray, actors: np.ndarray,
+                          exchange_of_turn: np.ndarray, action_rows: np.ndarray, counter_1_rows: np.ndarray, public_rows: np.ndarray,
+                          exchange_rows: np.ndarray) -> np.ndarray:
+        """
+        Coup._encode_history of every point: the row of the point's turn as it stood at its phase (none yet when the
+        action is being chosen), then the full rows of the previous turns, most recent first. A terminal point (phase -1)
+        is taken at the end of its turn, whose row is full.
+        """
+        L = self.history_length
+        history = np.zeros((len(turns), L, self.encoder.event_dim), dtype=np.float32)
+
+        partial = (phases > ACTION_PHASE).astype(np.int64)
+        for phase, rows in ((COUNTER_1_PHASE, action_rows), (COUNTER_2_PHASE, counter_1_rows), (DISCARD_PHASE, public_rows), (DISCARD_PAIR_PHASE, public_rows)):
+            points = np.flatnonzero(phases == phase)
+            history[points, 0] = rows[turns[points]]
+
+        # full rows: turn - j + partial for row j, counting the point's own turn as full if it is terminal
+        latest = turns - (phases >= ACTION_PHASE)
+        full_turns = latest[:, None] - np.arange(L)[None] + partial[:, None]
+        valid = full_turns >= first_turns[:, None]
+        valid[:, 0] &= partial == 0
+        points, rows = np.nonzero(valid)
+        full_turns = full_turns[points, rows]
+        history[points, rows] = public_rows[full_turns]
+        own = (actors[full_turns] == seats[points]) & (exchange_of_turn[full_turns] >= 0)
+        history[points[own], rows[own]] += exchange_rows[exchange_of_turn[full_turns[own]]]
+
+        return history.reshape(len(turns), L * self.encoder.event_dim)
+
+    def _action_masks(self, phases: np.ndarray, seats: np.ndarray, action_types: np.ndarray, hands: np.ndarray, coins: np.ndarray, discards: np.ndarray) -> np.ndarray:
+        """Coup._action_mask of every point; terminal points (phase -1) get an empty mask."""
+        n = self.player_count
+        points = np.arange(len(seats))
+        masks = np.zeros((len(seats), self.action_count), dtype=bool)
+
+        acting = np.flatnonzero(phases == ACTION_PHASE)
+        own_coins = coins[acting, seats[acting]]
+        # targeted actions list the other players in seat order, skipping the actor
+        k = np.arange(n - 1)
+        targets = k[None] + (k[None] >= seats[acting, None])
+        target_alive = (hands[acting[:, None], targets] >= 0).any(axis=2)
+        target_coins = coins[acting[:, None], targets]
+        rich = own_coins >= 10
+        masks[acting, 0:4] = ~rich[:, None]
+        masks[acting, 4:3 + n] = ~rich[:, None] & target_alive & (target_coins > 0)
+        masks[acting, 3 + n:2 + 2 * n] = ~rich[:, None] & target_alive & (own_coins[:, None] >= 3)
+        masks[acting, 2 + 2 * n:1 + 3 * n] = target_alive & (own_coins[:, None] >= 7)
+
+        countering = np.flatnonzero(phases == COUNTER_1_PHASE)
+        masks[countering, 1 + 3 * n] = True
+        masks[countering, 2 + 3 * n] = np.isin(action_types[countering], CHALLENGEABLE_ACTIONS)
+        masks[countering, 3 + 3 * n] = np.isin(action_types[countering], BLOCKABLE_ACTIONS)
+
+        # the counter_2 phase only follows a block, which may always be challenged
+        masks[phases == COUNTER_2_PHASE, 4 + 3 * n:6 + 3 * n] = True
+
+        discarding = np.flatnonzero(phases == DISCARD_PHASE)
+        masks[discarding, 6 + 3 * n] = True
+        masks[discarding, 7 + 3 * n] = discards[discarding, seats[discarding], 0] < 0
+
+        # an exchanger's hand holds the 2 cards it drew on top of the ones it held before
+        exchanging = np.flatnonzero(phases == DISCARD_PAIR_PHASE)
+        held = (hands[exchanging, seats[exchanging]] >= 0).sum(axis=1)
+        masks[exchanging, 8 + 3 * n:] = EXCHANGE_PAIR_MASKS[held - 2]
+
+        return masks
+
+    def _rewards(self, seats: np.ndarray, hands: np.ndarray, coins: np.ndarray, terminal: np.ndarray) -> np.ndarray:
+        """Coup._reward at every point, for its seat."""
+        COIN_VALUE, OPP_COIN_VALUE, CARD_VALUE, OPP_CARD_VALUE, WIN_VALUE = self.reward_hyperparameters
+        points = np.arange(len(seats))
+        hand_sizes = (hands >= 0).sum(axis=2)
+        own_coins, own_cards = coins[points, seats], hand_sizes[points, seats]
+
+        rewards = COIN_VALUE * own_coins + OPP_COIN_VALUE * (coins.sum(axis=1) - own_coins)
+        rewards = rewards + CARD_VALUE * own_cards + OPP_CARD_VALUE * (hand_sizes.sum(axis=1) - own_cards)
+        alive = hand_sizes > 0
+        rewards += WIN_VALUE * (terminal & alive[points, seats] & (alive.sum(axis=1) == 1))
+        rewards -= WIN_VALUE * (terminal & ~alive[points, seats])
+        return rewards.astype(np.float32)
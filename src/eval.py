@@ -2,6 +2,7 @@ import numpy as np
 import gymnasium as gym
 import random
 import math
+import multiprocessing as mp
 import matplotlib
 import matplotlib.pyplot as plt
 from itertools import count
@@ -14,8 +15,38 @@ import torch.nn.functional as F
 
 from agent import DQN
 from coup.coup import Coup
-from coup.player import GreedyPlayer, HeuristicPlayer, RandomPlayer
+from coup.player import GreedyPlayer, HeuristicPlayer, RandomPlayer, make_players
 from coup.utils import *
+from statistics import NormalDist
+from typing import Any
+
+def wilson_interval(wins: int, games: int, confidence: float = 0.95) -> tuple[float, float]:
+    """Wilson score interval of a win rate of wins / games at the given confidence level."""
+    if games == 0:
+        return (0.0, 1.0)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = wins / games
+    center = (p + z * z / (2 * games)) / (1 + z * z / games)
+    half_width = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return (center - half_width, center + half_width)
+
+def spent_alpha(fraction: float, alpha: float) -> float:
+    """
+    The part of the error rate alpha spent once the given fraction of the planned games has been played, following the
+    O'Brien-Fleming-type spending function of Lan and DeMets, 2 - 2 * Phi(z_(1 - alpha / 2) / sqrt(fraction)): almost
+    nothing is spent early on, and all of alpha by the end.
+    """
+    if fraction <= 0:
+        return 0.0
+    return 2 * NormalDist().cdf(-NormalDist().inv_cdf(1 - alpha / 2) / math.sqrt(min(fraction, 1.0)))
+
+def critical_value(alpha: float) -> float:
+    """The two-sided normal critical value of the error rate alpha (infinite if alpha is 0)."""
+    return -NormalDist().inv_cdf(alpha / 2) if alpha > 0 else math.inf
+
+# the 15 possible starting hands (as sorted card pairs) and the probability of being dealt each of them from the full deck
+START_HANDS: list[tuple[int, int]] = [(j, i) for i in range(5) for j in range(i + 1)]
+START_HAND_PROBABILITIES: dict[tuple[int, int], float] = {(j, i) : (6 if i == j else 18) / 210 for (j, i) in START_HANDS}
 
 class Evaluator:
     """A class used to evaluate DQN players for Coup."""
@@ -30,6 +61,10 @@ class Evaluator:
 
         self.games_played: int = 0
         self.games_won: int = 0
+        # the bounds of the win rate interval eval_sequential stopped at, if any
+        self.interval: tuple[float, float] | None = None
+        # the envs of the game slots past the first one (see eval), created as they are first needed
+        self.extra_envs: list[Coup] = []
 
         # stores [games_played, games_won]
         self.games_by_start_hand: dict[tuple[int, int], list[int]] = {}
@@ -38,86 +73,298 @@ class Evaluator:
             for j in range(i + 1):
                 self.games_by_start_hand[(j, i)] = [0, 0]
 
-    def get_start_cards_from_encoding(self, observation: torch.Tensor) -> tuple[int, int]:
-        card1 = (observation[:5] == 1).nonzero().item()
-        card2 = (observation[5:10] == 1).nonzero().item()
+    def get_start_cards_from_encoding(self, observation: np.ndarray) -> tuple[int, int]:
+        card1 = int(np.flatnonzero(observation[:5] == 1)[0])
+        card2 = int(np.flatnonzero(observation[5:10] == 1)[0])
         if card1 > card2:
             card1, card2 = card2, card1
 
         return (card1, card2)
             
 
-    def eval(self, num_episodes: int = -1, player_type: str = "g", display: bool = True):
+    def eval(self, num_episodes: int = -1, player_type: str = "g", display: bool = True, batch_size: int = 1, seed: int | None = None):
+        """
+        Plays num_episodes games against players of player_type and returns the agent's win rate.
+
+        batch_size games are kept in flight at once: every tick stacks the observations of the games still running and
+        picks all of their actions with a single forward pass of the model. The first game slot plays on self.env, and the
+        others on envs of the same configuration (see Coup.config) kept for the following calls.
+
+        If seed is given, the k-th game is reset with seed + k (which also picks the agent's seat), so every game is fully
+        determined by its own seed whatever the batch_size.
+        """
         if num_episodes < 0:
             if torch.backends.mps.is_available():
                 num_episodes = 1000
             else:
                 num_episodes = 50
 
-        for i in range(num_episodes):
-            if i % 50 == 0 and display: print(i)
-
-            agent_idx = random.choice(list(range(self.env.player_count)))
+        slots = min(batch_size, num_episodes)
+        while len(self.extra_envs) < slots - 1:
+            self.extra_envs.append(Coup(**self.env.config()))
+        envs = [self.env] + self.extra_envs[:slots - 1]
+        # every game writes its observations straight into its row of states
+        states = np.zeros((len(envs), self.env.observation_space.shape[0]), dtype=np.float32)
+        for env, row in zip(envs, states):
+            env.set_observation_buffer(row)
+        start_cards = [None] * len(envs)
+        games_started = 0
 
-            match player_type:
-                case "g":
-                    players = [GreedyPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-                case "r":
-                    players = [RandomPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-                case "h":
-                    players = [HeuristicPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-                case _:
-                    players = [GreedyPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
+        def start_game(slot: int) -> None:
+            nonlocal games_started
+            if games_started % 50 == 0 and display: print(games_started)
+            game_seed = None if seed is None else seed + games_started
+            games_started += 1
 
+            agent_idx = self.choose_agent_idx(game_seed)
+            players = make_players(player_type, self.env.player_count)
             options = {'players' : players, 'agent_idx' : agent_idx, 'reward_hyperparameters' : [0.1, -0.05, 1, -0.5, 20]}
 
             # Initialize the environment and get its state
-            state, _ = self.env.reset(options=options)
-            state = torch.tensor(state, dtype=torch.float32, device=self.device)
+            envs[slot].reset(seed=game_seed, options=options)
+            start_cards[slot] = self.get_start_cards_from_encoding(states[slot])
 
-            start_cards = self.get_start_cards_from_encoding(state)
-            
-            state = state.unsqueeze(0)
+        for slot in range(len(envs)):
+            start_game(slot)
+        active = list(range(len(envs)))
+
+        while active:
+            with torch.no_grad():
+                actions = self.model(torch.from_numpy(states[active]).to(self.device))
 
-            for t in count():
-                with torch.no_grad():
-                    action = self.model(state)[0]
-                observation, reward, terminated, truncated, info = self.env.step(action)
-                done = terminated or truncated
+            still_active = []
+            for row, slot in enumerate(active):
+                _, reward, terminated, truncated, info = envs[slot].step(actions[row])
 
-                if terminated:
-                    next_state = None
+                if terminated or truncated:
+                    self.record_game(start_cards[slot], reward >= 20)
+                    if games_started < num_episodes:
+                        start_game(slot)
+                        still_active.append(slot)
                 else:
-                    next_state = torch.tensor(observation, dtype=torch.float32, device=self.device).unsqueeze(0)
-
-                # Move to the next state
-                state = next_state
-
-                if done:
-                    self.games_played += 1
-                    self.games_by_start_hand[start_cards][0] += 1
-                    if reward >= 20:
-                        self.games_won += 1
-                        self.games_by_start_hand[start_cards][1] += 1
-                    break
-            
+                    still_active.append(slot)
+            active = still_active
+        self.env.set_observation_buffer(None)
+
         if display:
-            print(f"win rate: {round(100 * self.games_won / self.games_played, 1)}%")
-            print("win rate by starting hand: ")
+            self.display()
+
+        return self.games_won / self.games_played
+
+    def eval_sequential(self, max_episodes: int = 1000, player_type: str = "g", display: bool = True, batch_size: int = 50,
+                        half_width: float = 0.02, target: float | None = None, confidence: float = 0.95, seed: int | None = None):
+        """
+        Plays games in chunks of batch_size until the win rate is resolved, and returns its estimate stratified by starting
+        hand (see stratified_win_rate).
+
+        After every chunk, an interval around the estimate is checked: play stops once it is no wider than +/- half_width,
+        or, when a target rate is given (e.g. 1 / player_count), once the interval excludes it. Each check only spends its
+        share of the error rate 1 - confidence, as given by spent_alpha over the max_episodes planned games, so that by the
+        union bound the true rate lies in every interval checked along the way with probability at least confidence, and
+        stopping at any of them keeps that guarantee. Early checks thus need a much clearer result than the last ones.
+        At most max_episodes games are played; the number actually played is left in games_played, and the last interval
+        in interval.
+        """
+        alpha = 1 - confidence
+        spent = 0.0
+        while self.games_played < max_episodes:
+            chunk_seed = None if seed is None else seed + self.games_played
+            self.eval(min(batch_size, max_episodes - self.games_played), player_type, display=False, batch_size=batch_size, seed=chunk_seed)
+
+            estimate, error = self.stratified_win_rate()
+            now = spent_alpha(self.games_played / max_episodes, alpha)
+            margin = critical_value(now - spent) * error
+            spent = now
+            self.interval = (max(estimate - margin, 0.0), min(estimate + margin, 1.0))
+            if margin <= half_width or (target is not None and not self.interval[0] <= target <= self.interval[1]):
+                break
+
+        estimate = self.stratified_win_rate()[0]
+        if display:
+            low, high = self.interval or (0.0, 1.0)
+            print(f"stopped after {self.games_played} games: stratified win rate {round(100 * estimate, 1)}% [{round(100 * low, 1)}%, {round(100 * high, 1)}%]")
+            self.display()
+
+        return estimate
+
+    def stratified_win_rate(self) -> tuple[float, float]:
+        """
+        Returns the win rate over the games played so far and its standard error, stratified by starting hand: the rate of
+        every hand is weighted by the probability of being dealt it (START_HAND_PROBABILITIES) rather than by how often it
+        happened to be dealt, which takes the luck of the deal out of the estimate. Hands not dealt yet count at the rate of
+        all games. The standard error uses rates shrunk by one win and one loss, so that a hand won or lost every time so far
+        doesn't count as certain.
+        """
+        estimate, variance = 0.0, 0.0
+        unseen = 0.0
+        for cards, (played, won) in self.games_by_start_hand.items():
+            weight = START_HAND_PROBABILITIES[cards]
+            if played == 0:
+                unseen += weight
+                continue
+            estimate += weight * won / played
+            shrunk = (won + 1) / (played + 2)
+            variance += weight ** 2 * shrunk * (1 - shrunk) / played
+        if unseen > 0:
+            estimate += unseen * self.games_won / self.games_played
+            shrunk = (self.games_won + 1) / (self.games_played + 2)
+            variance += unseen ** 2 * shrunk * (1 - shrunk) / self.games_played
+        return estimate, math.sqrt(variance)
+
+    def eval_paired(self, other: DQN, games_per_hand: int = 20, player_type: str = "g", display: bool = True, seed: int = 0,
+                    confidence: float = 0.95) -> tuple[float, float, float]:
+        """
+        Compares self.model with other on common random numbers and returns the win rate difference (self.model - other)
+        along with the bounds of its confidence interval.
+
+        Both models play the same games_per_hand games from each of the 15 starting hands: every game fixes the agent's
+        hand and is reset with its own seed for each model, so the seat, the rest of the deal and the
+        opponents' random draws coincide until the models' decisions diverge. The per-hand paired differences are
+        combined with the probability of each starting hand, so the estimate is that of the unstratified difference.
+        self.model's games are also recorded in games_won and games_by_start_hand.
+        """
+        other = other.to(self.device)
+        difference, variance = 0.0, 0.0
+
+        for h, cards in enumerate(START_HANDS):
+            differences = []
+            for k in range(games_per_hand):
+                game_seed = seed + h * games_per_hand + k
+                won = []
+                for model in (self.model, other):
+                    won.append(self.play_game(model, player_type, cards, game_seed))
+                self.record_game(cards, won[0])
+                differences.append(won[0] - won[1])
+
+            weight = START_HAND_PROBABILITIES[cards]
+            difference += weight * float(np.mean(differences))
+            if games_per_hand > 1:
+                variance += weight ** 2 * float(np.var(differences, ddof=1)) / games_per_hand
+
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        low, high = difference - z * math.sqrt(variance), difference + z * math.sqrt(variance)
+
+        if display:
+            print(f"win rate difference: {round(100 * difference, 1)}% [{round(100 * low, 1)}%, {round(100 * high, 1)}%] over {2 * self.games_played} games")
+            self.display()
+
+        return difference, low, high
+
+    def play_game(self, model: DQN, player_type: str, agent_cards: tuple[int, int] | None = None, seed: int | None = None) -> bool:
+        """Plays one game on self.env with model as the agent and returns whether it won."""
+        agent_idx = self.choose_agent_idx(seed)
+        players = make_players(player_type, self.env.player_count)
+        options = {'players' : players, 'agent_idx' : agent_idx, 'reward_hyperparameters' : [0.1, -0.05, 1, -0.5, 20], 'agent_cards' : agent_cards}
+
+        # the env writes its observations straight into state, which the model reads without a copy on the CPU
+        state = torch.zeros((1, self.env.observation_space.shape[0]), dtype=torch.float32)
+        self.env.set_observation_buffer(state)
+        self.env.reset(seed=seed, options=options)
+        while True:
+            with torch.no_grad():
+                action = model(state.to(self.device))[0]
+            _, reward, terminated, truncated, info = self.env.step(action)
+            if terminated or truncated:
+                self.env.set_observation_buffer(None)
+                return reward >= 20
+
+    def choose_agent_idx(self, seed: int | None = None) -> int:
+        """Picks the agent's seat with the env's generator, or as a function of the game's seed if one is given."""
+        if seed is None:
+            return self.env.rng.randrange(self.env.player_count)
+        return random.Random(seed).randrange(self.env.player_count)
+
+    def eval_parallel(self, num_episodes: int = -1, player_type: str = "g", display: bool = True, num_workers: int = 2, seed: int = 0, batch_size: int = 1):
+        """
+        Plays num_episodes games spread over num_workers processes and returns the agent's win rate.
+
+        Game k is played with seed + k (see eval), and every worker plays a contiguous range of games with its own env, of
+        the configuration of self.env (see Coup.config), and a CPU copy of the model, so the merged statistics only depend
+        on seed and not on num_workers.
+        """
+        if num_episodes < 0:
+            if torch.backends.mps.is_available():
+                num_episodes = 1000
+            else:
+                num_episodes = 50
+
+        model_state = {key : value.cpu() for key, value in self.model.state_dict().items()}
+        bounds = np.linspace(0, num_episodes, num_workers + 1).astype(int).tolist()
+        jobs = [(model_state, self.env.config(), player_type, end - start, seed + start, batch_size)
+                for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+        with mp.Pool(len(jobs)) as pool:
+            for stats in pool.starmap(_eval_worker, jobs):
+                self.merge(stats)
+
+        if display:
+            self.display()
 
-            for i in range(5):
-                for j in range(i + 1):
-                    cards = (j, i)
-                    print(f"{', '.join(list(CARD_NAMES[k] for k in cards))}: {round(100 * self.games_by_start_hand[cards][1] / self.games_by_start_hand[cards][0], 1)}%")
-        
         return self.games_won / self.games_played
 
+    def stats(self) -> dict[str, Any]:
+        """The statistics gathered so far, in the form accepted by merge."""
+        return {'games_played' : self.games_played, 'games_won' : self.games_won, 'games_by_start_hand' : self.games_by_start_hand}
+
+    def merge(self, stats: dict[str, Any]) -> None:
+        """Adds the statistics of another Evaluator (see stats) to this one."""
+        self.games_played += stats['games_played']
+        self.games_won += stats['games_won']
+        for cards, (played, won) in stats['games_by_start_hand'].items():
+            self.games_by_start_hand[cards][0] += played
+            self.games_by_start_hand[cards][1] += won
+
+    def record_game(self, start_cards: tuple[int, int], won: bool) -> None:
+        self.games_played += 1
+        self.games_by_start_hand[start_cards][0] += 1
+        if won:
+            self.games_won += 1
+            self.games_by_start_hand[start_cards][1] += 1
+
+    def display(self, confidence: float | None = None) -> None:
+        """Prints the win rates, along with their Wilson intervals if a confidence level is given."""
+        def rate(won: int, played: int) -> str:
+            if played == 0:
+                return "no games"
+            text = f"{round(100 * won / played, 1)}%"
+            if confidence is not None:
+                low, high = wilson_interval(won, played, confidence)
+                text += f" [{round(100 * low, 1)}%, {round(100 * high, 1)}%]"
+            return text
+
+        print(f"win rate: {rate(self.games_won, self.games_played)}")
+        print("win rate by starting hand: ")
+
+        for i in range(5):
+            for j in range(i + 1):
+                cards = (j, i)
+                print(f"{', '.join(list(CARD_NAMES[k] for k in cards))}: {rate(*reversed(self.games_by_start_hand[cards]))}")
+
+def _eval_worker(model_state: dict[str, torch.Tensor], env_config: dict[str, Any], player_type: str, num_episodes: int,
+                 seed: int, batch_size: int) -> dict[str, Any]:
+    torch.set_num_threads(1)
+
+    env = Coup(**env_config)
+    model = DQN(env.observation_space.shape[0], env.action_space.shape[0])
+    model.load_state_dict(model_state)
+    model.eval()
+
+    evaluator = Evaluator(env, model)
+    evaluator.eval(num_episodes, player_type, display=False, batch_size=batch_size, seed=seed)
+    return evaluator.stats()
+
 def main():
     parser = ArgumentParser(description='Evaluate a Deep Q-learning agent for Coup.')
     parser.add_argument('--player_count', '-n', type=int, default=2, help='the number of players')
-    parser.add_argument('--player_type', '-p', type=str, default="g", help='the type of players to evaluate against: r(andom), g(reedy), h(euristic)')
+    parser.add_argument('--player_type', '-p', type=str, default="g", help='the type of players to evaluate against: r(andom), g(reedy), h(euristic), p(irate), m(cts)')
     parser.add_argument('--num_episodes', '-e', type=int, default=-1, help='the number of episodes for evaluation')
     parser.add_argument('--model_path', '-m', type=str, help='the path to the model to be evaluated')
+    parser.add_argument('--batch_size', '-b', type=int, default=64, help='the number of games played at once')
+    parser.add_argument('--num_workers', '-w', type=int, default=0, help='the number of evaluation processes (0 evaluates in this process)')
+    parser.add_argument('--seed', '-s', type=int, default=0, help='the seed of the first game (game k is played with seed + k)')
+    parser.add_argument('--compare_path', type=str, default=None, help='the path to a second model to compare against on paired games')
+    parser.add_argument('--half_width', type=float, default=None, help='play until the win rate interval is this tight (at most num_episodes games)')
+    parser.add_argument('--target', type=float, default=None, help='with --half_width, also stop once the win rate interval excludes this rate')
 
 
     args = parser.parse_args()
@@ -129,7 +376,19 @@ def main():
 
     evaluator = Evaluator(env, model)
 
-    evaluator.eval(args.num_episodes, args.player_type)
+    if args.compare_path is not None:
+        other: DQN = DQN(env.observation_space.shape[0], env.action_space.shape[0])
+        other.load_state_dict(torch.load(args.compare_path))
+        other.eval()
+        games_per_hand = max(1, args.num_episodes // len(START_HANDS)) if args.num_episodes > 0 else 20
+        evaluator.eval_paired(other, games_per_hand, args.player_type, seed=args.seed)
+    elif args.half_width is not None:
+        evaluator.eval_sequential(args.num_episodes if args.num_episodes > 0 else 1000, args.player_type, batch_size=args.batch_size,
+                                  half_width=args.half_width, target=args.target)
+    elif args.num_workers > 0:
+        evaluator.eval_parallel(args.num_episodes, args.player_type, num_workers=args.num_workers, seed=args.seed, batch_size=args.batch_size)
+    else:
+        evaluator.eval(args.num_episodes, args.player_type, batch_size=args.batch_size)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import torch
+
+from coup.coup import Coup
+from coup.player import make_players
+from coup.vec_coup import VecCoup
+
+
+REWARD_HYPERPARAMETERS: list[float] = [0.1, -0.05, 1, -0.5, 20]
+
+
+class ParallelRollout:
+    """
+    Steps num_workers * envs_per_worker games of Coup spread over a pool of worker processes.
+
+    Every worker runs a VecCoup of envs_per_worker games against player_type opponents (see make_players), with game i
+    reset from seed + i (game i draws everything, its agent's seat included, from its own generator, so the rollouts only
+    depend on seed), and writes its rows of the observation, reward, done, mask and action arrays straight into shared
+    memory. The games are built from the given Coup constructor arguments, so **env.config() rolls out games like env's
+    (see Coup.config). The main process reads those arrays as (num_envs, ...) NumPy views, so each tick costs one batched
+    forward pass for all games and a single small message per worker.
+
+    Games are reset automatically when they finish; the observation and legal-action mask a finished game ended on are kept
+    in final_observations and final_action_masks.
+    All of the returned arrays are views of shared memory that are overwritten by the next call to step.
+    """
+
+    def __init__(self, num_workers: int, player_count: int, player_type: str = "g", envs_per_worker: int = 1,
+                 seed: int = 0, round_cap: int = 100, history_length: int = 10, mask_observation: bool = False, track_beliefs: bool = False) -> None:
+        self.num_workers: int = num_workers
+        self.envs_per_worker: int = envs_per_worker
+        self.num_envs: int = num_workers * envs_per_worker
+
+        env = Coup(player_count, round_cap, history_length, mask_observation, track_beliefs=track_beliefs)
+        env_config = env.config()
+        self.observation_dim: int = env.observation_space.shape[0]
+        self.action_dim: int = env.action_space.shape[0]
+
+        # name -> (shape, dtype) of every shared array
+        self.layout: dict[str, tuple[tuple[int, ...], Any]] = {
+            'q_values' : ((self.num_envs, self.action_dim), np.float32),
+            'observations' : ((self.num_envs, self.observation_dim), np.float32),
+            'final_observations' : ((self.num_envs, self.observation_dim), np.float32),
+            'action_masks' : ((self.num_envs, self.action_dim), np.bool_),
+            'final_action_masks' : ((self.num_envs, self.action_dim), np.bool_),
+            'actions' : ((self.num_envs,), np.int64),
+            'rewards' : ((self.num_envs,), np.float32),
+            'terminated' : ((self.num_envs,), np.bool_),
+            'truncated' : ((self.num_envs,), np.bool_),
+        }
+        self.shared_memory: dict[str, SharedMemory] = {}
+        for name, (shape, dtype) in self.layout.items():
+            self.shared_memory[name] = SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=self.shared_memory[name].buf))
+            getattr(self, name)[:] = 0
+
+        shared_names = {name : shm.name for name, shm in self.shared_memory.items()}
+        self.connections: list[Connection] = []
+        self.processes: list[mp.Process] = []
+        for worker_idx in range(num_workers):
+            parent_conn, child_conn = mp.Pipe()
+            args = (worker_idx, child_conn, shared_names, self.layout, env_config, player_type, envs_per_worker, seed)
+            process = mp.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+    def reset(self) -> tuple[np.ndarray[np.float32], np.ndarray[bool]]:
+        """Resets every game. Returns the observations and legal-action masks."""
+        self._run('reset')
+        return self.observations, self.action_masks
+
+    def step(self, q_values: torch.Tensor | np.ndarray) -> tuple[np.ndarray[np.float32], np.ndarray[np.float32], np.ndarray[bool], np.ndarray[bool], np.ndarray[np.int64]]:
+        """
+        Advances every game by one agent decision. q_values is a (num_envs, action_dim) batch of Q-values.
+
+        Returns (observations, rewards, terminated, truncated, actions), where actions holds the index of the move each game
+        decoded from its Q-values; action_masks, final_observations and final_action_masks are updated as well.
+        """
+        if isinstance(q_values, torch.Tensor):
+            q_values = q_values.detach().cpu().numpy()
+        self.q_values[:] = q_values
+        self._run('step')
+        return self.observations, self.rewards, self.terminated, self.truncated, self.actions
+
+    def close(self) -> None:
+        for conn in self.connections:
+            conn.send('close')
+        for process in self.processes:
+            process.join()
+        for shm in self.shared_memory.values():
+            shm.close()
+            shm.unlink()
+        self.connections, self.processes, self.shared_memory = [], [], {}
+
+    def __enter__(self) -> 'ParallelRollout':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _run(self, command: str) -> None:
+        for conn in self.connections:
+            conn.send(command)
+        for conn in self.connections:
+            conn.recv()
+
+
+def _worker(worker_idx: int, conn: Connection, shared_names: dict[str, str], layout: dict[str, tuple[tuple[int, ...], Any]],
+            env_config: dict[str, Any], player_type: str, envs_per_worker: int, seed: int) -> None:
+    shared_memory = {name : SharedMemory(name=shm_name) for name, shm_name in shared_names.items()}
+    rows = slice(worker_idx * envs_per_worker, (worker_idx + 1) * envs_per_worker)
+    arrays = {name : np.ndarray(shape, dtype=dtype, buffer=shared_memory[name].buf)[rows] for name, (shape, dtype) in layout.items()}
+
+    player_count = env_config['player_count']
+
+    # the agent's seat is left to the game, which draws it from its own generator (see Coup.reset)
+    def make_options() -> dict[str, Any]:
+        return {'players' : make_players(player_type, player_count), 'reward_hyperparameters' : REWARD_HYPERPARAMETERS}
+
+    # the games write their observations straight into their rows of the shared array
+    envs = VecCoup(envs_per_worker, **env_config, make_options=make_options, observations=arrays['observations'])
+
+    while True:
+        command = conn.recv()
+        if command == 'reset':
+            envs.reset(seed=seed + worker_idx * envs_per_worker)
+        elif command == 'step':
+            _, rewards, terminated, truncated, infos = envs.step(arrays['q_values'])
+            arrays['rewards'][:] = rewards
+            arrays['terminated'][:] = terminated
+            arrays['truncated'][:] = truncated
+            for i, info in enumerate(infos):
+                if 'final_info' in info:
+                    arrays['final_observations'][i] = info['final_observation']
+                    info = info['final_info']
+                    arrays['final_action_masks'][i] = info['action_mask']
+                arrays['actions'][i] = info['action']
+        else:
+            break
+        arrays['action_masks'][:] = envs.action_masks
+        conn.send(None)
+
+    del arrays
+    for shm in shared_memory.values():
+        shm.close()
+    conn.close()
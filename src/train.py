@@ -13,11 +13,13 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 
-from agent import Transition, ReplayBuffer, DQN
+from agent import ReplayBuffer, PrioritizedReplayBuffer, TargetUpdater, Transition, DQN
 from coup.coup import Coup
-from coup.player import GreedyPlayer, HeuristicPlayer, RandomPlayer
+from coup.player import make_players
 
+from dataset import OfflineDataset
 from eval import Evaluator
+from rollout import ParallelRollout
 
 
 class Trainer:
@@ -29,12 +31,20 @@ class Trainer:
     # EPS_END is the final value of epsilon
     # EPS_DECAY controls the rate of exponential decay of epsilon, higher means a slower decay
     # TAU is the update rate of the target network
+    # TARGET_UPDATE is "soft" to blend the target network towards the policy network by TAU or "hard" to copy it
+    # TARGET_UPDATE_FREQ is the number of steps between target network updates
     # LR is the learning rate of the AdamW optimizer
+    # PRIORITIZED selects prioritized experience replay instead of uniform sampling
+    # ALPHA is how strongly the TD errors skew prioritized sampling (0 is uniform)
+    # BETA_START is the initial importance-sampling exponent, annealed linearly to 1 over BETA_STEPS optimization steps
 
     def __init__(self, env: Coup, BATCH_SIZE: int = 128,
                  GAMMA: float = 0.99, EPS_START: float = 0.9, 
                  EPS_END: float = 0.05, EPS_DECAY: float = 1000,
-                 TAU: float = 0.005, LR: float = 1e-4):
+                 TAU: float = 0.005, LR: float = 1e-4,
+                 TARGET_UPDATE: str = "soft", TARGET_UPDATE_FREQ: int = 1,
+                 PRIORITIZED: bool = False, ALPHA: float = 0.6,
+                 BETA_START: float = 0.4, BETA_STEPS: int = 100000):
         
         self.env: Coup = env
         self.state_size: int = env.observation_space.shape[0]
@@ -47,17 +57,25 @@ class Trainer:
         self.eps_decay: float = EPS_DECAY
         self.tau: float = TAU
         self.lr: float = LR
+        self.prioritized: bool = PRIORITIZED
+        self.beta_start: float = BETA_START
+        self.beta_steps: int = BETA_STEPS
 
         self.device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
 
         self.policy_net: DQN = DQN(self.state_size, self.action_count).to(self.device)
         self.target_net: DQN = DQN(self.state_size, self.action_count).to(self.device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
+        self.target_updater: TargetUpdater = TargetUpdater(self.policy_net, self.target_net, TARGET_UPDATE, TAU, TARGET_UPDATE_FREQ)
 
         self.optimizer = optim.AdamW(self.policy_net.parameters(), lr=LR, amsgrad=True)
-        self.memory: ReplayBuffer = ReplayBuffer(10000)
+        if self.prioritized:
+            self.memory: ReplayBuffer = PrioritizedReplayBuffer(10000, self.state_size, self.action_count, self.device, alpha=ALPHA)
+        else:
+            self.memory: ReplayBuffer = ReplayBuffer(10000, self.state_size, self.action_count, self.device)
 
         self.steps_done: int = 0
+        self.optimize_steps: int = 0
 
         self.episode_durations = []
         self.episode_rewards = []
@@ -76,6 +94,17 @@ class Trainer:
         else:
             return torch.tensor(self.env.action_space.sample(), device=self.device, dtype=torch.float32)
         
+    def get_policy_actions(self, states: torch.Tensor) -> torch.Tensor:
+        """Batched get_policy_action: one forward pass for every row of states, with an independent epsilon draw per row."""
+        batch_size = states.shape[0]
+        eps_threshold = self.eps_end + (self.eps_start - self.eps_end) * math.exp(-1. * self.steps_done / self.eps_decay)
+        self.steps_done += batch_size
+        with torch.no_grad():
+            actions = self.policy_net(states)
+        explore = torch.rand(batch_size, device=self.device) <= eps_threshold
+        actions[explore] = torch.rand((int(explore.sum()), self.action_count), device=self.device)
+        return actions
+
     def plot_durations(self, show_result: bool = False) -> None:
         plt.figure(1)
         durations_t = torch.tensor(self.episode_durations, dtype=torch.float)
@@ -114,24 +143,22 @@ class Trainer:
 
         plt.pause(0.001)  # pause a bit so that plots are updated
 
-    def optimize_model(self):
-        if len(self.memory) < self.batch_size:
-            return
-        transitions = self.memory.sample(self.batch_size)
-
-        # Transpose the batch
-        batch = Transition(*zip(*transitions))
-
-        # Compute a mask of non-final states and concatenate the batch elements
-        # (a final state would've been the one after which simulation ended)
-        non_final_mask = torch.tensor(tuple(map(lambda s: s is not None,
-                                            batch.next_state)), device=self.device, dtype=torch.bool)
-        non_final_next_states = torch.cat([s for s in batch.next_state
-                                                    if s is not None])
-        state_batch = torch.cat(batch.state)
-        action_batch = torch.cat(batch.action)
-        action_batch = action_batch.argmax(dim=1).view(state_batch.shape[0], 1)
-        reward_batch = torch.cat(batch.reward)
+    def optimize_model(self, batch: Transition | None = None):
+        """Runs one optimization step on batch, or on a sample of the replay buffer if batch is None."""
+        prioritized = self.prioritized and batch is None
+        if batch is None:
+            if len(self.memory) < self.batch_size:
+                return
+            if prioritized:
+                beta = min(1.0, self.beta_start + (1 - self.beta_start) * self.optimize_steps / self.beta_steps)
+                batch, weights, idxs = self.memory.sample(self.batch_size, beta)
+            else:
+                batch = self.memory.sample(self.batch_size)
+        self.optimize_steps += 1
+
+        state_batch = batch.state
+        action_batch = batch.action.unsqueeze(1)
+        reward_batch = batch.reward
 
         # Compute Q(s_t, a) - the model computes Q(s_t), then we select the
         # columns of actions taken. These are the actions which would've been taken
@@ -139,20 +166,25 @@ class Trainer:
         state_action_values = self.policy_net(state_batch).gather(1, action_batch)
 
         # Compute V(s_{t+1}) for all next states.
-        # Expected values of actions for non_final_next_states are computed based
-        # on the "older" target_net; selecting their best reward with max(1).values
-        # This is merged based on the mask, such that we'll have either the expected
+        # Expected values of actions for the next states are computed based
+        # on the "older" target_net; selecting their best legal reward with max(1).values
+        # This is merged based on the done flags, such that we'll have either the expected
         # state value or 0 in case the state was final.
-        next_state_values = torch.zeros(self.batch_size, device=self.device)
         with torch.no_grad():
-            next_state_values[non_final_mask] = self.target_net(non_final_next_states).max(1).values
+            next_q_values = self.target_net(batch.next_state).masked_fill(~batch.next_mask, -float('inf'))
+            next_state_values = torch.where(batch.done, 0.0, next_q_values.max(1).values)
 
         # Compute the expected Q values
         expected_state_action_values = (next_state_values * self.gamma) + reward_batch
 
-        # Compute Huber loss
-        criterion = nn.SmoothL1Loss()
-        loss = criterion(state_action_values.squeeze(1), expected_state_action_values)
+        # Compute Huber loss (weighted by the importance-sampling weights with prioritized replay)
+        if prioritized:
+            td_errors = state_action_values.squeeze(1) - expected_state_action_values
+            loss = (weights * F.smooth_l1_loss(state_action_values.squeeze(1), expected_state_action_values, reduction='none')).mean()
+            self.memory.update_priorities(idxs, td_errors)
+        else:
+            criterion = nn.SmoothL1Loss()
+            loss = criterion(state_action_values.squeeze(1), expected_state_action_values)
 
         # Optimize the model
         self.optimizer.zero_grad()
@@ -169,39 +201,29 @@ class Trainer:
                 num_episodes = 50
 
         eval_freq = int(num_episodes / 25)
+        observations = torch.zeros((2, self.state_size), dtype=torch.float32)
 
         for i in range(num_episodes):
 
-            match player_type:
-                case "g":
-                    players = [GreedyPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-                case "r":
-                    players = [RandomPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-                case "h":
-                    players = [HeuristicPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-                case _:
-                    players = [GreedyPlayer(f"Player {i+1}") for i in range(self.env.player_count)]
-
-            options = {'players' : players, 'agent_idx' : random.choice(list(range(self.env.player_count))), 'reward_hyperparameters' : [0.1, -0.05, 1, -0.5, 20]}
-
-            # Initialize the environment and get its state
-            state, _ = self.env.reset(options=options)
-            state = torch.tensor(state, dtype=torch.float32, device=self.device).unsqueeze(0)
+            players = make_players(player_type, self.env.player_count)
+
+            # the agent's seat is drawn from the env's generator (see Coup.reset)
+            options = {'players' : players, 'reward_hyperparameters' : [0.1, -0.05, 1, -0.5, 20]}
+
+            # Initialize the environment and get its state; the env writes its observations straight into the rows of
+            # observations, alternating between the two so that a transition's state and next state don't overlap
+            self.env.set_observation_buffer(observations[0])
+            self.env.reset(options=options)
+            state = observations[0:1].to(self.device)
             for t in count():
                 action = self.get_policy_action(state)
-                observation, reward, terminated, truncated, info = self.env.step(action)
-                reward = torch.tensor([reward], device=self.device)
+                self.env.set_observation_buffer(observations[(t + 1) % 2])
+                _, reward, terminated, truncated, info = self.env.step(action)
                 done = terminated or truncated
+                next_state = observations[(t + 1) % 2:(t + 1) % 2 + 1].to(self.device)
 
-                if terminated:
-                    next_state = None
-                else:
-                    next_state = torch.tensor(observation, dtype=torch.float32, device=self.device).unsqueeze(0)
-                
-                action = torch.zeros_like(action, dtype=torch.int64)
-                action[info['action']] = 1
                 # Store the transition in memory
-                self.memory.push(state, action.unsqueeze(0), next_state, reward)
+                self.memory.push(state, info['action'], next_state, reward, info['action_mask'], terminated)
 
                 # Move to the next state
                 state = next_state
@@ -209,32 +231,100 @@ class Trainer:
                 # Perform one step of the optimization (on the policy network)
                 self.optimize_model()
 
-                # Soft update of the target network's weights
-                target_net_state_dict = self.target_net.state_dict()
-                policy_net_state_dict = self.policy_net.state_dict()
-                for key in policy_net_state_dict:
-                    target_net_state_dict[key] = policy_net_state_dict[key] * self.tau + target_net_state_dict[key] * (1 - self.tau)
-                self.target_net.load_state_dict(target_net_state_dict)
+                # Update of the target network's weights
+                self.target_updater.step()
 
                 if done:
                     self.episode_durations.append(t + 1)
-                    self.episode_rewards.append(reward.item())
+                    self.episode_rewards.append(reward)
                     # self.plot_rewards()
                     # self.plot_durations()
                     break
+            self.env.set_observation_buffer(None)
             
             if i % eval_freq == 0:
                 print(i)
                 evaluator = Evaluator(self.env, self.policy_net)
 
-                self.win_rates.append(evaluator.eval(num_episodes=200, player_type=player_type, display=False))
+                self.win_rates.append(evaluator.eval_sequential(max_episodes=200, player_type=player_type, display=False, half_width=0.05))
 
+        self.finish_training(num_episodes, player_type, eval_freq)
+
+    def train_parallel(self, num_episodes: int = -1, player_type: str = "g", num_workers: int = 2, envs_per_worker: int = 1, updates_per_tick: int = 1, seed: int = 0):
+        """
+        Trains like train, but collects transitions from num_workers * envs_per_worker games stepped in worker processes
+        (see ParallelRollout). Each tick picks the actions of every game with one batched forward pass, stores one
+        transition per game and then runs updates_per_tick optimization steps.
+        """
+        if num_episodes < 0:
+            if torch.backends.mps.is_available():
+                num_episodes = 1000
+            else:
+                num_episodes = 50
+
+        eval_freq = max(1, int(num_episodes / 25))
+        next_eval = 0
+        episodes = 0
+
+        with ParallelRollout(num_workers, player_type=player_type, envs_per_worker=envs_per_worker, seed=seed, **self.env.config()) as rollout:
+            observations, _ = rollout.reset()
+            states = torch.tensor(observations, dtype=torch.float32, device=self.device)
+            episode_steps = np.zeros((rollout.num_envs,), dtype=np.int64)
+
+            while episodes < num_episodes:
+                actions = self.get_policy_actions(states)
+                observations, rewards, terminated, truncated, action_idxs = rollout.step(actions)
+                next_states = torch.tensor(observations, dtype=torch.float32, device=self.device)
+                episode_steps += 1
+
+                # a truncated game's next state is the observation it ended on, not the first one of the game replacing it
+                next_observations, next_masks = observations.copy(), rollout.action_masks.copy()
+                next_observations[truncated] = rollout.final_observations[truncated]
+                next_masks[truncated] = rollout.final_action_masks[truncated]
+                # Store the transitions in memory
+                self.memory.push_batch(states, action_idxs, next_observations, rewards, next_masks, terminated)
+
+                for i in np.flatnonzero(terminated | truncated):
+                    self.episode_durations.append(int(episode_steps[i]))
+                    self.episode_rewards.append(float(rewards[i]))
+                    episode_steps[i] = 0
+                    episodes += 1
+
+                # Move to the next state (finished games have already been reset by the workers)
+                states = next_states
+
+                for _ in range(updates_per_tick):
+                    self.optimize_model()
+
+                # Update of the target network's weights
+                self.target_updater.step()
+
+                while next_eval <= episodes and next_eval < num_episodes:
+                    print(next_eval)
+                    evaluator = Evaluator(self.env, self.policy_net)
+
+                    self.win_rates.append(evaluator.eval_sequential(max_episodes=200, player_type=player_type, display=False, half_width=0.05))
+                    next_eval += eval_freq
+
+        self.finish_training(num_episodes, player_type, eval_freq)
+
+    def pretrain(self, dataset: OfflineDataset, num_updates: int) -> None:
+        """Runs num_updates optimization steps on shuffled minibatches of recorded games (see OfflineDataset)."""
+        batches = dataset.batches(self.batch_size, epochs=None)
+        for _ in range(num_updates):
+            self.optimize_model(next(batches))
+            self.target_updater.step()
+        print(f"{num_updates} offline updates on {len(dataset)} recorded games")
+
+    def finish_training(self, num_episodes: int, player_type: str, eval_freq: int) -> None:
+        """Plots the win rates recorded during training and saves the model."""
         print('Complete')
+        print(f"{self.target_updater.update_count} target network updates, {self.target_updater.mean_update_time() * 1e6:.1f} us per update")
         # self.plot_durations(show_result=True)
         # self.plot_rewards(show_result=True)
 
         plt.plot([x * eval_freq + 1 for x in list(range(len(self.win_rates)))], self.win_rates, label="agent win rate")
-        plt.plot([x * eval_freq + 1 for x in list(range(len(self.win_rates)))], [1 / len(self.env.players) for _ in range(len(self.win_rates))], label="expected win rate", linestyle='dashed')
+        plt.plot([x * eval_freq + 1 for x in list(range(len(self.win_rates)))], [1 / self.env.player_count for _ in range(len(self.win_rates))], label="expected win rate", linestyle='dashed')
         plt.legend()
         plt.title('Q-Learning win rate over time')
         plt.ylabel('win rate')
@@ -251,15 +341,31 @@ class Trainer:
 def main():
     parser = ArgumentParser(description='Train a Deep Q-learning agent for Coup.')
     parser.add_argument('--player_count', '-n', type=int, default=2, help='the number of players')
-    parser.add_argument('--player_type', '-p', type=str, default="g", help='the type of players to train against: r(andom), g(reedy), h(euristic)')
+    parser.add_argument('--player_type', '-p', type=str, default="g", help='the type of players to train against: r(andom), g(reedy), h(euristic), p(irate), m(cts)')
     parser.add_argument('--num_episodes', '-e', type=int, default=-1, help='the number of episodes for training')
+    parser.add_argument('--num_workers', '-w', type=int, default=0, help='the number of rollout worker processes (0 trains in this process)')
+    parser.add_argument('--envs_per_worker', type=int, default=1, help='the number of games each rollout worker steps')
+    parser.add_argument('--prioritized', action='store_true', help='sample the replay buffer by TD error')
+    parser.add_argument('--target_update', type=str, default="soft", help='how the target network follows the policy network: soft or hard')
+    parser.add_argument('--target_update_freq', type=int, default=1, help='the number of steps between target network updates')
+    parser.add_argument('--offline_path', type=str, default=None, help='a directory of recorded games to pretrain on before training')
+    parser.add_argument('--offline_updates', type=int, default=10000, help='the number of optimization steps on the recorded games')
+    parser.add_argument('--offline_seats', type=str, default="all", help='whose decisions to learn from: all, agent or bots')
 
     args = parser.parse_args()
     env = Coup(args.player_count)
 
-    trainer = Trainer(env, EPS_DECAY=args.num_episodes)
+    trainer = Trainer(env, EPS_DECAY=args.num_episodes, PRIORITIZED=args.prioritized,
+                      TARGET_UPDATE=args.target_update, TARGET_UPDATE_FREQ=args.target_update_freq)
+
+    if args.offline_path is not None:
+        dataset = OfflineDataset(args.offline_path, args.player_count, env.history_length, env.mask_observation, args.offline_seats, device=trainer.device)
+        trainer.pretrain(dataset, args.offline_updates)
 
-    trainer.train(args.num_episodes, args.player_type)
+    if args.num_workers > 0:
+        trainer.train_parallel(args.num_episodes, args.player_type, args.num_workers, args.envs_per_worker)
+    else:
+        trainer.train(args.num_episodes, args.player_type)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import os
+import sys
+from typing import Callable, Iterator
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from coup.coup import Coup
+
+
+def _play(env: Coup, seed: int) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    rng = np.random.default_rng(seed)
+    observation, info = env.reset(seed=seed)
+    done = False
+    while not done:
+        mask = info['action_mask']
+        yield observation, mask
+        action = np.zeros(mask.shape, dtype=np.float32)
+        action[rng.choice(np.flatnonzero(mask))] = 1
+        observation, _, terminated, truncated, info = env.step(action)
+        done = terminated or truncated
+
+
+@pytest.fixture
+def play() -> Callable[[Coup, int], Iterator[tuple[np.ndarray, np.ndarray]]]:
+    """
+    Plays the game of env reset with seed, with an agent picking uniformly among its legal actions, and yields the
+    observation and action mask before each of the agent's decisions.
+    """
+    return _play
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from coup.coup import Coup
+from coup.encoding import DISCARD_PAIRS
+from coup.representations import Action
+from coup.utils import *
+
+
+def reference_mask(env: Coup) -> np.ndarray:
+    """The actions the old decoder would accept in the current phase, found from the engine's lists of legal moves."""
+    gs = env.game_state
+    n = env.player_count
+    agent = env.agent_idx
+    name = gs.names[agent]
+    mask = np.zeros((14 + 3 * n,), dtype=bool)
+    if not gs.is_alive(agent) or gs.alive_count() == 1:
+        return mask
+
+    if env.phase == ACTION_PHASE:
+        others = [other for other in gs.names if other != name]
+        for action in generate_valid_actions(gs):
+            mask[action.type if action.type < 4 else 4 + (action.type - 4) * (n - 1) + others.index(action.target_player)] = True
+    elif env.phase == COUNTER_1_PHASE:
+        for counter in generate_valid_counters(name, env.current_action):
+            mask[1 + 3 * n + (0 if not counter.attempted else 1 if counter.challenge else 2)] = True
+    elif env.phase == COUNTER_2_PHASE:
+        counter_1 = env.current_counter_1
+        for counter in generate_valid_counters(name, Action(counter_1.active_player, name, -2 if counter_1.challenge else -1)):
+            mask[4 + 3 * n + counter.attempted] = True
+    elif env.phase == DISCARD_PHASE:
+        mask[6 + 3 * n] = True
+        mask[7 + 3 * n] = len(gs.player_cards[name]) == 2
+    elif env.phase == DISCARD_PAIR_PHASE:
+        # any 2 of the cards held once the exchange has drawn
+        held = len(gs.player_cards[name])
+        for k, (i, j) in enumerate(DISCARD_PAIRS):
+            mask[8 + 3 * n + k] = j < held
+    return mask
+
+
+@pytest.mark.parametrize("player_count", [2, 3, 4, 6])
+def test_masks_match_legal_moves(play, player_count):
+    env = Coup(player_count)
+    exchange_hands = set()
+    for seed in range(100):
+        for _, mask in play(env, seed):
+            assert mask.any()
+            np.testing.assert_array_equal(mask, reference_mask(env))
+            if env.phase == DISCARD_PAIR_PHASE:
+                exchange_hands.add(env.game_state.hand_sizes[env.agent_idx])
+        # the game is over for the agent, which has nothing left to choose
+        assert not env.action_mask.any()
+    # exchanges were made with both 1 and 2 cards in hand
+    assert exchange_hands == {3, 4}
+
+
+def test_decoding_picks_best_legal_action(play):
+    env = Coup(4)
+    rng = np.random.default_rng(0)
+    for seed in range(20):
+        env.reset(seed=seed)
+        done = False
+        while not done:
+            mask = env.action_mask
+            scores = rng.standard_normal(mask.shape).astype(np.float32)
+            expected = int(np.flatnonzero(mask)[np.argmax(scores[mask])])
+            _, _, terminated, truncated, info = env.step(scores)
+            assert info['action'] == expected
+            done = terminated or truncated
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from coup.coup import Coup
+from coup.recorder import GameRecorder
+from dataset import OfflineDataset
+
+
+def play_recorded(env: Coup, seed: int) -> list[tuple[np.ndarray, ...]]:
+    """
+    Plays the game of env reset with seed with a random legal agent, and returns its transitions (state, action,
+    next_state, reward, next_mask, done) as the dataset would rebuild them.
+    """
+    rng = np.random.default_rng(seed)
+    observation, info = env.reset(seed=seed)
+    transitions = []
+    done = False
+    while not done:
+        mask = info['action_mask']
+        action = np.zeros(mask.shape, dtype=np.float32)
+        action[rng.choice(np.flatnonzero(mask))] = 1
+        state = observation.copy()
+        observation, reward, terminated, truncated, info = env.step(action)
+        transitions.append((state, info['action'], observation.copy(), reward, info['action_mask'].copy(), terminated))
+        done = terminated or truncated
+    if not terminated:
+        # the agent's next state is unknown when the game is cut short
+        transitions.pop()
+    return transitions
+
+
+@pytest.mark.parametrize("player_count", [2, 3, 5])
+@pytest.mark.parametrize("mask_observation", [False, True])
+def test_dataset_rebuilds_live_transitions(tmp_path, player_count, mask_observation):
+    expected = []
+    with GameRecorder(str(tmp_path), chunk_records=512) as recorder:
+        env = Coup(player_count, round_cap=30, history_length=4, mask_observation=mask_observation, recorder=recorder)
+        for seed in range(30):
+            expected.extend(play_recorded(env, seed))
+
+    dataset = OfflineDataset(str(tmp_path), player_count, history_length=4, mask_observation=mask_observation, seats="agent")
+    assert len(dataset) == 30
+    states, actions, next_states, rewards, next_masks, dones = dataset.build(np.arange(len(dataset)))
+    assert len(states) == len(expected)
+    for k, (state, action, next_state, reward, next_mask, done) in enumerate(expected):
+        np.testing.assert_array_equal(states[k], state)
+        assert actions[k] == action
+        np.testing.assert_array_equal(next_states[k], next_state)
+        assert rewards[k] == pytest.approx(reward, abs=1e-5)
+        np.testing.assert_array_equal(next_masks[k], next_mask)
+        assert dones[k] == done
+
+
+def test_bot_decisions_are_legal(tmp_path):
+    with GameRecorder(str(tmp_path)) as recorder:
+        env = Coup(4, recorder=recorder)
+        env.reset(seed=0)
+        list(env.simulate_games(env.players, 50, seed=1))
+
+    # with mask_observation, the observation of every decision ends with its action mask
+    dataset = OfflineDataset(str(tmp_path), 4, mask_observation=True, seats="bots")
+    states, actions, _, _, _, _ = dataset.build(np.arange(len(dataset)))
+    assert len(actions) > 0
+    masks = states[:, -dataset.action_count:].astype(bool)
+    assert masks[np.arange(len(actions)), actions].all()
@@ -0,0 +1,32 @@
+import pytest
+import torch
+
+from agent import DQN
+from coup.coup import Coup
+from eval import Evaluator
+
+
+def make_evaluator(env: Coup) -> Evaluator:
+    torch.manual_seed(0)
+    return Evaluator(env, DQN(env.observation_space.shape[0], env.action_space.shape[0]))
+
+
+@pytest.mark.parametrize("mask_observation", [False, True])
+def test_batched_games_match_lone_games(mask_observation):
+    lone = make_evaluator(Coup(3, mask_observation=mask_observation))
+    lone.eval(12, "h", display=False, batch_size=1, seed=0)
+    batched = make_evaluator(Coup(3, mask_observation=mask_observation))
+    batched.eval(12, "h", display=False, batch_size=4, seed=0)
+
+    assert all(env.config() == batched.env.config() for env in batched.extra_envs)
+    assert batched.stats() == lone.stats()
+
+
+def test_parallel_workers_match_evaluator():
+    env = Coup(3, mask_observation=True)
+    evaluator = make_evaluator(env)
+    evaluator.eval(8, "h", display=False, batch_size=4, seed=0)
+    parallel = make_evaluator(Coup(3, mask_observation=True))
+    parallel.eval_parallel(8, "h", display=False, num_workers=2, seed=0, batch_size=4)
+
+    assert parallel.stats() == evaluator.stats()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from coup.coup import Coup
+from coup.representations import Action, Counter, DiscardPair
+
+from test_state import reference_encoding
+
+PAIR_INDEX = {frozenset({0, 1}) : 20, frozenset({0, 2}) : 21, frozenset({0, 3}) : 22,
+              frozenset({1, 2}) : 23, frozenset({1, 3}) : 24, frozenset({2, 3}) : 25}
+
+
+def encode_action(action: Action, names: tuple[str, ...], n: int) -> np.ndarray:
+    encoding = np.zeros((4 + 4 * n,))
+    encoding[names.index(action.active_player)] = 1
+    if action.type < 4:
+        encoding[n + action.type] = 1
+    else:
+        encoding[(action.type - 3) * n + 4 + names.index(action.target_player)] = 1
+    return encoding
+
+
+def encode_counter(counter: Counter, names: tuple[str, ...], n: int) -> np.ndarray:
+    if counter.counter_1:
+        encoding = np.zeros((3 + n,))
+        encoding[0 if not counter.attempted else 1 if counter.challenge else 2] = 1
+        if counter.attempted:
+            encoding[3 + names.index(counter.active_player)] = 1
+    else:
+        encoding = np.zeros((2 + n,))
+        encoding[int(counter.attempted)] = 1
+        if counter.attempted:
+            encoding[2 + names.index(counter.active_player)] = 1
+    return encoding
+
+
+def encode_discard_pair(discard_pair: DiscardPair) -> np.ndarray:
+    encoding = np.zeros((26,))
+    for i, card in enumerate(discard_pair.initial_cards):
+        encoding[5 * i + card] = 1
+    encoding[PAIR_INDEX[frozenset(discard_pair.discard_idxs)]] = 1
+    return encoding
+
+
+def reference_observation(env: Coup) -> np.ndarray:
+    """The observation as the engine built it before turns were encoded as they happen: by walking back the history."""
+    gs = env.game_state
+    n = env.player_count
+    names = gs.names
+    event_dim = 35 + 6 * n
+    history = np.zeros((event_dim * env.history_length,))
+    turns = 0
+    turn = np.zeros((event_dim,))
+    for event in reversed(env.history):
+        if turns == env.history_length:
+            break
+        if isinstance(event, Action):
+            turn[0:4 + 4 * n] = encode_action(event, names, n)
+            history[event_dim * turns:event_dim * (turns + 1)] = turn
+            turns += 1
+            turn = np.zeros((event_dim,))
+        elif isinstance(event, Counter):
+            if event.counter_1:
+                turn[4 + 4 * n:7 + 5 * n] = encode_counter(event, names, n)
+            else:
+                turn[7 + 5 * n:9 + 6 * n] = encode_counter(event, names, n)
+        elif isinstance(event, DiscardPair) and event.active_player_idx == env.agent_idx:
+            turn[9 + 6 * n:35 + 6 * n] = encode_discard_pair(event)
+    return np.concatenate((reference_encoding(gs, env.agent_idx, n), history)).astype(np.float32)
+
+
+@pytest.mark.parametrize("player_count", [2, 3, 4, 6])
+@pytest.mark.parametrize("history_length", [3, 10])
+def test_observations_match_history_walk(play, player_count, history_length):
+    env = Coup(player_count, history_length=history_length)
+    for seed in range(20):
+        for observation, _ in play(env, seed):
+            np.testing.assert_array_equal(observation, reference_observation(env))
+
+
+def test_mask_observation_appends_mask(play):
+    env = Coup(3, mask_observation=True)
+    for seed in range(10):
+        for observation, mask in play(env, seed):
+            size = reference_observation(env).shape[0]
+            np.testing.assert_array_equal(observation[:size], reference_observation(env))
+            np.testing.assert_array_equal(observation[size:], mask)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from coup.coup import Coup
+from coup.player import make_players
+from coup.recorder import AGENT_ELIMINATED, GAME, OUTCOME, RECORD_DTYPE, ROUND_CAP, TURN, WON, GameRecorder, chunk_path, read_index
+
+
+def read_games(directory: str) -> list[np.ndarray]:
+    index = read_index(directory)
+    chunks = {chunk : np.fromfile(chunk_path(directory, chunk), dtype=RECORD_DTYPE) for chunk in np.unique(index['chunk'])}
+    return [chunks[chunk][offset:offset + length] for chunk, offset, length in index.tolist()]
+
+
+def test_outcomes_record_why_games_ended(play, tmp_path):
+    expected = []
+    with GameRecorder(str(tmp_path), chunk_records=256, buffer_records=64) as recorder:
+        env = Coup(3, round_cap=12, recorder=recorder)
+        for seed in range(60):
+            for _ in play(env, seed):
+                pass
+            gs = env.game_state
+            # the truncated flag is set past the round cap, even on a turn that leaves a winner
+            truncated = env.round > env.round_cap
+            if gs.alive_count() == 1:
+                expected.append((env.agent_idx, truncated, WON, gs.alive.bit_length() - 1))
+            elif not gs.is_alive(env.agent_idx):
+                expected.append((env.agent_idx, truncated, AGENT_ELIMINATED, -1))
+            else:
+                expected.append((env.agent_idx, truncated, ROUND_CAP, -1))
+
+    games = read_games(str(tmp_path))
+    assert len(games) == len(expected)
+    # the games ended in every way
+    assert {reason for _, _, reason, _ in expected} == {WON, AGENT_ELIMINATED, ROUND_CAP}
+    for records, (agent, truncated, reason, winner) in zip(games, expected):
+        assert records['kind'][0] == GAME and records['kind'][-1] == OUTCOME
+        assert (records['kind'][1:-1] == TURN).all()
+        assert records['data'][0, :2].tolist() == [3, agent]
+        outcome = records[-1]
+        assert outcome['seat'] == winner
+        assert outcome['data'][2] == truncated
+        assert outcome['data'][3] == reason
+
+
+def test_games_among_bots_end_with_a_winner_or_the_round_cap(tmp_path):
+    with GameRecorder(str(tmp_path)) as recorder:
+        env = Coup(4, round_cap=20, recorder=recorder)
+        env.reset(seed=0)
+        outcomes = list(env.simulate_games(env.players, 40, seed=1))
+
+    games = read_games(str(tmp_path))
+    assert len(games) == len(outcomes)
+    for records, outcome in zip(games, outcomes):
+        assert records['data'][0, 1] == -1
+        assert records[-1]['seat'] == outcome.winner
+        assert records[-1]['data'][3] == (ROUND_CAP if outcome.winner < 0 else WON)
+
+
+def test_records_dont_depend_on_where_the_state_is_kept(tmp_path):
+    # greedy bots stall until the round cap, so that games outgrow the block of pending records
+    players = make_players("g", 3)
+    for storage in ("recorder", "arrays"):
+        with GameRecorder(str(tmp_path / storage), chunk_records=2048, buffer_records=64) as recorder:
+            env = Coup(3, round_cap=600, recorder=recorder)
+            if storage == "arrays":
+                env.set_state_storage(None)
+            outcomes = list(env.simulate_games(players, 12, seed=0))
+    assert max(outcome.rounds for outcome in outcomes) > 600
+
+    chunks = np.unique(read_index(str(tmp_path / "recorder"))['chunk'])
+    assert len(chunks) > 1
+    for chunk in chunks:
+        with open(chunk_path(str(tmp_path / "recorder"), chunk), "rb") as f, open(chunk_path(str(tmp_path / "arrays"), chunk), "rb") as g:
+            assert f.read() == g.read()
+    assert (read_index(str(tmp_path / "recorder")) == read_index(str(tmp_path / "arrays"))).all()
+    # the seats past the player count are left empty
+    games = read_games(str(tmp_path / "recorder"))
+    assert len(games) == len(outcomes)
+    assert all((records['hands'][:, 3:] == 0).all() and (records['coins'][:, 3:] == 0).all() for records in games)
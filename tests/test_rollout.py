@@ -0,0 +1,42 @@
+import random
+
+import numpy as np
+
+from coup.coup import Coup
+from rollout import ParallelRollout
+
+
+def test_workers_build_envs_like_the_callers():
+    env = Coup(3, round_cap=40, mask_observation=True)
+    with ParallelRollout(2, player_type="h", envs_per_worker=2, seed=0, **env.config()) as rollout:
+        observations, masks = rollout.reset()
+        assert observations.shape == (4, env.observation_space.shape[0])
+        for _ in range(20):
+            # mask observations end with the mask of the pending decision
+            np.testing.assert_array_equal(observations[:, -env.action_space.shape[0]:], masks)
+            observations, _, _, _, _ = rollout.step(np.random.default_rng(0).standard_normal((4, env.action_space.shape[0])))
+            masks = rollout.action_masks
+
+
+def roll(num_workers: int, envs_per_worker: int, seed: int) -> list[tuple[np.ndarray, ...]]:
+    rng = np.random.default_rng(0)
+    steps = []
+    with ParallelRollout(num_workers, 3, "h", envs_per_worker, seed, round_cap=40) as rollout:
+        observations, masks = rollout.reset()
+        steps.append((observations.copy(), masks.copy()))
+        for _ in range(30):
+            observations, rewards, terminated, truncated, actions = rollout.step(rng.standard_normal((4, rollout.action_dim)))
+            steps.append((observations.copy(), rewards.copy(), terminated.copy(), actions.copy()))
+    return steps
+
+
+def test_rollouts_only_depend_on_seed():
+    random.seed(1)
+    first = roll(2, 2, seed=5)
+    random.seed(2)
+    # game i is reset from seed + i whichever worker steps it
+    second = roll(1, 4, seed=5)
+    assert len(first) == len(second)
+    for a, b in zip(first, second):
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x, y)
@@ -0,0 +1,61 @@
+import copy
+
+import numpy as np
+import pytest
+
+from coup.coup import Coup
+
+
+def play_out(env: Coup, actions: np.ndarray) -> list[tuple]:
+    """Steps env to the end of its game, picking the legal action ranked first by each row of actions, and returns the positions it went through."""
+    trajectory = []
+    done = False
+    for scores in actions:
+        _, reward, terminated, truncated, info = env.step(scores)
+        trajectory.append((env.snapshot().tolist(), info['action'], info['action_mask'].tolist(), reward, terminated, truncated))
+        done = terminated or truncated
+        if done:
+            break
+    assert done
+    return trajectory
+
+
+@pytest.mark.parametrize("player_count", [2, 4, 6])
+def test_restore_replays_identically(player_count):
+    env = Coup(player_count)
+    for seed in range(10):
+        rng = np.random.default_rng(seed)
+        env.reset(seed=seed)
+        # the game forks at a few of the agent's decisions: the rest of it is played out, then played again from there
+        for _ in range(3):
+            snapshot = env.snapshot()
+            # the rng is not part of the snapshot, so the bots replay the same draws only if it is restored as well
+            rng_state = copy.deepcopy(vars(env.game_state.rng))
+            actions = rng.standard_normal((300, env.action_space.shape[0])).astype(np.float32)
+
+            first = play_out(env, actions)
+            env.restore(snapshot)
+            vars(env.game_state.rng).update(copy.deepcopy(rng_state))
+            assert env.snapshot() == snapshot
+            assert play_out(env, actions) == first
+
+            # move the game on by a decision from the forking point for the next fork
+            env.restore(snapshot)
+            vars(env.game_state.rng).update(copy.deepcopy(rng_state))
+            _, _, terminated, truncated, _ = env.step(actions[0])
+            if terminated or truncated:
+                break
+
+
+def test_restore_brings_back_state_fields():
+    env = Coup(3)
+    env.reset(seed=3)
+    gs = env.game_state
+    snapshot = env.snapshot()
+    fields = (gs.coins.tolist(), gs.hands.tolist(), gs.hand_sizes.tolist(), gs.discards.tolist(), gs.discard_counts.tolist(),
+              gs.deck.tolist(), gs.alive, gs.current, env.phase, env.round)
+    rng = np.random.default_rng(0)
+    play_out(env, rng.standard_normal((300, env.action_space.shape[0])).astype(np.float32))
+    env.restore(snapshot)
+    assert (gs.coins.tolist(), gs.hands.tolist(), gs.hand_sizes.tolist(), gs.discards.tolist(), gs.discard_counts.tolist(),
+            gs.deck.tolist(), gs.alive, gs.current, env.phase, env.round) == fields
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from coup.coup import Coup
+from coup.player import HeuristicPlayer, make_players
+
+
+def reference_encoding(state, idx: int, player_count: int) -> np.ndarray:
+    """The state encoding of the name-keyed State the array-backed one replaced, read through its name-keyed views."""
+    names = state.names
+    our_cards = state.player_cards[names[idx]]
+    encoding = np.zeros((20 + 12 * player_count,), dtype=np.float32)
+    for i, card in enumerate(our_cards):
+        encoding[5 * i + card] = 1
+    for i, name in enumerate(names):
+        encoding[20 + i] = state.player_coins[name] / 12
+        for j, card in enumerate(state.player_discards[name]):
+            encoding[20 + player_count + 10 * i + 5 * j + card] = 1
+    encoding[20 + 11 * player_count + idx] = 1
+    return encoding
+
+
+@pytest.mark.parametrize("player_count", [2, 3, 4, 6])
+def test_encoding_matches_name_keyed_state(play, player_count):
+    env = Coup(player_count)
+    for seed in range(20):
+        for _ in play(env, seed):
+            gs = env.game_state
+            for seat in range(player_count):
+                np.testing.assert_array_equal(gs.encode(seat, player_count), reference_encoding(gs, seat, player_count))
+
+
+def test_views_follow_arrays(play):
+    env = Coup(4)
+    for seed in range(20):
+        for _ in play(env, seed):
+            gs = env.game_state
+            for seat, name in enumerate(gs.names):
+                hand = gs.player_cards[name]
+                assert hand == [card for card in gs.hands[4 * seat:4 * seat + 4] if card >= 0]
+                assert gs.player_discards[name] == [card for card in gs.discards[2 * seat:2 * seat + 2] if card >= 0]
+                assert gs.player_coins[name] == gs.coins[seat]
+                assert gs.is_alive(seat) == (len(hand) > 0)
+            # every role has 3 copies between the hands, the discards and the deck
+            counts = np.bincount([card for card in (*gs.hands, *gs.discards) if card >= 0], minlength=5) + np.array(gs.deck)
+            np.testing.assert_array_equal(counts, [3] * 5)
+
+
+class HistoryReader(HeuristicPlayer):
+    reads_history = True
+
+
+@pytest.mark.parametrize("player_count", [2, 4])
+def test_simulated_games_dont_depend_on_keeping_the_history(player_count):
+    env = Coup(player_count)
+    skipped = list(env.simulate_games(make_players("h", player_count), 50, seed=0))
+    assert env.history == []
+    kept = list(env.simulate_games([HistoryReader(f"Player {i + 1}") for i in range(player_count)], 50, seed=0))
+    assert len(env.history) > 0
+    assert kept == skipped